@@ -1,15 +1,13 @@
 """la_funding_analysis."""
 import logging
-import logging.config
 from pathlib import Path
 from typing import Optional
 
-import yaml
-from dotenv import load_dotenv
-
 
 def get_yaml_config(file_path: Path) -> Optional[dict]:
     """Fetch yaml config and return as dict if it exists."""
+    import yaml
+
     if file_path.exists():
         with open(file_path, "rt") as f:
             return yaml.load(f.read(), Loader=yaml.FullLoader)
@@ -22,18 +20,37 @@ PROJECT_DIR = Path(__file__).resolve().parents[1]
 info_out = str(PROJECT_DIR / "info.log")
 error_out = str(PROJECT_DIR / "errors.log")
 
-# Read log config file
 _log_config_path = Path(__file__).parent.resolve() / "config/logging.yaml"
-_logging_config = get_yaml_config(_log_config_path)
-if _logging_config:
-    logging.config.dictConfig(_logging_config)
+_base_config_path = Path(__file__).parent.resolve() / "config/base.yaml"
 
-# Define module logger
-logger = logging.getLogger(__name__)
 
-# base/global config
-_base_config_path = Path(__file__).parent.resolve() / "config/base.yaml"
-config = get_yaml_config(_base_config_path)
+def _get_logger() -> logging.Logger:
+    """Read log config file and define module logger."""
+    import logging.config
+
+    _logging_config = get_yaml_config(_log_config_path)
+    if _logging_config:
+        logging.config.dictConfig(_logging_config)
+    return logging.getLogger(__name__)
+
+
+def _get_config() -> Optional[dict]:
+    """Read base/global config, and BUCKET and METAFLOW_PROFILE."""
+    from dotenv import load_dotenv
+
+    load_dotenv(f"{PROJECT_DIR}/.env.shared")
+    return get_yaml_config(_base_config_path)
+
+
+# `logger` and `config` are set up on first use rather than on import,
+# so that importing the package (e.g. to show CLI help) stays fast
+_lazy_attributes = {"logger": _get_logger, "config": _get_config}
+
 
-# BUCKET and METAFLOW_PROFILE
-load_dotenv(f"{PROJECT_DIR}/.env.shared")
+def __getattr__(name: str):
+    """Set up and return a lazy module attribute (logger or config)."""
+    if name in _lazy_attributes:
+        value = _lazy_attributes[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
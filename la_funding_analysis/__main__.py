@@ -0,0 +1,5 @@
+"""Allows the CLI to be run with `python -m la_funding_analysis`."""
+
+from la_funding_analysis.cli import app
+
+app(prog_name="la-funding")
@@ -1,114 +1,108 @@
 # File: analysis/generate_plots.py
 """Produces plots and stores them in /outputs/figures.
+The charts are defined by the chart registry in config/base.yaml
+(see pipeline/chart_registry.py), and refer to plotting functions
+(from pipeline/plotters.py) by name so that charts can be listed
+without importing pandas or matplotlib.
 """
 
-from la_funding_analysis.pipeline.joining import form_all_tidy_data
-from la_funding_analysis.pipeline.plotters import (
-    imd_strip_plot,
-    improvable_strip_plot,
-    proportion_by_number_of_grants,
-    stacked_no_members_by_grant_type,
-    dual_bar_by_applicant_type,
-    boxplot_by_receipt_status,
-    fp_clusters_strip_plot,
-    westmids_london_fp_strip_plot,
+from la_funding_analysis.pipeline.chart_registry import (
+    chart_tables,
+    load_chart_registry,
 )
 
-la_data = form_all_tidy_data()
 
+def chart_jobs():
+    """Every chart in the registry as a (plotting function name, arguments,
+    filename without suffix, formats) job. Charts are referred to by
+    their filename.
+    """
+    return [
+        (chart.plot, chart.kwargs, name, chart.formats)
+        for name, chart in load_chart_registry().items()
+    ]
 
-def produce_charts(suffix):
-    """Produces all charts for the analysis with the given suffix (e.g. .png)"""
-    # STACKED BAR CHARTS
-    #
-    stacked_no_members_by_grant_type(
-        data=la_data,
-        factor="region_1",
-        graph_ylabel="Number of grants",
-        graph_title="Number of grants by region for each funding scheme\n(individual authorities and consortium leads only)",
-        filename="final_stack_region" + suffix,
-    )
-    #
-    stacked_no_members_by_grant_type(
-        data=la_data,
-        factor="model",
-        graph_ylabel="Number of grants",
-        graph_title="Number of grants by local authority type\nfor each funding scheme\n(individual authorities and consortium leads only)",
-        filename="final_stack_model" + suffix,
-    )
-    #
-    # PROPORTION PLOTS
-    #
-    proportion_by_number_of_grants(
-        data=la_data,
-        factor="region_1",
-        graph_ylabel="Region (Total LAs)",
-        graph_title="Percentages of local authorities in each region\nreceiving each number of grants\n(including consortium members)",
-        filename="final_prop_region" + suffix,
-    )
-    #
-    proportion_by_number_of_grants(
-        data=la_data,
-        factor="majority",
-        graph_ylabel="Majority party (Total LAs)",
-        graph_title="Percentages of local authorities receiving grants,\nby political composition in August 2021\nand number of grants received",
-        filename="final_prop_majority" + suffix,
-    )
-    #
-    proportion_by_number_of_grants(
-        data=la_data,
-        factor="old_majority",
-        graph_ylabel="Majority party (Total LAs)",
-        graph_title="Percentages of local authorities receiving grants,\nby political composition in August 2020\nand number of grants received",
-        filename="final_prop_old_majority" + suffix,
-    )
-    #
-    # DUAL BAR CHART
-    dual_bar_by_applicant_type(
-        data=la_data,
-        factor="model",
-        graph_ylabel="Type",
-        graph_title="Percentages of local authorities participating\nin GHG LAD and SHDDF by type",
-        filename="final_dual_type" + suffix,
-    )
-    #
-    # BOXPLOT
-    boxplot_by_receipt_status(
-        data=la_data,
-        factor="median_energy_efficiency",
-        graph_ylabel="Median energy efficiency of registered EPCs",
-        graph_title="Median energy efficiency of registered EPCs\nin each local authority vs whether or not they received a grant",
-        filename="final_boxplot_median" + suffix,
-    )
-    #
-    #
-    # STRIP PLOTS
-    #
-    # IMD
-    imd_strip_plot(data=la_data, filename="final_strip_imd" + suffix)
-    #
-    # FP, coloured clusters
-    fp_clusters_strip_plot(data=la_data, filename="final_strip_fp" + suffix)
-    #
-    # FP by region
-    westmids_london_fp_strip_plot(
-        data=la_data, filename="final_strip_fp_regions" + suffix
+
+def chart_names():
+    """Names of all the charts, in the order they are produced."""
+    return [filename for _, _, filename, _ in chart_jobs()]
+
+
+def select_chart_jobs(charts=None):
+    """Chart jobs for the given chart names (default: all charts)."""
+    jobs = chart_jobs()
+    unknown = set(charts or []) - {filename for _, _, filename, _ in jobs}
+    if unknown:
+        raise ValueError(f"Unknown charts: {', '.join(sorted(unknown))}")
+    return [job for job in jobs if not charts or job[2] in charts]
+
+
+def produce_charts(
+    la_data,
+    formats=None,
+    charts=None,
+    processes=None,
+    directory=None,
+    force=False,
+    dry_run=False,
+):
+    """Produces the charts for the analysis, rendering each chart once
+    and saving it in each of its formats from the registry, or in each
+    of formats (e.g. [".png", ".svg"]) if given, in directory
+    (defaults to outputs/figures).
+    charts optionally restricts this to a subset of chart names.
+    Only charts whose files are missing or out of date according to the
+    figure manifest (see pipeline/manifest.py) are rendered, unless force
+    is True. If dry_run is True, nothing is rendered and the charts that
+    would be are returned with the reason.
+    Charts are rendered in parallel processes, and tables shared by
+    several charts are computed once.
+    Returns the render time of each chart rendered.
+    """
+    import pandas as pd
+
+    from la_funding_analysis.pipeline.manifest import record_charts, stale_charts
+    from la_funding_analysis.pipeline.plotters import FIGURES_DIR
+    from la_funding_analysis.pipeline.rendering import render_charts
+
+    directory = directory or FIGURES_DIR
+    jobs = [
+        (plot, kwargs, filename, formats or job_formats)
+        for plot, kwargs, filename, job_formats in select_chart_jobs(charts)
+    ]
+    stale = stale_charts(la_data, jobs, directory, force=force)
+    if dry_run:
+        return pd.DataFrame(
+            [(job[2], reason) for job, _, reason in stale], columns=["chart", "reason"]
+        )
+    timings = render_charts(
+        la_data,
+        [job for job, _, _ in stale],
+        processes=processes,
+        directory=directory,
+        tables=chart_tables([job for job, _, _ in stale]),
     )
-    #
-    # Number of improvable vs SHDDF
-    improvable_strip_plot(
-        data=la_data,
-        factor="total_improvable",
-        filename="final_strip_improvable_count" + suffix,
+    record_charts(directory, [(job, hash) for job, hash, _ in stale])
+    return timings
+
+
+def produce_vegalite_charts(la_data, charts=None, directory=None):
+    """Produces Vega-Lite specs for the charts, plus the shared data file
+    they reference, in directory (defaults to outputs/figures/vegalite).
+    Returns the paths of the files written.
+    """
+    from la_funding_analysis.pipeline.vegalite import (
+        produce_vegalite_specs,
+        VEGALITE_DIR,
     )
-    #
-    # Proportion of improvable vs SHDDF
-    improvable_strip_plot(
-        data=la_data,
-        factor="prop_improvable",
-        filename="final_strip_improvable_prop" + suffix,
+
+    return produce_vegalite_specs(
+        la_data, select_chart_jobs(charts), directory=directory or VEGALITE_DIR
     )
 
 
-produce_charts(suffix=".png")
-produce_charts(suffix=".svg")
+if __name__ == "__main__":
+    from la_funding_analysis.pipeline.joining import form_all_tidy_data
+
+    la_data = form_all_tidy_data()
+    produce_charts(la_data)
@@ -5,6 +5,7 @@ from la_funding_analysis.pipeline.cleaning_and_joining import (
     get_clean_grants,
     form_all_tidy_data,
 )
+from la_funding_analysis.pipeline.merge_audit import audit_merge
 
 la_data = form_all_tidy_data()
 
@@ -72,9 +73,9 @@ the_rest = filtered_eng.loc[~filtered_eng.is_relevant & filtered_eng.body_grants
 
 
 grants = get_clean_grants()
-missing_names = [
-    name for name in grants.index if name not in [name2 for name2 in fp.clean_name]
-]
+missing_names = audit_merge(fp, grants, on="clean_name", max_keys=None)[
+    "unmatched_right"
+]["keys"]
 la_data.loc[[("Babergh" in name) for name in la_data.clean_name]]
 la_data.loc[[("Mid Suffolk" in name) for name in la_data.clean_name]]
 
@@ -161,4 +162,4 @@ len(la_data[la_data["all_no_members"] == 3])
 len(la_data[la_data["total_grants"] == 4])
 
 # leads
-len(la_data[la_data["GHG_1a_leads"] + la_data["GHG_1b_leads"] == 3])
+len(la_data[la_data[["GHG_1a_leads", "GHG_1b_leads"]].sum(axis=1) == 3])
@@ -0,0 +1,4 @@
+"""Benchmarks for the pipeline and plotting code.
+Each module can be run as a script, e.g.
+`python -m la_funding_analysis.benchmarks.figure_memory`.
+"""
@@ -0,0 +1,75 @@
+# File: benchmarks/choropleth.py
+"""Times building the simplified boundary cache for maps, and drawing a
+national choropleth with a cold cache (first map in a process) and a
+warm one, on synthetic data and boundaries.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from la_funding_analysis.pipeline import boundaries  # noqa: E402
+from la_funding_analysis.pipeline.plotters import choropleth  # noqa: E402
+from la_funding_analysis.utils.synthetic_data import (  # noqa: E402
+    make_la_boundaries,
+    make_tidy_data,
+)
+
+
+def _time(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _draw_map(la_data, tolerance, cache_path, directory):
+    fig = choropleth(
+        la_data, "fp_proportion", tolerance=tolerance, cache_path=cache_path
+    )
+    fig.savefig(Path(directory) / "map.png")
+    plt.close(fig)
+
+
+def choropleth_benchmark():
+    """Returns the time taken (s) to build the boundary cache, and to draw
+    and save a map at each tolerance from the cache on disk ("cold") and
+    from memory ("warm").
+    """
+    la_data = make_tidy_data()
+    geojson = make_la_boundaries(list(la_data["code"]))
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = Path(directory) / "la_boundaries.npz"
+        results.append(
+            {
+                "step": "build cache",
+                "seconds": _time(
+                    lambda: boundaries.build_boundary_cache(
+                        geojson, cache_path=cache_path
+                    )
+                ),
+            }
+        )
+        for tolerance in boundaries.MAP_TOLERANCES:
+            boundaries._loaded_boundaries.clear()
+            for step in ["cold", "warm"]:
+                results.append(
+                    {
+                        "step": f"map at {tolerance}m ({step})",
+                        "seconds": _time(
+                            lambda: _draw_map(la_data, tolerance, cache_path, directory)
+                        ),
+                    }
+                )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    print(choropleth_benchmark().to_string(index=False))
@@ -0,0 +1,73 @@
+# File: benchmarks/cli_startup.py
+"""Measures how long the CLI takes to start for commands that should not
+need pandas or matplotlib, and checks that those libraries are not imported.
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+# Commands that should start in well under a second
+FAST_COMMANDS = [["--help"], ["list-stages"], ["list-charts"]]
+MAX_SECONDS = 1.0
+HEAVY_MODULES = ["pandas", "matplotlib", "numpy"]
+
+# Runs a CLI command in a fresh interpreter and reports heavy imports
+_CHECK_IMPORTS = """
+import sys
+from la_funding_analysis.cli import app
+try:
+    app(args=sys.argv[1:], standalone_mode=False)
+except SystemExit:
+    pass
+print("heavy imports:", ",".join(m for m in {modules} if m in sys.modules))
+"""
+
+
+def time_command(args, repeats=5):
+    """Median wall time (s) of running the CLI with args in a new process."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "la_funding_analysis", *args],
+            check=True,
+            capture_output=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def heavy_imports(args):
+    """Heavy modules imported while running the CLI with args."""
+    result = subprocess.run(
+        [sys.executable, "-c", _CHECK_IMPORTS.format(modules=HEAVY_MODULES), *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.splitlines()[-1].split(":")[1].strip()
+
+
+def cli_startup_benchmark(repeats=5):
+    """Times each fast command and lists any heavy modules it imported."""
+    return pd.DataFrame(
+        [
+            {
+                "command": " ".join(args),
+                "seconds": time_command(args, repeats=repeats),
+                "heavy_imports": heavy_imports(args),
+            }
+            for args in FAST_COMMANDS
+        ]
+    )
+
+
+if __name__ == "__main__":
+    results = cli_startup_benchmark()
+    print(results.to_string(index=False))
+    assert (results["seconds"] < MAX_SECONDS).all(), "CLI startup is too slow"
+    assert (results["heavy_imports"] == "").all(), "Heavy modules were imported"
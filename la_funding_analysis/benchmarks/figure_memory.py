@@ -0,0 +1,59 @@
+# File: benchmarks/figure_memory.py
+"""Checks that producing the charts repeatedly does not accumulate figures
+or memory. Runs produce_charts several times in this process on synthetic
+data and reports the number of open figures and the memory still allocated
+after each run, which should stay flat.
+Memory rises slightly over the first few runs while matplotlib's text layout
+cache (bounded at 4096 entries) fills up, and is flat from then on.
+"""
+
+import gc
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from la_funding_analysis.analysis.generate_plots import produce_charts  # noqa: E402
+from la_funding_analysis.utils.synthetic_data import make_tidy_data  # noqa: E402
+
+
+def figure_memory_benchmark(runs=10, formats=(".png", ".svg")):
+    """Produces all charts runs times and returns, for each run,
+    the number of open figures and the traced memory (MB) still in use.
+    """
+    la_data = make_tidy_data()
+    results = []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(runs):
+            produce_charts(
+                la_data, formats, processes=1, directory=Path(directory), force=True
+            )
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            results.append(
+                {
+                    "run": run,
+                    "open_figures": len(plt.get_fignums()),
+                    "current_mb": current / 1e6,
+                    "peak_mb": peak / 1e6,
+                }
+            )
+    tracemalloc.stop()
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    results = figure_memory_benchmark()
+    print(results.to_string(index=False))
+    assert (results["open_figures"] == 0).all(), "Figures were left open"
+    late_runs = results["current_mb"].iloc[len(results) // 2 :]
+    print(
+        f"Memory growth over the last {len(late_runs)} runs: {late_runs.max() - late_runs.min():.2f} MB"
+    )
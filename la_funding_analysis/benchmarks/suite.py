@@ -0,0 +1,326 @@
+# File: benchmarks/suite.py
+"""Benchmark suite timing every getter, cleaning function, joining function
+and plotting function, and measuring its peak memory, at several synthetic
+data scales.
+Getters, cleaning and joining run on synthetic input files (see
+utils/synthetic_inputs.py) with the number of EPC rows set by the scale,
+written once per scale to outputs/benchmarks/inputs. Plotting functions run
+on the synthetic tidy dataset with the number of LAs set by the scale.
+Each benchmark is timed as the best of several runs, then run once more
+under tracemalloc for its peak memory. Results are appended to
+outputs/benchmarks/results.jsonl with the commit they were run at, so
+that runs at two commits can be compared with compare_results.
+"""
+
+import gc
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from la_funding_analysis import PROJECT_DIR  # noqa: E402
+from la_funding_analysis.getters import local_authority_data as getters  # noqa: E402
+from la_funding_analysis.pipeline import boundaries  # noqa: E402
+from la_funding_analysis.pipeline import cleaning, joining, plotters  # noqa: E402
+from la_funding_analysis.pipeline.chart_data import (  # noqa: E402
+    clear_chart_data_cache,
+)
+from la_funding_analysis.pipeline.chart_registry import (  # noqa: E402
+    PLOT_TYPES,
+    load_chart_registry,
+)
+from la_funding_analysis.utils.synthetic_data import (  # noqa: E402
+    make_la_boundaries,
+    make_tidy_data,
+)
+from la_funding_analysis.utils.synthetic_inputs import (  # noqa: E402
+    write_synthetic_inputs,
+)
+
+BENCHMARKS_DIR = PROJECT_DIR / "outputs/benchmarks"
+RESULTS_PATH = BENCHMARKS_DIR / "results.jsonl"
+
+# Scale factor of the synthetic inputs (100k EPC rows at 1), and number of
+# LAs in the synthetic tidy data for the plotting functions, at each scale
+Scale = namedtuple("Scale", ["input_scale", "n_las"])
+SCALES = {
+    "small": Scale(1, 339),
+    "medium": Scale(10, 3_390),
+    "large": Scale(100, 33_900),
+}
+# The large scale takes several minutes, so is only run when asked for
+DEFAULT_SCALES = ["small", "medium"]
+
+GROUPS = ["getters", "cleaning", "joining", "plotting"]
+
+# Arguments for plotting functions that have no chart in the registry
+DEFAULT_PLOT_KWARGS = {"choropleth": {"column": "fp_proportion"}}
+
+# Points per side of the synthetic LA boundaries for the choropleth,
+# fewer than the default so that the largest scale stays manageable
+BOUNDARY_POINTS_PER_SIDE = 50
+
+
+def _consume(iterator):
+    for _ in iterator:
+        pass
+
+
+def data_benchmarks():
+    """Dict of benchmark name: (group, function) for the getters,
+    cleaning and joining functions, which read the input files.
+    """
+    benchmarks = {
+        name: ("getters", getattr(getters, name))
+        for name in [
+            "get_fuel_poverty",
+            "get_parties_models",
+            "get_old_parties",
+            "get_imd",
+            "get_grants",
+            "get_la_centroids",
+            "get_la_boundaries",
+            "get_epc",
+        ]
+    }
+    benchmarks["get_epc_chunks"] = (
+        "getters",
+        lambda: _consume(getters.get_epc_chunks()),
+    )
+    benchmarks.update(
+        {
+            name: ("cleaning", getattr(cleaning, name))
+            for name in [
+                "get_clean_fuel_poverty",
+                "get_clean_parties_models",
+                "get_clean_old_parties",
+                "get_clean_imd",
+                "get_clean_grants",
+                "get_clean_la_centroids",
+                "get_clean_epc",
+                "get_epc_sketches",
+            ]
+        }
+    )
+    benchmarks.update(
+        {
+            name: ("joining", getattr(joining, name))
+            for name in [
+                "form_fp_parties_models",
+                "form_fp_pm_imd",
+                "form_fp_pm_imd_grants",
+                "form_all_data",
+                "form_all_tidy_data",
+            ]
+        }
+    )
+    return benchmarks
+
+
+def plot_kwargs():
+    """Arguments for each plotting function, from its first chart in
+    the registry.
+    """
+    kwargs = dict(DEFAULT_PLOT_KWARGS)
+    for chart in load_chart_registry().values():
+        kwargs.setdefault(chart.plot, chart.kwargs)
+    return kwargs
+
+
+def plot_benchmarks(la_data, cache_path):
+    """Dict of benchmark name: (group, function) drawing each plotting
+    function's chart of la_data, including computing its table.
+    Maps are drawn from the boundary cache at cache_path.
+    """
+
+    def draw(plot, kwargs):
+        def function():
+            clear_chart_data_cache()
+            boundaries._loaded_boundaries.clear()
+            fig = getattr(plotters, plot)(la_data, **kwargs)
+            fig.canvas.draw()
+            plt.close(fig)
+
+        return function
+
+    all_kwargs = plot_kwargs()
+    all_kwargs["choropleth"] = dict(all_kwargs["choropleth"], cache_path=cache_path)
+    return {plot: ("plotting", draw(plot, all_kwargs[plot])) for plot in PLOT_TYPES}
+
+
+def measure(function, repeat=3):
+    """Best time (s) of repeat runs of function, and its peak memory (MB)
+    in a further run traced with tracemalloc.
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak / 1e6
+
+
+def synthetic_inputs_dir(scale, seed=0):
+    """Directory of synthetic inputs for a scale, writing them if they
+    haven't been written with the same scale factor and seed.
+    """
+    directory = BENCHMARKS_DIR / "inputs" / scale
+    settings = {"scale": SCALES[scale].input_scale, "seed": seed}
+    settings_path = directory / "settings.json"
+    if settings_path.exists():
+        with open(settings_path) as f:
+            if json.load(f) == settings:
+                return directory
+    write_synthetic_inputs(directory, **settings)
+    # Written last, so that partly written inputs are rewritten
+    with open(settings_path, "w") as f:
+        json.dump(settings, f)
+    return directory
+
+
+def _boundary_cache(scale, codes):
+    """Boundary cache for synthetic LA boundaries of the given codes,
+    built once per scale. It is kept in its own directory, which the
+    plotting benchmarks use as their input directory: with no boundary
+    file there, the cache is never rebuilt from one.
+    """
+    cache_path = BENCHMARKS_DIR / "maps" / scale / "la_boundaries.npz"
+    with input_dir(cache_path.parent):
+        if not cache_path.exists():
+            boundaries.build_boundary_cache(
+                make_la_boundaries(codes, points_per_side=BOUNDARY_POINTS_PER_SIDE),
+                cache_path=cache_path,
+            )
+    return cache_path
+
+
+@contextmanager
+def input_dir(directory):
+    """Points the getters at the input files in directory."""
+    previous = os.environ.get(getters.INPUT_DIR_VARIABLE)
+    os.environ[getters.INPUT_DIR_VARIABLE] = str(directory)
+    try:
+        yield directory
+    finally:
+        if previous is None:
+            del os.environ[getters.INPUT_DIR_VARIABLE]
+        else:
+            os.environ[getters.INPUT_DIR_VARIABLE] = previous
+
+
+def git_commit():
+    """Hash of the current commit, and whether the working tree has
+    uncommitted changes to tracked files.
+    """
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=PROJECT_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    return git("rev-parse", "HEAD"), bool(git("status", "--porcelain", "-uno"))
+
+
+def run_benchmarks(scales=None, groups=None, names=None, repeat=3, record=True):
+    """Runs the benchmarks in the given groups (default: all) at each of
+    the given scales (default: DEFAULT_SCALES), optionally only those
+    in names, and returns a DataFrame of results.
+    If record is True, the results are also appended to RESULTS_PATH.
+    """
+    groups = groups or GROUPS
+    commit, dirty = git_commit()
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    results = []
+    for scale in scales or DEFAULT_SCALES:
+        if scale not in SCALES:
+            raise ValueError(f"Unknown scale: {scale}")
+        # Benchmarks to run, with the directory of inputs they read
+        suites = []
+        if set(groups) - {"plotting"}:
+            suites.append((synthetic_inputs_dir(scale), data_benchmarks()))
+        if "plotting" in groups:
+            la_data = make_tidy_data(n_las=SCALES[scale].n_las)
+            cache_path = _boundary_cache(scale, list(la_data["code"]))
+            suites.append((cache_path.parent, plot_benchmarks(la_data, cache_path)))
+        for directory, benchmarks in suites:
+            with input_dir(directory):
+                for name, (group, function) in benchmarks.items():
+                    if group not in groups or (names and name not in names):
+                        continue
+                    seconds, peak_mb = measure(function, repeat)
+                    results.append(
+                        {
+                            "commit": commit,
+                            "dirty": dirty,
+                            "timestamp": timestamp,
+                            "scale": scale,
+                            "group": group,
+                            "benchmark": name,
+                            "seconds": seconds,
+                            "peak_mb": peak_mb,
+                        }
+                    )
+    if record and results:
+        RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(RESULTS_PATH, "a") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return pd.DataFrame(results)
+
+
+def read_results(path=RESULTS_PATH):
+    """All recorded benchmark results as a DataFrame."""
+    return pd.read_json(path, lines=True, dtype={"commit": str})
+
+
+def compare_results(base, head, threshold=1.1, path=RESULTS_PATH):
+    """Compares the latest recorded results at two commits (given as
+    hashes or unique prefixes of them), returning a DataFrame with the
+    ratio of head to base time and peak memory for each benchmark and
+    scale run at both. A benchmark is flagged as a regression if either
+    ratio is above threshold.
+    """
+    results = read_results(path)
+
+    def latest(commit):
+        matches = results.loc[results["commit"].str.startswith(commit)]
+        if matches["commit"].nunique() != 1:
+            raise ValueError(f"No unique commit with results matching {commit}")
+        return (
+            matches.sort_values("timestamp")
+            .drop_duplicates(["scale", "benchmark"], keep="last")
+            .set_index(["scale", "group", "benchmark"])[["seconds", "peak_mb"]]
+        )
+
+    comparison = latest(base).join(
+        latest(head), how="inner", lsuffix="_base", rsuffix="_head"
+    )
+    comparison["time_ratio"] = comparison["seconds_head"] / comparison["seconds_base"]
+    comparison["memory_ratio"] = comparison["peak_mb_head"] / comparison["peak_mb_base"]
+    comparison["regression"] = (comparison["time_ratio"] > threshold) | (
+        comparison["memory_ratio"] > threshold
+    )
+    return comparison.reset_index()
+
+
+if __name__ == "__main__":
+    print(run_benchmarks().to_string(index=False))
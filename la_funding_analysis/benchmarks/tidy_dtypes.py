@@ -0,0 +1,66 @@
+# File: benchmarks/tidy_dtypes.py
+"""Compares the tidy dataset with the dtypes set by apply_tidy_dtypes
+(categoricals, float32 for whole-number measures and downcast grant
+counts) with the pandas extension dtypes that convert_dtypes gives it,
+in memory used and time taken by the groupbys behind the charts.
+"""
+
+import time
+
+import pandas as pd
+
+from la_funding_analysis.pipeline import chart_data
+from la_funding_analysis.utils.synthetic_data import make_tidy_data
+
+FACTORS = ["region_1", "model", "majority"]
+# Tables computed for each factor, by chart_data function name
+TABLES = [
+    "grant_type_subtotals",
+    "grant_count_proportions",
+    "applicant_type_rates",
+    "values_by_receipt_status",
+]
+
+
+def _time(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def tidy_dtypes_benchmark(n_las=(339, 100_000), repeats=5):
+    """Makes synthetic tidy datasets of each size in n_las with each set of
+    dtypes and returns their memory use (kB) and the mean time (ms) taken
+    to compute every chart table for each of FACTORS, without memoization.
+    """
+    results = []
+    for n in n_las:
+        datasets = {
+            "convert_dtypes": make_tidy_data(n, dtypes=False).convert_dtypes(),
+            "tidy_dtypes": make_tidy_data(n),
+        }
+        for name, data in datasets.items():
+
+            def compute_tables():
+                for table in TABLES:
+                    for factor in FACTORS:
+                        getattr(chart_data, table).__wrapped__(data, factor)
+
+            def hash_dataset():
+                chart_data.dataset_hash(data)
+
+            results.append(
+                {
+                    "n_las": n,
+                    "dtypes": name,
+                    "memory_kb": data.memory_usage(deep=True).sum() / 1e3,
+                    "tables_ms": _time(compute_tables, repeats) * 1e3,
+                    "hash_ms": _time(hash_dataset, repeats) * 1e3,
+                }
+            )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    print(tidy_dtypes_benchmark().to_string(index=False))
@@ -0,0 +1,56 @@
+# File: benchmarks/vegalite_specs.py
+"""Compares producing the charts as Vega-Lite specs with rendering them
+with matplotlib, in time taken and size of the files written.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pandas as pd  # noqa: E402
+
+from la_funding_analysis.analysis.generate_plots import (  # noqa: E402
+    produce_charts,
+    produce_vegalite_charts,
+)
+from la_funding_analysis.utils.synthetic_data import make_tidy_data  # noqa: E402
+
+
+def _directory_size(directory):
+    return sum(path.stat().st_size for path in Path(directory).iterdir())
+
+
+def vegalite_benchmark(formats=(".png", ".svg")):
+    """Produces all charts with each backend on synthetic data and returns
+    the time taken (s) and total size of the output files (kB).
+    """
+    la_data = make_tidy_data()
+    results = []
+    for backend, produce in [
+        (
+            "matplotlib",
+            lambda d: produce_charts(la_data, formats, processes=1, directory=d),
+        ),
+        ("vegalite", lambda d: produce_vegalite_charts(la_data, directory=d)),
+    ]:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            produce(Path(directory))
+            seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "backend": backend,
+                    "seconds": seconds,
+                    "files": len(list(Path(directory).iterdir())),
+                    "total_kb": _directory_size(directory) / 1e3,
+                }
+            )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    print(vegalite_benchmark().to_string(index=False))
@@ -0,0 +1,463 @@
+# File: cli.py
+"""Command line interface for building the data and producing the charts.
+Run `python -m la_funding_analysis --help` (or `la-funding --help`
+once the package is installed) to see the available commands.
+pandas, matplotlib and the pipeline code are only imported by the commands
+that need them, so that help and listing commands start quickly.
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+from la_funding_analysis import PROJECT_DIR
+
+app = typer.Typer(
+    help="Analysis of local authorities receiving decarbonisation grants.",
+    no_args_is_help=True,
+)
+
+
+@app.command("build-data")
+def build_data(
+    stages: Optional[List[str]] = typer.Argument(
+        None, help="Stages to build (default: tidy_data)."
+    ),
+    report: bool = typer.Option(
+        False,
+        help="Write a JSON report of each step's time, memory and rows "
+        "to outputs/reports.",
+    ),
+    profile: Optional[str] = typer.Option(
+        None,
+        help="Step to profile with cProfile (e.g. get_clean_epc), "
+        "dumped to outputs/reports. Implies --report.",
+    ),
+    audit_merges: bool = typer.Option(
+        False,
+        help="Write a JSON report of the audit of every merge (unmatched and "
+        "duplicate keys, row inflation, null rates) to outputs/reports.",
+    ),
+    min_coverage: Optional[float] = typer.Option(
+        None,
+        help="Fail if fewer than this share of the rows of any table merged "
+        "in are matched (default: merge_audit in config/base.yaml).",
+    ),
+):
+    """Builds data stages and caches their outputs in outputs/cache."""
+    from contextlib import ExitStack
+
+    from la_funding_analysis.pipeline.merge_audit import merge_audit_report
+    from la_funding_analysis.pipeline.stages import run_stage, STAGES
+    from la_funding_analysis.utils.instrumentation import find_stage, run_report
+
+    for name in stages or ["tidy_data"]:
+        if name not in STAGES:
+            raise typer.BadParameter(f"Unknown stage: {name}")
+    if profile:
+        try:
+            profile = find_stage(profile)
+        except ValueError as error:
+            raise typer.BadParameter(str(error))
+    with ExitStack() as reports:
+        if report or profile:
+            reports.enter_context(run_report(profile=profile))
+        if audit_merges or min_coverage is not None:
+            reports.enter_context(merge_audit_report(min_coverage=min_coverage))
+        for name in stages or ["tidy_data"]:
+            try:
+                output = run_stage(name)
+            except ValueError as error:
+                typer.echo(f"Failed to build {name}: {error}", err=True)
+                raise typer.Exit(1)
+            typer.echo(f"Built {name}: {len(output)} rows")
+
+
+@app.command("list-stages")
+def list_stages():
+    """Lists the data stages and whether their outputs are cached."""
+    from la_funding_analysis.pipeline.stages import cache_path, STAGES
+
+    for name, (_, _, description) in STAGES.items():
+        cached = "cached" if cache_path(name).exists() else "-"
+        typer.echo(f"{name:<16}{cached:<8}{description}")
+
+
+@app.command("list-charts")
+def list_charts():
+    """Lists the names of the charts that can be rendered."""
+    from la_funding_analysis.analysis.generate_plots import chart_names
+
+    for name in chart_names():
+        typer.echo(name)
+
+
+@app.command()
+def render(
+    charts: Optional[List[str]] = typer.Argument(
+        None, help="Charts to render (default: all). See list-charts."
+    ),
+    formats: Optional[List[str]] = typer.Option(
+        None,
+        "--format",
+        "-f",
+        help="File suffixes to save (default: from the chart registry).",
+    ),
+    processes: Optional[int] = typer.Option(
+        None, "--processes", "-p", help="Worker processes (default: CPU count)."
+    ),
+    rebuild: bool = typer.Option(False, help="Rebuild the data before rendering."),
+    force: bool = typer.Option(
+        False, help="Render every chart, even if it is up to date."
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="List the charts that would be rendered."
+    ),
+    vegalite: bool = typer.Option(
+        False,
+        "--vegalite",
+        help="Write Vega-Lite specs to outputs/figures/vegalite instead.",
+    ),
+):
+    """Renders charts from the cached tidy data into outputs/figures.
+    Only charts that are missing or out of date are rendered.
+    """
+    from la_funding_analysis.analysis import generate_plots
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    la_data = load_stage("tidy_data", rebuild=rebuild)
+    if formats:
+        formats = [
+            suffix if suffix.startswith(".") else "." + suffix for suffix in formats
+        ]
+    try:
+        if vegalite:
+            paths = generate_plots.produce_vegalite_charts(la_data, charts=charts)
+            typer.echo("\n".join(str(path) for path in paths))
+        else:
+            results = generate_plots.produce_charts(
+                la_data,
+                formats,
+                charts=charts,
+                processes=processes,
+                force=force,
+                dry_run=dry_run,
+            )
+            if results.empty:
+                typer.echo("All charts are up to date")
+            else:
+                typer.echo(results.to_string(index=False))
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+
+
+@app.command("map")
+def map_chart(
+    column: str = typer.Argument(..., help="Column of the tidy data to map."),
+    tolerance: int = typer.Option(
+        500, "--tolerance", "-t", help="Boundary simplification in metres."
+    ),
+    formats: List[str] = typer.Option(
+        [".png"], "--format", "-f", help="File suffixes to save."
+    ),
+    rebuild: bool = typer.Option(
+        False, help="Rebuild the data and the boundary cache before mapping."
+    ),
+):
+    """Draws a choropleth map of a column of the tidy data into outputs/figures."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from la_funding_analysis.pipeline.boundaries import build_boundary_cache
+    from la_funding_analysis.pipeline.plotters import choropleth, export_figure
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    la_data = load_stage("tidy_data", rebuild=rebuild)
+    if column not in la_data.columns:
+        raise typer.BadParameter(f"Unknown column: {column}")
+    if rebuild:
+        build_boundary_cache()
+    formats = [suffix if suffix.startswith(".") else "." + suffix for suffix in formats]
+    try:
+        paths = export_figure(
+            choropleth,
+            f"map_{column}",
+            formats,
+            data=la_data,
+            column=column,
+            tolerance=tolerance,
+        )
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    typer.echo("\n".join(str(path) for path in paths))
+
+
+@app.command()
+def report(
+    processes: Optional[int] = typer.Option(
+        None, "--processes", "-p", help="Worker processes (default: CPU count)."
+    ),
+    rebuild: bool = typer.Option(False, help="Rebuild the data before reporting."),
+    force: bool = typer.Option(
+        False, help="Rebuild every section, even if it is up to date."
+    ),
+):
+    """Builds a self-contained HTML report of the tables and charts in
+    outputs/reports/report.html. Only sections whose inputs have changed
+    are rebuilt.
+    """
+    from la_funding_analysis.pipeline.html_report import (
+        build_report,
+        REPORT_DIR,
+        REPORT_FILENAME,
+    )
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    la_data = load_stage("tidy_data", rebuild=rebuild)
+    results = build_report(la_data, processes=processes, force=force)
+    if results.empty:
+        typer.echo("All sections are up to date")
+    else:
+        typer.echo(results.to_string(index=False))
+    typer.echo(f"Wrote {REPORT_DIR / REPORT_FILENAME}")
+
+
+@app.command("need-scores")
+def need_scores(
+    weights: Optional[List[str]] = typer.Option(
+        None,
+        "--weight",
+        "-w",
+        help="Weight of a need indicator, e.g. fp_proportion=2 (default: "
+        "equal weights). Indicators not given are weighted 0.",
+    ),
+    top: int = typer.Option(20, help="Number of the neediest LAs to list."),
+    k: int = typer.Option(
+        50, "-k", help="Number of the neediest LAs whose grants are compared."
+    ),
+    sweep: int = typer.Option(
+        10_000, help="Number of random weight vectors to compare (0 to skip)."
+    ),
+    seed: Optional[int] = typer.Option(None, help="Seed for the weight vectors."),
+    grants: str = typer.Option("total_grants", help="Column of grants received."),
+    rebuild: bool = typer.Option(False, help="Rebuild the data before scoring."),
+):
+    """Ranks LAs by a composite need score and compares the ranking with
+    the grants they received, for the given weights and across random
+    weight vectors.
+    """
+    import pandas as pd
+
+    from la_funding_analysis.pipeline import need_scoring
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    la_data = load_stage("tidy_data", rebuild=rebuild)
+    if grants not in la_data.columns:
+        raise typer.BadParameter(f"Unknown column: {grants}")
+    try:
+        weights = {
+            indicator: float(weight)
+            for indicator, _, weight in (item.partition("=") for item in weights or [])
+        } or None
+    except ValueError:
+        raise typer.BadParameter("Expected weights as indicator=weight")
+    try:
+        ranking = need_scoring.need_ranking(la_data, weights, grants)
+        agreement = need_scoring.need_agreement(la_data, weights, grants, k)
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        typer.echo(ranking.head(top).round(3).to_string(index=False))
+        typer.echo("")
+        typer.echo(agreement.round(3).to_string())
+        if sweep:
+            results = need_scoring.weight_sweep(la_data, sweep, grants, k, seed)
+            typer.echo(f"\nAcross {sweep} random weight vectors:")
+            typer.echo(need_scoring.sweep_summary(results).round(3).to_string())
+
+
+@app.command("synthetic-inputs")
+def synthetic_inputs(
+    directory: Path = typer.Argument(..., help="Directory to write the inputs to."),
+    scale: float = typer.Option(
+        1, "--scale", "-s", help="Scale factor (100k EPC rows at 1)."
+    ),
+    seed: int = typer.Option(0, help="Random seed."),
+):
+    """Writes synthetic versions of every input file, so that the pipeline
+    can be run without the real data.
+    """
+    from la_funding_analysis.getters.local_authority_data import INPUT_DIR_VARIABLE
+    from la_funding_analysis.utils.synthetic_inputs import write_synthetic_inputs
+
+    write_synthetic_inputs(directory, scale=scale, seed=seed)
+    for path in sorted(directory.iterdir()):
+        typer.echo(path)
+    typer.echo(f"Set {INPUT_DIR_VARIABLE}={directory} to use them.")
+
+
+@app.command()
+def benchmark(
+    names: Optional[List[str]] = typer.Argument(
+        None, help="Benchmarks to run, e.g. get_epc (default: all)."
+    ),
+    scales: Optional[List[str]] = typer.Option(
+        None, "--scale", "-s", help="small, medium or large (default: small, medium)."
+    ),
+    groups: Optional[List[str]] = typer.Option(
+        None, "--group", "-g", help="getters, cleaning, joining or plotting."
+    ),
+    repeat: int = typer.Option(3, help="Timed runs of each benchmark."),
+    record: bool = typer.Option(True, help="Record the results for comparison."),
+):
+    """Times the getters, cleaning, joining and plotting functions and
+    measures their peak memory on synthetic data.
+    """
+    from la_funding_analysis.benchmarks.suite import run_benchmarks
+
+    try:
+        results = run_benchmarks(scales, groups, names, repeat=repeat, record=record)
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    if len(results):
+        columns = ["scale", "group", "benchmark", "seconds", "peak_mb"]
+        typer.echo(results[columns].to_string(index=False))
+
+
+@app.command("compare-benchmarks")
+def compare_benchmarks(
+    base: str = typer.Argument(..., help="Commit to compare against."),
+    head: str = typer.Argument(..., help="Commit to compare."),
+    threshold: float = typer.Option(
+        1.1, help="Time or memory ratio above which to flag a regression."
+    ),
+):
+    """Compares the recorded benchmark results at two commits."""
+    from la_funding_analysis.benchmarks.suite import compare_results
+
+    try:
+        comparison = compare_results(base, head, threshold)
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    typer.echo(comparison.to_string(index=False, float_format="{:.3f}".format))
+    regressions = comparison.loc[comparison["regression"]]
+    if len(regressions):
+        names = regressions["benchmark"] + " (" + regressions["scale"] + ")"
+        typer.echo(f"Regressions: {', '.join(names)}")
+        raise typer.Exit(1)
+
+
+def _input_store(store, profile):
+    from dotenv import load_dotenv
+
+    from la_funding_analysis.getters.input_sync import store_from_url
+
+    if store is None:
+        load_dotenv(PROJECT_DIR / ".env.shared")
+        store = f"s3://{os.environ['BUCKET']}/inputs/data"
+    return store_from_url(store, profile)
+
+
+@app.command("sync-inputs")
+def sync_inputs(
+    store: Optional[str] = typer.Argument(
+        None,
+        help="s3://bucket/prefix or directory to sync from "
+        "(default: the project's bucket).",
+    ),
+    files: Optional[List[str]] = typer.Option(
+        None, "--file", "-f", help="Files to sync (default: all)."
+    ),
+    workers: int = typer.Option(4, help="Files downloaded at once."),
+    profile: Optional[str] = typer.Option(None, help="AWS profile for S3."),
+):
+    """Downloads the input files that are missing or out of date to
+    inputs/data, checking them against the store's manifest.
+    """
+    from la_funding_analysis.getters.input_sync import sync_inputs as sync
+
+    try:
+        statuses = sync(_input_store(store, profile), workers=workers, files=files)
+    except FileNotFoundError as error:
+        typer.echo(str(error), err=True)
+        raise typer.Exit(1)
+    for key, status in statuses.items():
+        typer.echo(f"{key:<56}{status}")
+    if any(status.startswith("failed") for status in statuses.values()):
+        raise typer.Exit(1)
+
+
+@app.command("push-inputs")
+def push_inputs(
+    store: Optional[str] = typer.Argument(
+        None,
+        help="s3://bucket/prefix or directory to push to "
+        "(default: the project's bucket).",
+    ),
+    files: Optional[List[str]] = typer.Option(
+        None, "--file", "-f", help="Files to push (default: all)."
+    ),
+    profile: Optional[str] = typer.Option(None, help="AWS profile for S3."),
+):
+    """Writes the manifest of the files in inputs/data and uploads them
+    with it.
+    """
+    from la_funding_analysis.getters.input_sync import push_inputs as push
+
+    manifest = push(_input_store(store, profile), files=files)
+    typer.echo(f"Pushed {len(files or manifest)} files and the manifest")
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("127.0.0.1", help="Address to listen on."),
+    port: int = typer.Option(8050, help="Port to listen on."),
+    interval: float = typer.Option(
+        2.0, help="Seconds between checks for a rebuilt dataset."
+    ),
+):
+    """Serves queries about the tidy LA dataset over HTTP (see
+    pipeline/query_service.py), reloading it when it is rebuilt.
+    """
+    from la_funding_analysis.pipeline.query_service import serve as serve_queries
+
+    serve_queries(host, port, interval)
+
+
+@app.command()
+def export(
+    output_dir: Path = typer.Option(
+        PROJECT_DIR / "outputs/data", help="Directory to write outputs to."
+    ),
+    rebuild: bool = typer.Option(False, help="Rebuild the data before exporting."),
+    formats: Optional[List[str]] = typer.Option(
+        None,
+        "--format",
+        "-f",
+        help="Formats to export: csv, parquet and/or arrow (default: csv). "
+        "Parquet and Arrow exports include the EPC aggregates per LA.",
+    ),
+):
+    """Exports the tidy LA dataset as a CSV, Parquet or Arrow IPC file."""
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    formats = formats or ["csv"]
+    unknown = set(formats) - {"csv", "parquet", "arrow"}
+    if unknown:
+        raise typer.BadParameter(f"Unknown formats: {', '.join(sorted(unknown))}")
+    la_data = load_stage("tidy_data", rebuild=rebuild)
+    if "csv" in formats:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        la_data.to_csv(output_dir / "la_tidy_data.csv", index=False)
+    if set(formats) - {"csv"}:
+        from la_funding_analysis.pipeline.arrow_export import export_arrow
+
+        for path in export_arrow(output_dir, formats, rebuild=rebuild):
+            typer.echo(f"Wrote {path}")
+    typer.echo(f"Exported {len(la_data)} rows to {output_dir}")
+
+
+if __name__ == "__main__":
+    app()
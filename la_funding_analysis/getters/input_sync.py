@@ -0,0 +1,352 @@
+# File: getters/input_sync.py
+"""Syncing of the input files from an object store (the project's S3
+bucket, or a local directory standing in for it) to inputs/data.
+The store holds a manifest (manifest.json) of each input file's size and
+SHA-256 checksum, written with write_manifest before the files are
+pushed. Syncing downloads files in parallel threads, skips those whose
+checksum already matches the manifest, resumes partial downloads (kept
+as <file>.part) and moves each file into place only once its checksum
+has been verified. The manifest is then kept alongside the inputs, so
+that the getters can check each file against it before reading it.
+A store without a manifest (e.g. one filled with aws s3 sync) has to be
+pushed to once with push_inputs before it can be synced from.
+Checksums of verified files are recorded with their size and
+modification time in .verified.json, so unchanged files aren't re-hashed.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from la_funding_analysis import PROJECT_DIR
+
+MANIFEST_FILENAME = "manifest.json"
+VERIFIED_FILENAME = ".verified.json"
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+# Files that are never listed in the manifest
+_SYNC_FILES = [MANIFEST_FILENAME, VERIFIED_FILENAME]
+
+# (size, modification time) and checksum of files verified in this process
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+class ObjectStore(ABC):
+    """Interface of an object store holding the input files, by key
+    (their path relative to the inputs directory).
+    """
+
+    @abstractmethod
+    def exists(self, key):
+        """Whether the store holds an object."""
+
+    @abstractmethod
+    def read(self, key, start=0):
+        """Iterates over the bytes of an object from offset start, in chunks."""
+
+    @abstractmethod
+    def write(self, key, path):
+        """Uploads the file at path as an object."""
+
+
+class LocalStore(ObjectStore):
+    """A local directory used as an object store, e.g. for testing."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def __repr__(self):
+        return f"LocalStore({str(self.directory)!r})"
+
+    def exists(self, key):
+        """Whether the directory holds the file key."""
+        return (self.directory / key).is_file()
+
+    def read(self, key, start=0):
+        """Iterates over the bytes of the file key from offset start,
+        in chunks.
+        """
+        with open(self.directory / key, "rb") as f:
+            f.seek(start)
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+    def write(self, key, path):
+        """Copies the file at path to key in the directory."""
+        destination = self.directory / key
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "rb") as source, open(destination, "wb") as f:
+            while chunk := source.read(CHUNK_SIZE):
+                f.write(chunk)
+
+
+class S3Store(ObjectStore):
+    """Objects under a prefix of an S3 bucket, read with boto3."""
+
+    def __init__(self, bucket, prefix="inputs/data", profile=None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.Session(profile_name=profile).client("s3")
+
+    def __repr__(self):
+        return f"S3Store('s3://{self.bucket}/{self.prefix}')"
+
+    def exists(self, key):
+        """Whether the bucket holds key under the prefix."""
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}")
+        except self.client.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                return False
+            raise
+        return True
+
+    def read(self, key, start=0):
+        """Iterates over the bytes of the object key under the prefix from
+        offset start (with a range request), in chunks.
+        """
+        kwargs = {"Range": f"bytes={start}-"} if start else {}
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=f"{self.prefix}/{key}", **kwargs
+        )
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+    def write(self, key, path):
+        """Uploads the file at path to key under the prefix."""
+        self.client.upload_file(str(path), self.bucket, f"{self.prefix}/{key}")
+
+
+def store_from_url(url, profile=None):
+    """An S3Store for an s3://bucket/prefix URL, otherwise a LocalStore
+    for a directory.
+    """
+    if str(url).startswith("s3://"):
+        bucket, _, prefix = str(url)[len("s3://") :].partition("/")
+        return S3Store(bucket, prefix or "inputs/data", profile)
+    return LocalStore(url)
+
+
+def file_checksum(path):
+    """SHA-256 checksum of a file, as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(directory):
+    """Manifest of the size and checksum of every file in directory."""
+    directory = Path(directory)
+    return {
+        path.relative_to(directory).as_posix(): {
+            "size": path.stat().st_size,
+            "sha256": file_checksum(path),
+        }
+        for path in sorted(directory.rglob("*"))
+        if path.is_file()
+        and path.name not in _SYNC_FILES
+        and not path.name.endswith(PART_SUFFIX)
+    }
+
+
+def write_manifest(directory):
+    """Writes the manifest of the files in directory to its manifest.json,
+    to be pushed to the store with them. Returns the manifest.
+    """
+    manifest = build_manifest(directory)
+    _write_json(Path(directory) / MANIFEST_FILENAME, manifest)
+    return manifest
+
+
+def read_manifest(directory):
+    """The manifest kept in directory, or None if there isn't one."""
+    path = Path(directory) / MANIFEST_FILENAME
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    # Written to a temporary file then moved into place, as several
+    # processes may be verifying files at once
+    temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def _file_state(path):
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _record_verified(directory, records):
+    """Adds the checksums of verified files to directory's .verified.json."""
+    path = Path(directory) / VERIFIED_FILENAME
+    with _verified_lock:
+        verified = {}
+        if path.exists():
+            with open(path) as f:
+                verified = json.load(f)
+        verified.update(records)
+        _write_json(path, verified)
+
+
+def _recorded_checksum(path):
+    """Checksum recorded for a file when it was last verified, if it
+    hasn't changed since.
+    """
+    verified_path = path.parent / VERIFIED_FILENAME
+    if not verified_path.exists():
+        return None
+    with open(verified_path) as f:
+        record = json.load(f).get(path.name)
+    if record and record["state"] == _file_state(path):
+        return record["sha256"]
+    return None
+
+
+def verify_input(path):
+    """Checks an input file against the manifest in its directory, if
+    there is one and it lists the file. Raises a ValueError if its size
+    or checksum don't match.
+    Files are only hashed if they have changed since they were verified.
+    """
+    path = Path(path)
+    manifest = read_manifest(path.parent)
+    if not manifest or path.name not in manifest:
+        return
+    if not path.exists():
+        # Left to the reader, as some inputs are optional
+        return
+    expected = manifest[path.name]
+    state = _file_state(path)
+    if _verified.get(path) == (state, expected["sha256"]):
+        return
+    if state[0] != expected["size"]:
+        raise ValueError(
+            f"Input file {path} has {state[0]} bytes, not the "
+            f"{expected['size']} in the manifest; run sync-inputs"
+        )
+    checksum = _recorded_checksum(path)
+    if checksum is None:
+        checksum = file_checksum(path)
+        _record_verified(path.parent, {path.name: {"state": state, "sha256": checksum}})
+    if checksum != expected["sha256"]:
+        raise ValueError(
+            f"Input file {path} doesn't match its checksum in the manifest; "
+            "run sync-inputs"
+        )
+    _verified[path] = (state, expected["sha256"])
+
+
+def _download(store, key, expected, destination):
+    """Downloads an object to destination, resuming from a partial
+    download if there is one, and moves it into place once verified.
+    Returns "downloaded" or "resumed".
+    """
+    part_path = destination.with_name(destination.name + PART_SUFFIX)
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    start = part_path.stat().st_size if part_path.exists() else 0
+    if start > expected["size"]:
+        part_path.unlink()
+        start = 0
+    digest = hashlib.sha256()
+    if start:
+        # The checksum covers the whole file, so the part already
+        # downloaded is hashed first
+        with open(part_path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+    with open(part_path, "ab") as f:
+        if start < expected["size"]:
+            for chunk in store.read(key, start):
+                f.write(chunk)
+                digest.update(chunk)
+    if digest.hexdigest() != expected["sha256"]:
+        part_path.unlink()
+        raise ValueError(f"Checksum of {key} from {store} doesn't match the manifest")
+    os.replace(part_path, destination)
+    return "resumed" if start else "downloaded"
+
+
+def sync_inputs(store, directory=None, workers=DEFAULT_WORKERS, files=None):
+    """Downloads the files listed in the store's manifest (optionally only
+    those in files) to directory (default: inputs/data), skipping files
+    that already match the manifest.
+    Returns a dict of each file's status: "up to date", "downloaded",
+    "resumed" or the error it failed with. The manifest is only saved
+    in directory if every file was synced.
+    Raises a FileNotFoundError if the store has no manifest, i.e. it has
+    never been pushed to with push_inputs.
+    """
+    from la_funding_analysis import logger
+
+    if not store.exists(MANIFEST_FILENAME):
+        raise FileNotFoundError(
+            f"{store} has no {MANIFEST_FILENAME}; run push-inputs (make inputs-push) "
+            "from a complete copy of the inputs once to write it"
+        )
+    directory = Path(directory or PROJECT_DIR / "inputs/data")
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = json.loads(b"".join(store.read(MANIFEST_FILENAME)))
+    keys = [key for key in manifest if not files or key in files]
+
+    def sync(key):
+        destination = directory / key
+        expected = manifest[key]
+        if destination.exists() and destination.stat().st_size == expected["size"]:
+            checksum = _recorded_checksum(destination) or file_checksum(destination)
+            if checksum == expected["sha256"]:
+                return "up to date"
+        return _download(store, key, expected, destination)
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(sync, key) for key in keys}
+        for key, future in futures.items():
+            try:
+                statuses[key] = future.result()
+            except Exception as error:
+                statuses[key] = f"failed: {error}"
+            logger.info(f"{key}: {statuses[key]}")
+    synced = [key for key in keys if not statuses[key].startswith("failed")]
+    _record_verified(
+        directory,
+        {
+            key: {
+                "state": _file_state(directory / key),
+                "sha256": manifest[key]["sha256"],
+            }
+            for key in synced
+            if "/" not in key
+        },
+    )
+    if len(synced) == len(keys):
+        _write_json(directory / MANIFEST_FILENAME, manifest)
+    return statuses
+
+
+def push_inputs(store, directory=None, files=None):
+    """Writes the manifest of the files in directory (default: inputs/data)
+    and uploads them (optionally only those in files) and the manifest
+    to the store. Returns the manifest.
+    """
+    directory = Path(directory or PROJECT_DIR / "inputs/data")
+    manifest = write_manifest(directory)
+    for key in manifest:
+        if not files or key in files:
+            store.write(key, directory / key)
+    store.write(MANIFEST_FILENAME, directory / MANIFEST_FILENAME)
+    return manifest
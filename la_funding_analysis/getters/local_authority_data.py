@@ -2,17 +2,42 @@
 """Functions to import all data.
 """
 
+import io
+import json
+import os
+from pathlib import Path
+
 import pandas as pd
 
 from la_funding_analysis import PROJECT_DIR
+from la_funding_analysis.getters.input_sync import verify_input
+from la_funding_analysis.utils.instrumentation import instrumented
+
+# Environment variable naming a directory to read the inputs from instead
+# of inputs/data, e.g. one of synthetic inputs (see utils/synthetic_inputs.py)
+INPUT_DIR_VARIABLE = "LA_FUNDING_INPUT_DIR"
+
+
+def input_path(filename):
+    """Path of an input file, in the directory named by the
+    LA_FUNDING_INPUT_DIR environment variable if it is set,
+    otherwise in inputs/data. If the directory has a manifest from
+    syncing the inputs (see getters/input_sync.py), the file is first
+    checked against it.
+    """
+    input_dir = os.environ.get(INPUT_DIR_VARIABLE, PROJECT_DIR / "inputs/data")
+    path = Path(input_dir) / filename
+    verify_input(path)
+    return path
 
 
+@instrumented
 def get_fuel_poverty():
     """Fetches fuel poverty data. Also contains information about LA regional structure.
     Source: https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/981910/2021-sub-regional-fuel-poverty-tables.xlsx
     """
     fuel_poverty = pd.read_excel(
-        PROJECT_DIR / "inputs/data/2021-sub-regional-fuel-poverty-tables.xlsx",
+        input_path("2021-sub-regional-fuel-poverty-tables.xlsx"),
         sheet_name="Table 2",
         skiprows=2,
         skipfooter=7,
@@ -20,30 +45,31 @@ def get_fuel_poverty():
     return fuel_poverty
 
 
+@instrumented
 def get_parties_models():
     """Fetches data about LA model types (i.e. county, district etc.)
     and majority political parties as of August 2021.
     Source: http://opencouncildata.co.uk/csv1.php
     """
     parties_models = pd.read_csv(
-        PROJECT_DIR / "inputs/data/opencouncildata_councils.csv", usecols=[1, 2, 5]
+        input_path("opencouncildata_councils.csv"), usecols=[1, 2, 5]
     )
     return parties_models
 
 
+@instrumented
 def get_old_parties():
     """Fetches data about LA majority parties as of 2019.
     Source: http://opencouncildata.co.uk/downloads.php
     """
-    old_parties = pd.read_csv(
-        PROJECT_DIR / "inputs/data/history1973-2019.csv", usecols=[0, 3, 10]
-    )
+    old_parties = pd.read_csv(input_path("history1973-2019.csv"), usecols=[0, 3, 10])
     #
     old_parties = old_parties.loc[old_parties["Year"] == 2019].drop(columns="Year")
     #
     return old_parties
 
 
+@instrumented
 def get_imd():
     """Fetches data about LA IMD status.
     The "local concentration" measure is used -
@@ -51,13 +77,14 @@ def get_imd():
     Source: http://www.gov.uk/government/statistics/english-indices-of-deprivation-2019
     """
     imd = pd.read_csv(
-        PROJECT_DIR / "inputs/data/societal-wellbeing_imd2019_indicesbyla.csv",
+        input_path("societal-wellbeing_imd2019_indicesbyla.csv"),
         usecols=[1, 2],
         skiprows=7,
     )
     return imd
 
 
+@instrumented
 def get_grants():
     """Fetches data on which LAs received GHG and SHDF grants.
     Sources:
@@ -65,17 +92,88 @@ def get_grants():
     http://www.gov.uk/government/publications/social-housing-decarbonisation-fund-demonstrator-successful-bids
     """
     grants = pd.read_excel(
-        PROJECT_DIR / "inputs/data/Local_authorities_and_decarbonisation_schemes.xlsx",
+        input_path("Local_authorities_and_decarbonisation_schemes.xlsx"),
         dtype={"Local authority": str},
         skiprows=[1],
-        usecols="A:I",
     ).fillna(0)
     #
     return grants
 
 
+@instrumented
+def get_la_centroids():
+    """Fetches LA district centroids in British National Grid coordinates.
+    Source: https://geoportal.statistics.gov.uk/ (Local Authority Districts
+    (December 2021) Centroids)
+    """
+    centroids = pd.read_csv(
+        input_path("la_centroids.csv"),
+        usecols=["LAD21CD", "BNG_E", "BNG_N"],
+    )
+    return centroids
+
+
+@instrumented
+def get_la_boundaries():
+    """Fetches LA district boundaries as a GeoJSON dict, in British National
+    Grid coordinates and with each feature's code in its LAD21CD property.
+    Source: https://geoportal.statistics.gov.uk/ (Local Authority Districts
+    (December 2021) Boundaries UK BGC)
+    """
+    with open(input_path("la_boundaries.geojson")) as f:
+        boundaries = json.load(f)
+    return boundaries
+
+
+@instrumented
 def get_epc():
     """Fetches English LA EPC data. Quite big so takes a few seconds."""
-    epc = pd.read_csv(PROJECT_DIR / "inputs/data/epc.csv").drop(columns="Unnamed: 0")
+    epc = pd.read_csv(input_path("epc.csv")).drop(columns="Unnamed: 0")
     #
     return epc
+
+
+@instrumented
+def get_epc_chunks(chunksize=500_000, usecols=None):
+    """Fetches English LA EPC data as an iterator of DataFrames with
+    at most chunksize rows each, so that it can be processed
+    without holding the whole file in memory.
+    usecols optionally restricts the columns that are read.
+    """
+    reader = pd.read_csv(input_path("epc.csv"), chunksize=chunksize, usecols=usecols)
+    for chunk in reader:
+        yield chunk.drop(columns="Unnamed: 0", errors="ignore")
+
+
+def epc_shard_offsets(n_shards):
+    """Splits the EPC file into n_shards byte ranges of whole lines
+    (after the header), returned as a list of (start, end) offsets
+    for get_epc_shard. Assumes that no field contains a line break.
+    """
+    path = input_path("epc.csv")
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        f.readline()
+        offsets = [f.tell()]
+        for i in range(1, n_shards):
+            f.seek(max(offsets[-1], offsets[0] + (size - offsets[0]) * i // n_shards))
+            # Move on to the start of the next line
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+@instrumented
+def get_epc_shard(start, end, usecols=None):
+    """Fetches the EPC rows between byte offsets start and end of the
+    EPC file (see epc_shard_offsets), so that shards of the file can be
+    processed independently. usecols optionally restricts the columns
+    that are read.
+    """
+    with open(input_path("epc.csv"), "rb") as f:
+        header = f.readline()
+        f.seek(start)
+        rows = f.read(end - start)
+    shard = pd.read_csv(io.BytesIO(header + rows), usecols=usecols)
+    return shard.drop(columns="Unnamed: 0", errors="ignore")
@@ -0,0 +1,121 @@
+# File: pipeline/arrow_export.py
+"""Exports of the tidy LA dataset and the per-LA EPC aggregates as Parquet
+and Arrow IPC files in outputs/data, so that notebooks can load them
+without running the pipeline.
+String columns are dictionary-encoded, and pandas dtypes are restored
+on reading. The Arrow IPC files are uncompressed and hold one record
+batch, so read_arrow_table memory-maps them without copying, and numeric
+columns without missing values are read into NumPy as views of the file.
+"""
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from la_funding_analysis import PROJECT_DIR
+
+EXPORT_DIR = PROJECT_DIR / "outputs/data"
+
+# Exported file name (without suffix): data stage (see pipeline/stages.py)
+EXPORTS = {"la_tidy_data": "tidy_data", "la_epc": "epc"}
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def to_arrow_table(data):
+    """A DataFrame as an Arrow table with dictionary-encoded strings,
+    keeping the pandas metadata needed to restore its dtypes.
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+    return table.combine_chunks()
+
+
+def _write_atomically(path, write):
+    # Written to a temporary file then moved into place, so that readers
+    # with the old file memory-mapped keep a valid view of it
+    temporary_path = path.with_name(path.name + ".tmp")
+    write(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def write_arrow_files(data, directory, name, formats=FORMATS):
+    """Writes data to directory as name.parquet and/or name.arrow.
+    Returns the paths written.
+    """
+    table = to_arrow_table(data)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    if "parquet" in formats:
+        path = directory / f"{name}.parquet"
+        _write_atomically(path, lambda file: pq.write_table(table, file))
+        paths.append(path)
+    if "arrow" in formats:
+
+        def write_ipc(file):
+            with pa.OSFile(str(file), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=max(len(table), 1))
+
+        path = directory / f"{name}.arrow"
+        _write_atomically(path, write_ipc)
+        paths.append(path)
+    return paths
+
+
+def export_arrow(directory=EXPORT_DIR, formats=FORMATS, rebuild=False):
+    """Writes the tidy dataset and EPC aggregates (from the stage cache,
+    building them if needed or if rebuild is True) in each of formats.
+    Returns the paths written.
+    """
+    from la_funding_analysis.pipeline.stages import load_stage
+
+    paths = []
+    for name, stage in EXPORTS.items():
+        data = load_stage(stage, rebuild=rebuild)
+        paths += write_arrow_files(data, directory, name, formats)
+    return paths
+
+
+def read_arrow_table(path=EXPORT_DIR / "la_tidy_data.arrow", columns=None):
+    """Memory-maps an Arrow IPC file as an Arrow table, optionally with
+    only some columns. Its buffers point into the file, so nothing is
+    read until it is used.
+    """
+    table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_arrow(path=EXPORT_DIR / "la_tidy_data.arrow", columns=None):
+    """Reads an exported Arrow IPC file into a DataFrame with the dtypes
+    it was exported with.
+    """
+    table = read_arrow_table(path, columns)
+    data = table.to_pandas(split_blocks=True)
+    # Dictionary-encoded object columns are read as categoricals
+    for column in table.schema.pandas_metadata["columns"]:
+        name = column["name"]
+        if column["numpy_type"] == "object" and name in data.columns:
+            if isinstance(data[name].dtype, pd.CategoricalDtype):
+                data[name] = data[name].astype(object)
+    return data
+
+
+def read_arrow_arrays(path=EXPORT_DIR / "la_tidy_data.arrow", columns=None):
+    """Reads columns of an exported Arrow IPC file as NumPy arrays, which
+    are views of the memory-mapped file for numeric columns with no
+    missing values. Missing values in other columns become None, or NaN
+    in floating point columns.
+    """
+    table = read_arrow_table(path, columns)
+    arrays = {}
+    for name, column in zip(table.column_names, table.columns):
+        # Exports hold one chunk, which is used as is to avoid a copy
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        arrays[name] = column.to_numpy(zero_copy_only=False)
+    return arrays
@@ -0,0 +1,195 @@
+# File: pipeline/boundaries.py
+"""Functions to prepare LA boundaries for choropleth maps.
+Boundaries are read from inputs/data once, simplified at each of
+MAP_TOLERANCES and cached in outputs/cache as one .npz file of flat
+vertex arrays indexed by LA code, which is rebuilt if the boundary file
+changes. Maps (see choropleth in pipeline/plotters.py) join the tidy
+dataset to the boundaries on "code".
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from matplotlib.path import Path
+
+from la_funding_analysis import config
+from la_funding_analysis.getters.local_authority_data import (
+    get_la_boundaries,
+    input_path,
+)
+from la_funding_analysis.pipeline.stages import CACHE_DIR
+from la_funding_analysis.utils.geometry import (
+    orient_ring,
+    signed_ring_area,
+    simplify_line,
+)
+
+BOUNDARIES_FILENAME = "la_boundaries.geojson"
+BOUNDARIES_CACHE = CACHE_DIR / "la_boundaries.npz"
+
+# Simplification tolerances in metres, from most to least detailed
+MAP_TOLERANCES = config["map_tolerances"]
+
+# Boundaries at one tolerance. Rings are stored end to end in vertices
+# (each closed, starting at ring_starts[i]); ring_polygons gives each
+# ring's polygon (exterior ring first) and polygon_codes each polygon's
+# index in codes
+Boundaries = namedtuple(
+    "Boundaries", ["codes", "vertices", "ring_starts", "ring_polygons", "polygon_codes"]
+)
+
+# Boundaries loaded in this process, by cache path and tolerance
+_loaded_boundaries = {}
+
+
+def boundary_polygons(geojson, code_property="LAD21CD"):
+    """Dict of LA code: list of polygons, each a list of rings ((n, 2)
+    arrays, exterior ring first), from a GeoJSON feature collection.
+    """
+    polygons = {}
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        coordinates = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            coordinates = [coordinates]
+        polygons.setdefault(feature["properties"][code_property], []).extend(
+            [np.asarray(ring, dtype=float)[:, :2] for ring in polygon]
+            for polygon in coordinates
+        )
+    return polygons
+
+
+def simplify_polygons(polygons, tolerance):
+    """Simplifies each ring of each LA's polygons, dropping rings that
+    collapse to fewer than three distinct points. If every ring of an LA
+    collapses, its largest ring is kept unsimplified.
+    Exterior rings are oriented anticlockwise and holes clockwise.
+    """
+    simplified = {}
+    for code, la_polygons in polygons.items():
+        kept = []
+        for polygon in la_polygons:
+            rings = [simplify_line(ring, tolerance) for ring in polygon]
+            # Holes are dropped with their exterior ring
+            if len(rings[0]) >= 4:
+                kept.append(
+                    [orient_ring(rings[0])]
+                    + [
+                        orient_ring(ring, anticlockwise=False)
+                        for ring in rings[1:]
+                        if len(ring) >= 4
+                    ]
+                )
+        if not kept:
+            largest = max(
+                (polygon[0] for polygon in la_polygons),
+                key=lambda ring: abs(signed_ring_area(ring)),
+            )
+            kept = [[orient_ring(largest)]]
+        simplified[code] = kept
+    return simplified
+
+
+def _flatten(polygons):
+    """Flat arrays of a dict of code: polygons, as stored in the cache."""
+    codes = sorted(polygons)
+    rings, ring_polygons, polygon_codes = [], [], []
+    for code_index, code in enumerate(codes):
+        for polygon in polygons[code]:
+            ring_polygons += [len(polygon_codes)] * len(polygon)
+            polygon_codes.append(code_index)
+            rings += polygon
+    ring_starts = np.cumsum([0] + [len(ring) for ring in rings])
+    return Boundaries(
+        np.array(codes),
+        np.concatenate(rings).astype(np.float32),
+        ring_starts,
+        np.array(ring_polygons),
+        np.array(polygon_codes),
+    )
+
+
+def build_boundary_cache(
+    geojson=None, tolerances=MAP_TOLERANCES, cache_path=BOUNDARIES_CACHE
+):
+    """Simplifies the LA boundaries at each tolerance and saves them to
+    cache_path. geojson defaults to the boundaries in inputs/data.
+    Each tolerance is simplified from the result at the previous (smaller)
+    one rather than the full boundaries, which is much faster and moves
+    points by at most the sum of the tolerances.
+    Returns the path of the cache.
+    """
+    polygons = boundary_polygons(geojson or get_la_boundaries())
+    arrays = {"tolerances": np.array(tolerances), "source": _source_stamp()}
+    for tolerance in sorted(tolerances):
+        polygons = simplify_polygons(polygons, tolerance)
+        boundaries = _flatten(polygons)
+        arrays.update(
+            {
+                f"{field}_{tolerance}": value
+                for field, value in boundaries._asdict().items()
+            }
+        )
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, **arrays)
+    _loaded_boundaries.clear()
+    return cache_path
+
+
+def _source_stamp():
+    """Size and modification time of the boundary file, used to
+    tell whether the cache is out of date.
+    """
+    path = input_path(BOUNDARIES_FILENAME)
+    if not path.exists():
+        return np.array([0, 0])
+    stat = path.stat()
+    return np.array([stat.st_size, stat.st_mtime_ns])
+
+
+def load_boundaries(tolerance=500, rebuild=False, cache_path=BOUNDARIES_CACHE):
+    """Boundaries simplified at tolerance (one of MAP_TOLERANCES), from
+    this process's memory or the cache at cache_path, which is built first
+    if it is missing, out of date or rebuild is True.
+    """
+    if (cache_path, tolerance) in _loaded_boundaries and not rebuild:
+        return _loaded_boundaries[cache_path, tolerance]
+    if rebuild or not cache_path.exists():
+        build_boundary_cache(cache_path=cache_path)
+    with np.load(cache_path) as cache:
+        stale = input_path(BOUNDARIES_FILENAME).exists() and not np.array_equal(
+            cache["source"], _source_stamp()
+        )
+        if not stale:
+            if tolerance not in cache["tolerances"]:
+                raise ValueError(
+                    f"No boundaries cached at tolerance {tolerance}, "
+                    f"choose from {list(cache['tolerances'])}"
+                )
+            boundaries = Boundaries(
+                *(cache[f"{field}_{tolerance}"] for field in Boundaries._fields)
+            )
+    # Rebuilt once the out of date cache file is closed
+    if stale:
+        return load_boundaries(tolerance, rebuild=True, cache_path=cache_path)
+    _loaded_boundaries[cache_path, tolerance] = boundaries
+    return boundaries
+
+
+def boundary_paths(boundaries):
+    """One matplotlib Path per polygon (holes included), and the index in
+    boundaries.codes of each polygon's LA.
+    """
+    path_codes = np.full(len(boundaries.vertices), Path.LINETO, dtype=Path.code_type)
+    path_codes[boundaries.ring_starts[:-1]] = Path.MOVETO
+    path_codes[boundaries.ring_starts[1:] - 1] = Path.CLOSEPOLY
+    # Each polygon's vertices run from the start of its first ring
+    # to the end of its last
+    first_rings = np.flatnonzero(np.diff(boundaries.ring_polygons, prepend=-1))
+    starts = boundaries.ring_starts[first_rings]
+    ends = np.append(starts[1:], len(boundaries.vertices))
+    paths = [
+        Path(boundaries.vertices[start:end], path_codes[start:end])
+        for start, end in zip(starts, ends)
+    ]
+    return paths, boundaries.polygon_codes
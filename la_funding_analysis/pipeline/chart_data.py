@@ -0,0 +1,228 @@
+# File: pipeline/chart_data.py
+"""Functions computing the aggregate table behind each chart.
+These only read from the tidy dataset - they never add columns to it
+or modify it - and their results are memoized by a hash of the dataset's
+contents and the function's parameters, so re-drawing or restyling a chart
+doesn't recompute its groupbys.
+"""
+
+import hashlib
+import inspect
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+# Memoized tables, most recently used last
+_table_cache = OrderedDict()
+CACHE_SIZE = 256
+
+
+def dataset_hash(data):
+    """Hash of a DataFrame's contents, index, column names and dtypes."""
+    digest = hashlib.sha1()
+    digest.update(str(list(zip(data.columns, data.dtypes.astype(str)))).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def memoize_by_dataset(function):
+    """Decorator memoizing a chart table function of (data, **parameters)
+    by the hash of data and the parameter values.
+    Returns a copy of the cached table, so callers can't alter the cache.
+    """
+    signature = inspect.signature(function)
+
+    def cache_key(data, *args, **kwargs):
+        arguments = signature.bind(data, *args, **kwargs)
+        arguments.apply_defaults()
+        parameters = tuple(
+            (name, value)
+            for name, value in arguments.arguments.items()
+            if name != "data"
+        )
+        return (function.__name__, dataset_hash(data), parameters)
+
+    @wraps(function)
+    def memoized(data, *args, **kwargs):
+        key = cache_key(data, *args, **kwargs)
+        if key in _table_cache:
+            _table_cache.move_to_end(key)
+        else:
+            _table_cache[key] = function(data, *args, **kwargs)
+            if len(_table_cache) > CACHE_SIZE:
+                _table_cache.popitem(last=False)
+        return _table_cache[key].copy()
+
+    memoized.cache_key = cache_key
+    return memoized
+
+
+def clear_chart_data_cache():
+    """Empties the memoized chart tables."""
+    _table_cache.clear()
+
+
+@memoize_by_dataset
+def grant_type_subtotals(data, factor):
+    """Number of grants of each type awarded to individual LAs and
+    consortium leads (no members) in each level of factor,
+    sorted by the total number of such grants.
+    """
+    return (
+        data.groupby(factor)[
+            ["1a_no_members", "1b_no_members", "SHDDF", "all_no_members"]
+        ]
+        .sum()
+        .sort_values("all_no_members")
+        .drop(columns="all_no_members")
+        .rename(
+            columns={
+                "1a_no_members": "GHG LAD 1a",
+                "1b_no_members": "GHG LAD 1b",
+            }
+        )
+    )
+
+
+@memoize_by_dataset
+def grant_count_proportions(data, factor, max_grants=4):
+    """Proportion of LAs in each level of factor receiving each number of
+    grants (max_grants down to 0, one column each). The index labels
+    each level with its number of LAs, e.g. "London (33)".
+    Sorted by the proportion receiving no grants, largest first.
+    """
+    # Grouped without copying data; LAs with no level of factor are
+    # dropped by the groupby. Count codes to ensure non-LAs are excluded
+    la_counts = data.groupby(factor, observed=True)["code"].count()
+    num_grants = (
+        data.groupby([factor, "total_grants"], observed=True)
+        .size()
+        .unstack("total_grants", fill_value=0)
+        .reindex(columns=range(max_grants, -1, -1), fill_value=0)
+    )
+    prop_grants = num_grants.div(num_grants.sum(axis=1), axis=0)
+    prop_grants.columns = list(prop_grants.columns)
+    prop_grants.index = [f"{level} ({la_counts[level]})" for level in prop_grants.index]
+    return prop_grants.rename_axis("new_index").sort_values(0, ascending=False)
+
+
+@memoize_by_dataset
+def applicant_type_rates(data, factor):
+    """Proportion of LAs in each level of factor that received any grant,
+    and that were an individual LA or consortium lead.
+    """
+    counts = pd.DataFrame(
+        {
+            "Individual or consortium lead only": data["all_no_members"] >= 1,
+            "Individual/lead/consortium member": data["total_grants"] >= 1,
+            factor: data[factor],
+        }
+    )
+    return counts.groupby(factor).mean()
+
+
+@memoize_by_dataset
+def values_by_receipt_status(data, factor):
+    """The values of factor for each LA alongside whether or not it
+    received at least one grant of any type ("Yes"/"No").
+    """
+    return pd.DataFrame(
+        {
+            factor: data[factor],
+            "Received at least one grant": np.where(
+                data["total_grants"] >= 1, "Yes", "No"
+            ),
+        }
+    )
+
+
+def compute_tables(data, tables):
+    """Computes (or fetches from the cache) each of tables, a list of
+    (table function name, keyword arguments), and returns their cache
+    entries so that they can be loaded into other processes' caches.
+    """
+    entries = {}
+    for function, kwargs in tables:
+        globals()[function](data, **kwargs)
+        key = globals()[function].cache_key(data, **kwargs)
+        entries[key] = _table_cache[key]
+    return entries
+
+
+def load_tables(entries):
+    """Adds entries returned by compute_tables to this process's cache."""
+    _table_cache.update(entries)
+
+
+# FACETED TABLES
+# Computed for several factors at once by melting the tidy dataset into
+# one row per LA and factor, then grouping by (factor, level) in one pass.
+# Tables are indexed by (facet, level), with facets in the order given.
+
+
+def _melt_factors(data, factors, columns):
+    """One row per LA and factor, with the factor's name ("facet"), the
+    LA's level of that factor ("level") and columns.
+    LAs with no level for a factor are dropped from that facet.
+    """
+    long = data.melt(
+        id_vars=columns,
+        value_vars=list(factors),
+        var_name="facet",
+        value_name="level",
+    ).dropna(subset=["level"])
+    long["facet"] = pd.Categorical(long["facet"], categories=list(factors))
+    return long
+
+
+@memoize_by_dataset
+def faceted_grant_type_subtotals(data, factors):
+    """grant_type_subtotals for each of factors (a tuple), computed in one
+    pass and sorted within each facet.
+    """
+    columns = ["1a_no_members", "1b_no_members", "SHDDF", "all_no_members"]
+    subtotals = (
+        _melt_factors(data, factors, columns)
+        .groupby(["facet", "level"], observed=True)[columns]
+        .sum()
+        .sort_values("all_no_members")
+        .sort_index(level="facet", sort_remaining=False, kind="stable")
+    )
+    return subtotals.drop(columns="all_no_members").rename(
+        columns={"1a_no_members": "GHG LAD 1a", "1b_no_members": "GHG LAD 1b"}
+    )
+
+
+@memoize_by_dataset
+def faceted_grant_count_proportions(data, factors, max_grants=4):
+    """grant_count_proportions for each of factors (a tuple), computed in
+    one pass and sorted within each facet.
+    """
+    long = _melt_factors(data, factors, ["code", "total_grants"])
+    grouped = long.groupby(["facet", "level"], observed=True)
+    la_counts = grouped["code"].count()
+    num_grants = (
+        long.groupby(["facet", "level", "total_grants"], observed=True)
+        .size()
+        .unstack("total_grants", fill_value=0)
+        .reindex(columns=range(max_grants, -1, -1), fill_value=0)
+    )
+    prop_grants = num_grants.div(num_grants.sum(axis=1), axis=0)
+    prop_grants.columns = list(prop_grants.columns)
+    prop_grants.index = pd.MultiIndex.from_arrays(
+        [
+            prop_grants.index.get_level_values("facet"),
+            [
+                f"{level} ({la_counts[key]})"
+                for key, level in zip(
+                    prop_grants.index, prop_grants.index.get_level_values("level")
+                )
+            ],
+        ],
+        names=["facet", "new_index"],
+    )
+    return prop_grants.sort_values(0, ascending=False).sort_index(
+        level="facet", sort_remaining=False, kind="stable"
+    )
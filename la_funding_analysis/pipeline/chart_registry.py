@@ -0,0 +1,190 @@
+# File: pipeline/chart_registry.py
+"""Loads and validates the chart registry in config/base.yaml.
+Each chart in the registry is a config entry giving a plotting function
+from pipeline/plotters.py and its arguments, so that charts can be added
+or changed without editing any Python. Chart matrices are expanded into
+one chart per plotting function and factor.
+Plotting functions are described here by name rather than imported,
+so that the registry can be loaded without importing matplotlib.
+"""
+
+from collections import namedtuple
+
+# Arguments each plotting function takes (besides the data), and the
+# function in pipeline/chart_data.py computing its table, if any
+PlotType = namedtuple("PlotType", ["required", "optional", "table"])
+
+PLOT_TYPES = {
+    "stacked_no_members_by_grant_type": PlotType(
+        ["factor", "graph_ylabel", "graph_title"], [], "grant_type_subtotals"
+    ),
+    "proportion_by_number_of_grants": PlotType(
+        ["factor", "graph_ylabel", "graph_title"], [], "grant_count_proportions"
+    ),
+    "dual_bar_by_applicant_type": PlotType(
+        ["factor", "graph_ylabel", "graph_title"], [], "applicant_type_rates"
+    ),
+    "boxplot_by_receipt_status": PlotType(
+        ["factor", "graph_ylabel", "graph_title"], [], "values_by_receipt_status"
+    ),
+    "faceted_stacked_no_members_by_grant_type": PlotType(
+        ["factors", "graph_ylabels", "graph_title"],
+        [],
+        "faceted_grant_type_subtotals",
+    ),
+    "faceted_proportion_by_number_of_grants": PlotType(
+        ["factors", "graph_ylabels", "graph_title"],
+        [],
+        "faceted_grant_count_proportions",
+    ),
+    "imd_strip_plot": PlotType([], [], None),
+    "fp_clusters_strip_plot": PlotType(
+        [],
+        [
+            "top_left_grants",
+            "top_left_min_fp",
+            "middle_right_grants",
+            "middle_right_max_fp",
+        ],
+        None,
+    ),
+    "westmids_london_fp_strip_plot": PlotType([], [], None),
+    "improvable_strip_plot": PlotType(["factor"], [], None),
+    "choropleth": PlotType(
+        ["column"], ["graph_title", "legend_label", "tolerance", "cmap"], None
+    ),
+}
+
+IMPROVABLE_FACTORS = ["total_improvable", "prop_improvable"]
+
+# A chart's plotting function, its arguments and the file suffixes to save
+Chart = namedtuple("Chart", ["plot", "kwargs", "formats"])
+
+
+def expand_chart_matrix(matrix):
+    """Expands a chart matrix into a dict of chart name: chart entry,
+    with one chart per plotting function and factor.
+    String values are filled in with {plot}, {factor} and the factor's
+    variables.
+    """
+    template = {
+        key: value
+        for key, value in matrix.items()
+        if key not in ["name", "plots", "factors"]
+    }
+    charts = {}
+    for plot in matrix["plots"]:
+        for factor, variables in matrix["factors"].items():
+            variables = dict(variables or {}, plot=plot, factor=factor)
+            entry = {
+                key: value.format(**variables) if isinstance(value, str) else value
+                for key, value in template.items()
+            }
+            charts[matrix["name"].format(**variables)] = dict(
+                entry, plot=plot, factor=factor
+            )
+    return charts
+
+
+def chart_entry_errors(name, entry, map_tolerances=()):
+    """Problems with a chart's config entry, as a list of messages.
+    map_tolerances are the tolerances at which map boundaries are cached.
+    """
+    if not isinstance(entry, dict):
+        return [f"{name}: entry must be a mapping"]
+    plot = entry.get("plot")
+    if plot not in PLOT_TYPES:
+        return [f"{name}: unknown plot type {plot!r}"]
+    plot_type = PLOT_TYPES[plot]
+    arguments = set(entry) - {"plot", "formats"}
+    errors = [
+        f"{name}: missing {argument!r} for {plot}"
+        for argument in plot_type.required
+        if argument not in arguments
+    ]
+    errors += [
+        f"{name}: {plot} has no argument {argument!r}"
+        for argument in sorted(
+            arguments - set(plot_type.required) - set(plot_type.optional)
+        )
+    ]
+    if plot == "choropleth" and entry.get("tolerance", 500) not in map_tolerances:
+        errors.append(f"{name}: tolerance must be one of {map_tolerances}")
+    if "factor" in entry and not isinstance(entry["factor"], str):
+        errors.append(f"{name}: factor must be a column name")
+    if "factors" in entry:
+        factors = entry["factors"]
+        if not isinstance(factors, list) or not all(
+            isinstance(factor, str) for factor in factors
+        ):
+            errors.append(f"{name}: factors must be a list of column names")
+        elif len(entry.get("graph_ylabels") or []) != len(factors):
+            errors.append(f"{name}: graph_ylabels must give one label per factor")
+    if plot == "improvable_strip_plot" and entry.get("factor") not in (
+        IMPROVABLE_FACTORS
+    ):
+        errors.append(f"{name}: factor must be one of {IMPROVABLE_FACTORS}")
+    formats = entry.get("formats", [])
+    if not isinstance(formats, list) or not all(
+        isinstance(suffix, str) and suffix.startswith(".") for suffix in formats
+    ):
+        errors.append(f"{name}: formats must be a list of suffixes like .png")
+    return errors
+
+
+def load_chart_registry(config=None):
+    """Reads and validates the charts and chart matrices in config
+    (defaults to config/base.yaml), returning a dict of chart name: Chart
+    in config order, followed by the charts from any matrices.
+    Raises ValueError listing every problem if the registry is invalid.
+    """
+    if config is None:
+        from la_funding_analysis import config
+    entries = dict(config.get("charts") or {})
+    errors = []
+    for matrix in config.get("chart_matrices") or []:
+        missing = {"name", "plots", "factors"} - set(matrix)
+        if missing:
+            errors.append(f"Chart matrix is missing {', '.join(sorted(missing))}")
+            continue
+        for name, entry in expand_chart_matrix(matrix).items():
+            if name in entries:
+                errors.append(f"{name}: defined more than once")
+            entries[name] = entry
+    for name, entry in entries.items():
+        errors += chart_entry_errors(name, entry, config.get("map_tolerances", []))
+    if errors:
+        raise ValueError("Invalid chart registry:\n" + "\n".join(errors))
+    default_formats = config.get("chart_formats", [".png", ".svg"])
+    return {
+        name: Chart(
+            entry["plot"],
+            {
+                key: value
+                for key, value in entry.items()
+                if key not in ["plot", "formats"]
+            },
+            entry.get("formats", default_formats),
+        )
+        for name, entry in entries.items()
+    }
+
+
+def chart_tables(jobs):
+    """The distinct tables (chart_data function name, arguments) needed
+    by a list of chart jobs, so that tables shared by several charts
+    are only computed once.
+    """
+    tables = []
+    for plot, kwargs, _, _ in jobs:
+        table = PLOT_TYPES[plot].table
+        if not table:
+            continue
+        if "factors" in kwargs:
+            # Faceted tables are memoized by a tuple of factors
+            table = (table, {"factors": tuple(kwargs["factors"])})
+        else:
+            table = (table, {"factor": kwargs["factor"]})
+        if table not in tables:
+            tables.append(table)
+    return tables
@@ -8,19 +8,36 @@ import pandas as pd
 
 from la_funding_analysis.getters.local_authority_data import (
     get_epc,
+    get_epc_chunks,
     get_grants,
     get_imd,
+    get_la_centroids,
     get_old_parties,
     get_parties_models,
     get_fuel_poverty,
 )
+from la_funding_analysis.utils.instrumentation import instrumented
 from la_funding_analysis.utils.name_cleaners import (
     clean_names,
     model_type,
     strip_and_titlecase,
 )
+from la_funding_analysis.utils.quantile_sketch import KLLSketch
 
+# Continuous EPC fields that are summarised per LA with quantile sketches,
+# mapped to the short names used in the clean data
+EPC_SKETCH_COLUMNS = {
+    "CO2_EMISS_CURR_PER_FLOOR_AREA": "co2_per_floor_area",
+    "ENERGY_CONSUMPTION_CURRENT": "energy_consumption",
+    "TOTAL_FLOOR_AREA": "floor_area",
+}
 
+# There are two different strings signifying socially rented
+# in the TENURE column of the EPC data
+SOCIAL_TENURES = ["rental (social)", "Rented (social)"]
+
+
+@instrumented
 def get_clean_fuel_poverty():
     """Gets and cleans fuel poverty dataset."""
     fuel_poverty = get_fuel_poverty()
@@ -112,6 +129,7 @@ def get_clean_fuel_poverty():
     return fuel_poverty
 
 
+@instrumented
 def get_clean_parties_models():
     """Gets and cleans current LA majority party and model (e.g. county, district) data."""
     parties_models = get_parties_models()
@@ -137,6 +155,7 @@ def get_clean_parties_models():
     return parties_models
 
 
+@instrumented
 def get_clean_old_parties():
     """Gets and cleans data about political majorities as of August 2020."""
     op = get_old_parties()
@@ -146,6 +165,7 @@ def get_clean_old_parties():
     return op
 
 
+@instrumented
 def get_clean_imd():
     """Gets and cleans IMD data."""
     imd = get_imd()
@@ -162,66 +182,104 @@ def get_clean_imd():
     return imd
 
 
+def grant_schemes():
+    """The scheme, round and role of the grants counted in each column of
+    the grants data (see grant_columns in config/base.yaml), with the name
+    of the column holding them in the tidy data: <scheme>_<round>_<role>,
+    leaving out any that are missing (e.g. GHG_1a_leads or SHDDF).
+    """
+    from la_funding_analysis import config
+
+    schemes = pd.DataFrame.from_dict(
+        config["grant_columns"], orient="index", columns=["scheme", "round", "role"]
+    )
+    schemes = schemes.rename_axis("source_column").reset_index()
+    # Rounds such as 2 are read from the config as numbers
+    schemes[["round", "role"]] = schemes[["round", "role"]].applymap(
+        lambda value: None if pd.isna(value) else str(value)
+    )
+    schemes["column"] = [
+        "_".join(part for part in parts if part)
+        for parts in schemes[["scheme", "round", "role"]].itertuples(index=False)
+    ]
+    return schemes
+
+
+@instrumented
 def get_clean_grants():
-    """Gets and cleans data on grants received by LAs."""
+    """Gets and cleans data on grants received by LAs, in long form:
+    one row per LA (by clean_name), scheme, round and role with the
+    number of grants, leaving out those with none. round and role are
+    missing for schemes without rounds or roles.
+    """
     grants = get_grants()
-    grants = grants.rename(
-        columns={
-            "Local authority": "full_name",
-            "GHG LADS 1a": "GHG_1a_individuals",
-            "1a Consortium Leads": "GHG_1a_leads",
-            "1a Consortium bodies": "GHG_1a_bodies",
-            "GHG LADS 1b": "GHG_1b_individuals",
-            "1b Consortium leads": "GHG_1b_leads",
-            "1b Consortium bodies": "GHG_1b_bodies",
-            "Social Housing Decarbonisation Fund - Demonstrator ": "SHDDF",
-            "Total": "total_grants",
-        }
+    grants.columns = grants.columns.str.strip()
+    schemes = grant_schemes()
+    grants = grants.rename(columns={"Local authority": "full_name"}).melt(
+        id_vars="full_name",
+        value_vars=list(schemes["source_column"]),
+        var_name="source_column",
+        value_name="amount",
     )
+    grants = grants.loc[grants["amount"] != 0]
     #
-    # Some regions appear twice in the grants data
-    duplicate_strings = ["Greenwich", "Lewisham", "Redbridge"]
-    regex_exp = "|".join(duplicate_strings)
-    clean_grants = grants[~grants["full_name"].str.contains(regex_exp, regex=True)]
-    #
-    for string in duplicate_strings:
-        duplicate_df = grants[grants["full_name"].str.contains(string)]
-        replacement_row = duplicate_df.iloc[0] + duplicate_df.iloc[1]
-        replacement_row["full_name"] = string
-        clean_grants = clean_grants.append(replacement_row, ignore_index=True)
+    # Some regions appear twice in the grants data, so their grants
+    # are added together below
+    for string in ["Greenwich", "Lewisham", "Redbridge"]:
+        grants.loc[grants["full_name"].str.contains(string), "full_name"] = string
     #
     # Babergh and Mid Suffolk are shown in one row in the grants data,
     # but they are actually two different LAs - the stated grants
     # apply to both individually
-    babergh_ms = clean_grants[
-        [("Babergh and Mid Suffolk" in name) for name in clean_grants["full_name"]]
-    ]
-    babergh = babergh_ms.copy()
-    babergh["full_name"] = "Babergh"
-    ms = babergh_ms.copy()
-    ms["full_name"] = "Mid Suffolk"
-    clean_grants = (
-        clean_grants[
-            [
-                ("Babergh and Mid Suffolk" not in name)
-                for name in clean_grants["full_name"]
-            ]
+    babergh_ms = grants["full_name"].str.contains("Babergh and Mid Suffolk")
+    grants = pd.concat(
+        [
+            grants.loc[~babergh_ms],
+            grants.loc[babergh_ms].assign(full_name="Babergh"),
+            grants.loc[babergh_ms].assign(full_name="Mid Suffolk"),
         ]
-        .append(babergh)
-        .append(ms)
-        .reset_index(drop=True)
     )
     #
     # As before, apply clean_names in order to join data
-    clean_grants["clean_name"] = clean_grants["full_name"].apply(clean_names)
-    clean_grants = clean_grants.drop(columns="full_name")
+    grants["clean_name"] = grants["full_name"].apply(clean_names)
+    grants = grants.merge(schemes.drop(columns="column"), on="source_column")
+    clean_grants = (
+        grants.groupby(
+            ["clean_name", "scheme", "round", "role"], dropna=False, sort=False
+        )["amount"]
+        .sum()
+        .reset_index()
+    )
+    clean_grants["amount"] = clean_grants["amount"].astype(int)
     #
     return clean_grants
 
 
-def get_clean_epc():
+@instrumented
+def get_clean_la_centroids():
+    """Gets and cleans LA centroid coordinates (in metres)."""
+    centroids = get_la_centroids().rename(
+        columns={"LAD21CD": "code", "BNG_E": "easting", "BNG_N": "northing"}
+    )
+    return centroids.drop_duplicates(subset="code").reset_index(drop=True)
+
+
+def is_improvable(epc):
+    """Flags EPCs that are currently D or below
+    and have the potential to be C or above.
+    """
+    return (epc["CURRENT_ENERGY_RATING"].isin(["G", "F", "E", "D"])) & (
+        epc["POTENTIAL_ENERGY_RATING"].isin(["C", "B", "A"])
+    )
+
+
+@instrumented
+def get_clean_epc(sketch_quantiles=None):
     """Processes EPC dataset to obtain median EPC for each LA
     and counts/proportions of improvable social housing.
+    If a list of quantiles is given (e.g. [0.25, 0.5, 0.75]),
+    these quantiles of the continuous fields in EPC_SKETCH_COLUMNS
+    are also added for each LA, estimated with quantile sketches.
     """
     epc = get_epc()
     #
@@ -236,13 +294,9 @@ def get_clean_epc():
     # (socially rented dwellings that are currently EPC D or below,
     # and have the potential to be C or above)
     #
-    # There are two different strings signifying socially rented
-    # in the TENURE column of the EPC data:
-    epc_social = epc.loc[epc["TENURE"].isin(["rental (social)", "Rented (social)"])]
-    #
-    epc_social["is_improvable"] = (
-        epc_social["CURRENT_ENERGY_RATING"].isin(["G", "F", "E", "D"])
-    ) & (epc_social["POTENTIAL_ENERGY_RATING"].isin(["C", "B", "A"]))
+    epc_social = epc.loc[epc["TENURE"].isin(SOCIAL_TENURES)].assign(
+        is_improvable=lambda social: is_improvable(social)
+    )
     #
     # Find the numbers of improvable / not improvable social houses in each LA
     potential_counts = (
@@ -268,4 +322,150 @@ def get_clean_epc():
         columns={"LOCAL_AUTHORITY": "code"}
     )
     #
+    if sketch_quantiles is not None:
+        sketches = update_epc_sketches({}, epc)
+        clean_epc = clean_epc.merge(
+            epc_sketch_quantiles(sketches, sketch_quantiles), how="left", on="code"
+        )
+    #
     return clean_epc
+
+
+# Columns of the EPC data needed to compute the clean EPC data
+EPC_CLEANING_COLUMNS = [
+    "LOCAL_AUTHORITY",
+    "CURRENT_ENERGY_EFFICIENCY",
+    "CURRENT_ENERGY_RATING",
+    "POTENTIAL_ENERGY_RATING",
+    "TENURE",
+]
+
+
+def epc_aggregates(epc):
+    """Counts from a shard of the EPC data that can be added up across
+    shards and turned into the clean EPC data with clean_epc_from_aggregates:
+    the number of EPCs with each energy efficiency score in each LA, and
+    the numbers of improvable and not improvable socially rented homes.
+    Returns a dict of the two count Series.
+    """
+    epc_social = epc.loc[epc["TENURE"].isin(SOCIAL_TENURES)]
+    return {
+        "efficiency_counts": epc.groupby(
+            ["LOCAL_AUTHORITY", "CURRENT_ENERGY_EFFICIENCY"]
+        ).size(),
+        "improvable_counts": epc_social.groupby(
+            [epc_social["LOCAL_AUTHORITY"], is_improvable(epc_social)]
+        ).size(),
+    }
+
+
+def _median_from_counts(counts):
+    """Median value in each group from a Series of counts indexed
+    by (group, value), as np.median would give for the values.
+    """
+    counts = counts.sort_index()
+    totals = counts.groupby(level=0).transform("sum")
+    cumulative = counts.groupby(level=0).cumsum()
+    values = pd.Series(counts.index.get_level_values(1), index=counts.index)
+    # First values past the lower and upper middle positions
+    lower = values[cumulative > (totals - 1) // 2].groupby(level=0).first()
+    upper = values[cumulative > totals // 2].groupby(level=0).first()
+    return (lower + upper) / 2
+
+
+def clean_epc_from_aggregates(aggregates):
+    """Adds up a list of epc_aggregates from shards of the EPC data and
+    computes the same median EPC and improvable social housing counts and
+    proportions per LA as get_clean_epc.
+    """
+    efficiency_counts = pd.concat([a["efficiency_counts"] for a in aggregates])
+    improvable_counts = pd.concat([a["improvable_counts"] for a in aggregates])
+    epc_medians = (
+        _median_from_counts(efficiency_counts.groupby(level=[0, 1]).sum())
+        .rename_axis("LOCAL_AUTHORITY")
+        .reset_index(name="median_energy_efficiency")
+    )
+    # LAs with no improvable (or no unimprovable) social housing have NaN
+    # counts, as in get_clean_epc
+    potential_counts = (
+        improvable_counts.groupby(level=[0, 1])
+        .sum()
+        .unstack()
+        .reindex(columns=[False, True])
+        .rename(columns={True: "total_improvable", False: "total_not_improvable"})
+    )
+    potential_counts.columns.name = None
+    potential_counts["total_social"] = potential_counts.sum(axis=1)
+    potential_counts["prop_improvable"] = (
+        potential_counts["total_improvable"] / potential_counts["total_social"]
+    )
+    potential_counts = potential_counts.rename_axis("LOCAL_AUTHORITY").reset_index()[
+        ["LOCAL_AUTHORITY", "total_improvable", "prop_improvable"]
+    ]
+    return epc_medians.merge(potential_counts, on="LOCAL_AUTHORITY").rename(
+        columns={"LOCAL_AUTHORITY": "code"}
+    )
+
+
+def update_epc_sketches(sketches, epc, columns=EPC_SKETCH_COLUMNS, k=200):
+    """Updates a dict of per-LA quantile sketches
+    ({LA code: {EPC column: KLLSketch}}) with a chunk of EPC rows.
+    The dict is updated in place and also returned.
+    """
+    for code, la_epc in epc.groupby("LOCAL_AUTHORITY"):
+        la_sketches = sketches.setdefault(code, {})
+        for column in columns:
+            if column not in la_sketches:
+                la_sketches[column] = KLLSketch(k=k)
+            la_sketches[column].update(la_epc[column].to_numpy())
+    return sketches
+
+
+def merge_epc_sketches(sketches, other):
+    """Merges per-LA quantile sketches built on another chunk or shard
+    of the EPC data into sketches (in place), and returns the result.
+    """
+    for code, other_la_sketches in other.items():
+        la_sketches = sketches.setdefault(code, {})
+        for column, sketch in other_la_sketches.items():
+            if column in la_sketches:
+                la_sketches[column].merge(sketch)
+            else:
+                la_sketches[column] = sketch
+    return sketches
+
+
+@instrumented
+def get_epc_sketches(columns=EPC_SKETCH_COLUMNS, k=200, chunksize=500_000):
+    """Streams the EPC dataset in chunks and builds quantile sketches
+    of the given continuous columns for each LA.
+    Memory use is bounded by the chunk size and the sketch size k,
+    not by the size of the EPC file.
+    """
+    sketches = {}
+    for epc in get_epc_chunks(
+        chunksize=chunksize, usecols=["LOCAL_AUTHORITY"] + list(columns)
+    ):
+        update_epc_sketches(sketches, epc, columns=columns, k=k)
+    return sketches
+
+
+def epc_sketch_quantiles(sketches, quantiles, columns=EPC_SKETCH_COLUMNS):
+    """Queries per-LA sketches for the given quantiles (one or a sequence)
+    and returns a DataFrame with one row per LA code and one column per
+    (field, quantile), e.g. "floor_area_q50" for the median floor area.
+    """
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+    records = {}
+    for code, la_sketches in sketches.items():
+        record = {}
+        for column, short_name in columns.items():
+            values = la_sketches[column].quantile(quantiles)
+            for q, value in zip(quantiles, values):
+                record[f"{short_name}_q{100 * q:g}"] = value
+        records[code] = record
+    return (
+        pd.DataFrame.from_dict(records, orient="index")
+        .rename_axis("code")
+        .reset_index()
+    )
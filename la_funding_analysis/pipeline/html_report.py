@@ -0,0 +1,408 @@
+# File: pipeline/html_report.py
+"""Builds a self-contained HTML report of the analysis in
+outputs/reports/report.html: tables of grant counts by region, LA model
+and majority party, the LAs with the most improvable social housing that
+didn't receive SHDDF, every chart in the registry (embedded as PNG) and
+metadata about the cached data stages.
+Each section is built separately, in parallel worker processes, as an
+HTML fragment kept in outputs/reports/sections. As with the figure
+manifest (see pipeline/manifest.py), each fragment is recorded in
+sections/manifest.json with a hash of the section's inputs and this
+module's code, and only sections whose fragment is missing or out of
+date are rebuilt before the fragments are put together.
+"""
+
+import base64
+import hashlib
+import html
+import json
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from la_funding_analysis import logger, PROJECT_DIR
+from la_funding_analysis.pipeline.chart_data import dataset_hash
+from la_funding_analysis.pipeline.stages import cache_path, STAGES
+
+REPORT_DIR = PROJECT_DIR / "outputs/reports"
+REPORT_FILENAME = "report.html"
+SECTIONS_DIRNAME = "sections"
+MANIFEST_FILENAME = "manifest.json"
+
+# Columns grant counts are summarised by
+REPORT_FACTORS = {
+    "region_1": "region",
+    "model": "LA model",
+    "majority": "majority party",
+}
+# Number of LAs listed in the improvable housing table, and their columns
+TOP_IMPROVABLE = 15
+IMPROVABLE_COLUMNS = [
+    "clean_name",
+    "region_1",
+    "model",
+    "total_improvable",
+    "prop_improvable",
+    "median_energy_efficiency",
+    "total_grants",
+]
+
+# A section of the report: the name of its fragment, its heading, the
+# function (in SECTION_KINDS) building it and that function's arguments
+Section = namedtuple("Section", ["name", "title", "kind", "kwargs"])
+
+# Dataset shared by all sections built in a worker process
+_worker_data = None
+
+
+def _table_html(table, float_format="{:,.2f}".format):
+    return table.to_html(
+        index=False, border=0, na_rep="-", float_format=float_format
+    ).replace('class="dataframe"', 'class="table"')
+
+
+def grant_count_columns():
+    """Columns of the tidy dataset counting the grants of each round and
+    scheme without rounds (excluding consortium members), and in total,
+    with their labels.
+    """
+    from la_funding_analysis.pipeline.cleaning import grant_schemes
+
+    schemes = grant_schemes()
+    columns = {}
+    for (scheme, round), _ in schemes.dropna(subset=["round"]).groupby(
+        ["scheme", "round"], sort=False
+    ):
+        columns[f"{scheme}_{round}_no_members"] = f"{scheme} {round}"
+    for column in schemes.loc[schemes["round"].isna(), "column"]:
+        columns[column] = column
+    columns["all_no_members"] = "All"
+    return columns
+
+
+def grant_counts_table(data, factor):
+    """Number of LAs in each level of factor, how many received at least
+    one grant, and the number of grants of each round (excluding
+    consortium members) and in total, sorted by the total.
+    """
+    columns = grant_count_columns()
+    grouped = data.groupby(factor, observed=True)
+    table = pd.concat(
+        [
+            grouped.size().rename("LAs"),
+            grouped["total_grants"]
+            .agg(lambda grants: int((grants > 0).sum()))
+            .rename("LAs with a grant"),
+            grouped[list(columns)].sum(),
+        ],
+        axis=1,
+    ).sort_values("all_no_members", ascending=False)
+    return table.rename(columns=columns).reset_index()
+
+
+def top_improvable_table(data, n=TOP_IMPROVABLE):
+    """The n LAs with the most improvable socially rented dwellings that
+    didn't receive a SHDDF grant.
+    """
+    return data.loc[data["SHDDF"] == 0, IMPROVABLE_COLUMNS].nlargest(
+        n, "total_improvable"
+    )
+
+
+def stage_table():
+    """Each data stage's description, and the size, build time, rows and
+    columns of its cached output, if it has been cached.
+    """
+    rows = []
+    for name, (_, _, description) in STAGES.items():
+        path = cache_path(name)
+        row = {"stage": name, "description": description}
+        if path.exists():
+            output = pd.read_pickle(path)
+            row.update(
+                {
+                    "rows": len(output),
+                    "columns": output.shape[1],
+                    "size_kb": path.stat().st_size / 1e3,
+                    "built": datetime.fromtimestamp(path.stat().st_mtime).isoformat(
+                        sep=" ", timespec="seconds"
+                    ),
+                }
+            )
+        rows.append(row)
+    columns = ["stage", "description", "rows", "columns", "size_kb", "built"]
+    return pd.DataFrame(rows, columns=columns).astype(
+        {"rows": "Int64", "columns": "Int64"}
+    )
+
+
+def _grant_counts_section(data, factor):
+    return _table_html(grant_counts_table(data, factor), "{:,.0f}".format)
+
+
+def _top_improvable_section(data, n):
+    return _table_html(top_improvable_table(data, n))
+
+
+def _stages_section(data):
+    return _table_html(stage_table(), "{:,.1f}".format)
+
+
+def _chart_section(data, chart):
+    from la_funding_analysis.pipeline import plotters
+    from la_funding_analysis.pipeline.chart_registry import load_chart_registry
+
+    registry_entry = load_chart_registry()[chart]
+    with tempfile.TemporaryDirectory() as directory:
+        (path,) = plotters.export_figure(
+            getattr(plotters, registry_entry.plot),
+            chart,
+            [".png"],
+            directory=Path(directory),
+            data=data,
+            **registry_entry.kwargs,
+        )
+        image = base64.b64encode(path.read_bytes()).decode()
+    return f'<img alt="{html.escape(chart)}" src="data:image/png;base64,{image}">'
+
+
+def _grant_counts_inputs(data, factor):
+    return data[[factor, "total_grants", *grant_count_columns()]]
+
+
+def _top_improvable_inputs(data, n):
+    return data[["SHDDF", *IMPROVABLE_COLUMNS]]
+
+
+def _stages_inputs(data):
+    states = []
+    for name in STAGES:
+        path = cache_path(name)
+        if path.exists():
+            states.append((name, path.stat().st_size, path.stat().st_mtime_ns))
+    return pd.DataFrame(states, columns=["stage", "size", "modified"])
+
+
+# Section kind: (function building its HTML from the dataset and the
+# section's arguments, function returning the inputs it depends on).
+# Charts depend on their inputs as recorded in the figure manifest.
+SECTION_KINDS = {
+    "grant_counts": (_grant_counts_section, _grant_counts_inputs),
+    "top_improvable": (_top_improvable_section, _top_improvable_inputs),
+    "chart": (_chart_section, None),
+    "stages": (_stages_section, _stages_inputs),
+}
+
+
+def report_sections():
+    """The sections of the report, in order."""
+    from la_funding_analysis.pipeline.chart_registry import load_chart_registry
+
+    sections = [
+        Section(
+            f"grants_by_{factor}",
+            f"Grants by {label}",
+            "grant_counts",
+            {"factor": factor},
+        )
+        for factor, label in REPORT_FACTORS.items()
+    ]
+    sections.append(
+        Section(
+            "top_improvable",
+            "LAs with the most improvable social housing and no SHDDF grant",
+            "top_improvable",
+            {"n": TOP_IMPROVABLE},
+        )
+    )
+    sections += [
+        Section(
+            f"chart_{name}",
+            chart.kwargs.get("graph_title", name).replace("\n", " "),
+            "chart",
+            {"chart": name},
+        )
+        for name, chart in load_chart_registry().items()
+    ]
+    sections.append(Section("stages", "Data stages", "stages", {}))
+    return sections
+
+
+def code_version():
+    """Hash of the code building the report."""
+    return hashlib.sha1(Path(__file__).read_bytes()).hexdigest()
+
+
+def section_hash(data, section, code=None):
+    """Hash of a section's heading, arguments and inputs, and of (by
+    default the current) code building it.
+    """
+    digest = hashlib.sha1((code or code_version()).encode())
+    digest.update(json.dumps(section, sort_keys=True).encode())
+    if section.kind == "chart":
+        from la_funding_analysis.pipeline.chart_registry import load_chart_registry
+        from la_funding_analysis.pipeline.manifest import chart_hash
+
+        chart = load_chart_registry()[section.kwargs["chart"]]
+        digest.update(chart_hash(data, chart.plot, chart.kwargs).encode())
+    else:
+        inputs = SECTION_KINDS[section.kind][1](data, **section.kwargs)
+        digest.update(dataset_hash(inputs).encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    """Dict of section name: hash from the manifest in directory."""
+    path = directory / MANIFEST_FILENAME
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def stale_sections(data, sections, directory, force=False):
+    """The sections whose fragments in directory are missing or out of date
+    (or all sections, if force is True), each with its new hash and the
+    reason it is stale. Returns a list of (section, hash, reason) tuples.
+    """
+    manifest = read_manifest(directory)
+    code = code_version()
+    stale = []
+    for section in sections:
+        new_hash = section_hash(data, section, code)
+        if not (directory / f"{section.name}.html").exists():
+            stale.append((section, new_hash, "missing"))
+        elif manifest.get(section.name) != new_hash:
+            stale.append((section, new_hash, "changed"))
+        elif force:
+            stale.append((section, new_hash, "forced"))
+    return stale
+
+
+def _init_worker(data):
+    """Sets up a worker process with the Agg backend and the dataset."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    global _worker_data
+    _worker_data = data
+
+
+def _build_section(section):
+    """Builds a section's HTML fragment with the worker's dataset and
+    returns it with the time taken in seconds.
+    """
+    start = time.perf_counter()
+    body = SECTION_KINDS[section.kind][0](_worker_data, **section.kwargs)
+    fragment = (
+        f'<section id="{section.name}">\n'
+        f"<h2>{html.escape(section.title)}</h2>\n{body}\n</section>\n"
+    )
+    return fragment, time.perf_counter() - start
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 60em; margin: 2em auto; color: #222; }}
+nav li {{ margin: 0.2em 0; }}
+section {{ margin: 2em 0; }}
+img {{ max-width: 100%; }}
+.table {{ border-collapse: collapse; font-size: 0.9em; }}
+.table th, .table td {{ padding: 0.3em 0.8em; border-bottom: 1px solid #ddd; }}
+.table td {{ text-align: right; }}
+.meta {{ color: #666; font-size: 0.9em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p class="meta">Generated {generated} from {rows} LAs (dataset {dataset}).</p>
+<nav><ul>
+{contents}
+</ul></nav>
+{sections}
+</body>
+</html>
+"""
+
+
+def assemble_report(data, sections, directory, path):
+    """Writes the report to path from the fragments of sections in
+    directory, removing fragments of sections no longer in the report.
+    """
+    names = {section.name for section in sections}
+    for fragment in directory.glob("*.html"):
+        if fragment.stem not in names:
+            fragment.unlink()
+    contents = "\n".join(
+        f'<li><a href="#{section.name}">{html.escape(section.title)}</a></li>'
+        for section in sections
+    )
+    report = REPORT_TEMPLATE.format(
+        title="Local authority decarbonisation grants",
+        generated=datetime.now().isoformat(sep=" ", timespec="seconds"),
+        rows=len(data),
+        dataset=dataset_hash(data)[:12],
+        contents=contents,
+        sections="".join(
+            (directory / f"{section.name}.html").read_text() for section in sections
+        ),
+    )
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_text(report)
+    temporary_path.replace(path)
+
+
+def build_report(data, directory=REPORT_DIR, processes=None, force=False):
+    """Builds the HTML report of the tidy dataset in directory (defaults
+    to outputs/reports), rebuilding only the sections that are missing or
+    out of date (or all of them, if force is True) in parallel across
+    processes workers (defaults to the number of CPUs; processes=1 builds
+    them in the current process).
+    Returns a DataFrame of the sections rebuilt, why and the time taken.
+    """
+    sections_dir = directory / SECTIONS_DIRNAME
+    sections_dir.mkdir(parents=True, exist_ok=True)
+    sections = report_sections()
+    stale = stale_sections(data, sections, sections_dir, force=force)
+    results = []
+
+    def record(section, reason, fragment, seconds):
+        (sections_dir / f"{section.name}.html").write_text(fragment)
+        results.append((section.name, reason, seconds))
+        logger.info(f"Built report section {section.name} in {seconds:.2f}s")
+
+    if processes == 1:
+        _init_worker(data)
+        for section, new_hash, reason in stale:
+            record(section, reason, *_build_section(section))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(data,)
+        ) as pool:
+            futures = {
+                pool.submit(_build_section, section): (section, reason)
+                for section, _, reason in stale
+            }
+            for future in as_completed(futures):
+                record(*futures[future], *future.result())
+    # Written once every stale section has been built, so that sections
+    # left unbuilt by a failure are rebuilt next time
+    manifest = {
+        name: hash
+        for name, hash in read_manifest(sections_dir).items()
+        if name in {section.name for section in sections}
+    }
+    manifest.update({section.name: new_hash for section, new_hash, _ in stale})
+    with open(sections_dir / MANIFEST_FILENAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    assemble_report(data, sections, sections_dir, directory / REPORT_FILENAME)
+    return pd.DataFrame(results, columns=["section", "reason", "seconds"])
@@ -3,6 +3,10 @@
 Datasets are added one at a time.
 """
 
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+
 from la_funding_analysis.pipeline.cleaning import (
     get_clean_fuel_poverty,
     get_clean_old_parties,
@@ -10,17 +14,59 @@ from la_funding_analysis.pipeline.cleaning import (
     get_clean_imd,
     get_clean_grants,
     get_clean_epc,
+    grant_schemes,
 )
+from la_funding_analysis.pipeline.merge_audit import audit_merge, check_merge
+from la_funding_analysis.utils.instrumentation import instrumented
+
+# Role of consortium members in the grants data, whose grants aren't
+# counted in the totals "without members"
+MEMBER_ROLE = "bodies"
+
+# Dtypes of the columns of the tidy dataset (see apply_tidy_dtypes).
+# String columns with few distinct values, which the plotters group by,
+# are categoricals. Measures that are whole numbers (or halves, for
+# medians) are float32, which holds them exactly, but proportions and
+# average ranks stay float64, as float32 would add rounding noise to their
+# decimals (e.g. 15.35 read back as 15.3500003815) in every output.
+# Counts that can be missing are nullable Int32.
+TIDY_DTYPES = {
+    "code": "string",
+    "region_1": "category",
+    "region_2": "category",
+    "region_3": "string",
+    "total_households": "float32",
+    "fp_households": "Int32",
+    "fp_proportion": "float64",
+    "clean_name": "string",
+    "model": "category",
+    "majority": "category",
+    "old_majority": "category",
+    "imd_concentration": "float64",
+    "median_energy_efficiency": "float32",
+    "total_improvable": "Int32",
+    "prop_improvable": "float64",
+    "high_improvable_no_SHDDF": "bool",
+}
+# The grant counts, which are never missing, are given the smallest
+# integer dtype that holds all of them (int8, unless an LA has more than
+# 127 grants of some kind). Row sums of them should use .sum(axis=1),
+# which widens the result, rather than adding columns together.
 
 
-def custom_merge(data_1, data_2, on):
+@instrumented
+def custom_merge(data_1, data_2, on, name=None):
     """Customised merge function for joining all data.
-    All merges will be left joins; also contains 1:1 validation for error checking
+    All merges will be left joins, and each one is audited (see
+    pipeline/merge_audit.py) under name, the name of the table added,
+    failing if too few of its rows are matched.
     """
     merged_data = data_1.merge(data_2, how="left", on=on)
+    check_merge(audit_merge(data_1, data_2, on, merged=merged_data, name=name))
     return merged_data
 
 
+@instrumented
 def form_fp_parties_models():
     """Forms a DataFrame from fuel poverty data (which also includes
     local authority structure) and majority party / LA model data.
@@ -29,12 +75,17 @@ def form_fp_parties_models():
     parties_models = get_clean_parties_models()
     old_parties = get_clean_old_parties()
     #
-    fp_new_parties = custom_merge(fuel_poverty, parties_models, on="clean_name")
-    fp_parties = custom_merge(fp_new_parties, old_parties, on="clean_name")
+    fp_new_parties = custom_merge(
+        fuel_poverty, parties_models, on="clean_name", name="parties_models"
+    )
+    fp_parties = custom_merge(
+        fp_new_parties, old_parties, on="clean_name", name="old_parties"
+    )
     #
     return fp_parties
 
 
+@instrumented
 def form_fp_pm_imd():
     """Forms a DataFrame combining fuel poverty, party/model
     and IMD proportion data.
@@ -42,44 +93,103 @@ def form_fp_pm_imd():
     fp_parties = form_fp_parties_models()
     imd = get_clean_imd()
     #
-    fp_parties_imd = custom_merge(fp_parties, imd, on="clean_name")
+    fp_parties_imd = custom_merge(fp_parties, imd, on="clean_name", name="imd")
     #
     return fp_parties_imd
 
 
+@instrumented
 def form_fp_pm_imd_grants():
     """Forms a DataFrame combining fuel poverty, party/model,
     IMD proportion and whether or not each local
     authority received a SHDF or GHG grant.
     """
-    fp_parties_imd = form_fp_pm_imd()
-    grants = get_clean_grants()
+    return add_grants_data(form_fp_pm_imd(), get_clean_grants())
+
+
+def grant_aggregate_weights(schemes):
+    """0/1 matrix with a row for each grants column in the tidy data
+    (see grant_schemes) and a column for each aggregate of them: the
+    column itself, the total overall (total_grants) and without consortium
+    members (all_no_members), and the total for each scheme
+    (total_grants_<scheme>), round of a scheme (total_grants_<scheme>_<round>)
+    and role (total_grants_<role>). Scheme and round totals are also given
+    without members (<scheme>_no_members and <scheme>_<round>_no_members).
+    Rounds belonging to one scheme only are also totalled under their
+    round alone (total_grants_<round> and <round>_no_members).
+    """
+    not_member = schemes["role"] != MEMBER_ROLE
+    weights = {column: schemes["column"] == column for column in schemes["column"]}
+    weights["total_grants"] = pd.Series(True, index=schemes.index)
+    rounds = schemes.dropna(subset=["round"])
+    round_schemes = rounds.groupby("round", sort=False)["scheme"].nunique()
+    for grant_round in round_schemes.index[round_schemes == 1]:
+        in_round = schemes["round"] == grant_round
+        weights[f"total_grants_{grant_round}"] = in_round
+        weights[f"{grant_round}_no_members"] = in_round & not_member
+    weights["all_no_members"] = not_member
+    for scheme in schemes["scheme"].unique():
+        in_scheme = schemes["scheme"] == scheme
+        weights[f"total_grants_{scheme}"] = in_scheme
+        weights[f"{scheme}_no_members"] = in_scheme & not_member
+    for scheme, grant_round in rounds[["scheme", "round"]].drop_duplicates().values:
+        in_round = (schemes["scheme"] == scheme) & (schemes["round"] == grant_round)
+        weights[f"total_grants_{scheme}_{grant_round}"] = in_round
+        weights[f"{scheme}_{grant_round}_no_members"] = in_round & not_member
+    for role in schemes["role"].dropna().unique():
+        weights[f"total_grants_{role}"] = schemes["role"] == role
+    return pd.DataFrame(weights).set_index(schemes["column"]).astype(int)
+
+
+@instrumented
+def grant_totals(grants):
+    """Number of grants received by each LA (by clean_name) in each
+    column of grant_aggregate_weights, from the long-form grants data.
+    Grants are summed into a sparse LA by column matrix, which is
+    multiplied by the weights to form every aggregate at once.
+    """
+    schemes = grant_schemes()
+    weights = grant_aggregate_weights(schemes)
+    keys = ["scheme", "round", "role"]
+    columns = pd.MultiIndex.from_frame(schemes[keys]).get_indexer(
+        pd.MultiIndex.from_frame(grants[keys])
+    )
+    las, la_positions = np.unique(grants["clean_name"], return_inverse=True)
+    counts = coo_matrix(
+        (grants["amount"], (la_positions, columns)), shape=(len(las), len(schemes))
+    ).tocsr()
+    totals = pd.DataFrame(counts @ weights.to_numpy(), columns=weights.columns)
+    totals.insert(0, "clean_name", las)
+    return totals
+
+
+@instrumented
+def add_grants_data(fp_parties_imd, grants):
+    """Adds the grants received by each LA (see grant_totals) to the
+    DataFrame formed by form_fp_pm_imd.
+    """
+    totals = grant_totals(grants)
     # Missing data corresponds to 0 grants, so fill NAs in these cols with 0
     fp_parties_imd_grants = custom_merge(
-        fp_parties_imd, grants, on="clean_name"
-    ).fillna(
-        {
-            "GHG_1a_individuals": 0,
-            "GHG_1a_leads": 0,
-            "GHG_1a_bodies": 0,
-            "GHG_1b_individuals": 0,
-            "GHG_1b_leads": 0,
-            "GHG_1b_bodies": 0,
-            "SHDDF": 0,
-            "total_grants": 0,
-        }
-    )
+        fp_parties_imd, totals, on="clean_name", name="grants"
+    ).fillna({column: 0 for column in totals.columns if column != "clean_name"})
     return fp_parties_imd_grants
 
 
+@instrumented
 def form_all_data():
     """Forms a DataFrame combining fuel poverty, party/model,
     IMD, grants, median EPC data and improvable counts.
     """
-    fp_parties_imd_grants = form_fp_pm_imd_grants()
-    epc = get_clean_epc()
-    #
-    all_data = custom_merge(fp_parties_imd_grants, epc, on="code")
+    return add_epc_data(form_fp_pm_imd_grants(), get_clean_epc())
+
+
+@instrumented
+def add_epc_data(fp_parties_imd_grants, epc):
+    """Adds clean EPC data to the DataFrame formed by form_fp_pm_imd_grants,
+    along with a flag for LAs with many improvable homes but no SHDF grant.
+    """
+    all_data = custom_merge(fp_parties_imd_grants, epc, on="code", name="epc")
     #
     # Add column for local authorities that have high numbers of improvable homes
     # but did not receive SHDF grants - this will be used for plotting
@@ -90,38 +200,50 @@ def form_all_data():
     return all_data
 
 
+@instrumented
 def form_all_tidy_data():
     """Forms a DataFrame combining all relevant data for the analysis
     in a tidy form for easier plotting.
     """
-    all_data = form_all_data()
-    #
-    # Tidy up data types in preparation for plotting
-    all_data = all_data.convert_dtypes()
-    all_data["total_households"] = all_data["total_households"].astype("float")
-    #
-    # Add total cols for GHG 1a and 1b - useful for splitting by grant type
-    all_data["total_grants_1a"] = (
-        all_data["GHG_1a_individuals"]
-        + all_data["GHG_1a_leads"]
-        + all_data["GHG_1a_bodies"]
-    )
-    all_data["total_grants_1b"] = (
-        all_data["GHG_1b_individuals"]
-        + all_data["GHG_1b_leads"]
-        + all_data["GHG_1b_bodies"]
-    )
-    all_data["1a_no_members"] = (
-        all_data["GHG_1a_individuals"] + all_data["GHG_1a_leads"]
-    )
-    all_data["1b_no_members"] = (
-        all_data["GHG_1b_individuals"] + all_data["GHG_1b_leads"]
-    )
-    all_data["all_no_members"] = (
-        all_data["1a_no_members"] + all_data["1b_no_members"] + all_data["SHDDF"]
+    return tidy_la_data(form_all_data())
+
+
+def grant_count_dtype(data, columns):
+    """Smallest integer dtype holding every value of the grant count columns
+    of data, checked rather than cast so that large counts never wrap.
+    Raises a ValueError if any count is missing or not a whole number.
+    """
+    dtypes = [
+        pd.to_numeric(data[column], downcast="integer").dtype for column in columns
+    ]
+    if any(dtype.kind != "i" for dtype in dtypes):
+        raise ValueError("Grant counts must be whole numbers with no missing values")
+    return np.result_type(*dtypes)
+
+
+def apply_tidy_dtypes(data):
+    """Sets the dtype of each column of the tidy dataset as in TIDY_DTYPES,
+    and the grant counts to grant_count_dtype. Other columns are left as
+    they are.
+    """
+    grant_columns = [
+        column
+        for column in grant_aggregate_weights(grant_schemes()).columns
+        if column in data
+    ]
+    dtypes = dict(TIDY_DTYPES)
+    if grant_columns:
+        grant_dtype = grant_count_dtype(data, grant_columns)
+        dtypes.update({column: grant_dtype for column in grant_columns})
+    return data.astype(
+        {column: dtype for column, dtype in dtypes.items() if column in data}
     )
-    #
-    all_tidy_data = all_data.reset_index(drop=True)
+
+
+@instrumented
+def tidy_la_data(all_data):
+    """Tidies the DataFrame formed by form_all_data for plotting."""
+    all_tidy_data = apply_tidy_dtypes(all_data).reset_index(drop=True)
     #
     return all_tidy_data
 
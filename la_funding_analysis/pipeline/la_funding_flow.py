@@ -0,0 +1,171 @@
+# File: pipeline/la_funding_flow.py
+"""Metaflow flow building the tidy LA dataset and rendering the charts,
+run entirely on this machine with Metaflow's local datastore.
+The cleaning of each source runs as a parallel foreach branch, as does the
+cleaning of each shard of the EPC file, whose per-LA counts are added up
+in the join. Stale charts (see pipeline/manifest.py) are then rendered in
+parallel batches. Every step's outputs are kept as Metaflow artifacts,
+so a failed or interrupted run can be resumed from the failing step.
+
+    python la_funding_analysis/pipeline/la_funding_flow.py run --max-workers 4
+    python la_funding_analysis/pipeline/la_funding_flow.py resume
+
+--shards and --chart-batches set the number of EPC shards and chart
+batches. The tidy dataset is also cached in outputs/cache, as by
+`build-data`, so that CLI commands can use it.
+"""
+
+import os
+
+# Run locally unless Metaflow has been configured otherwise
+os.environ.setdefault("METAFLOW_DEFAULT_DATASTORE", "local")
+os.environ.setdefault("METAFLOW_DEFAULT_METADATA", "local")
+
+from metaflow import FlowSpec, Parameter, step  # noqa: E402
+
+# Stages (see pipeline/stages.py) cleaning each source other than the EPCs
+SOURCE_STAGES = ["fuel_poverty", "parties_models", "old_parties", "imd", "grants"]
+
+
+class LAFundingFlow(FlowSpec):
+    """Builds the tidy LA dataset and renders the stale charts."""
+
+    shards = Parameter(
+        "shards", help="Number of EPC shards cleaned in parallel.", default=4
+    )
+    chart_batches = Parameter(
+        "chart-batches", help="Number of chart batches rendered in parallel.", default=4
+    )
+    force = Parameter(
+        "force", help="Render every chart, even if it is up to date.", default=False
+    )
+
+    @step
+    def start(self):
+        """Cleans each source in parallel."""
+        self.sources = SOURCE_STAGES
+        self.next(self.clean_source, foreach="sources")
+
+    @step
+    def clean_source(self):
+        """Cleans one source with its stage function."""
+        from la_funding_analysis.pipeline.stages import stage_function
+
+        self.source = self.input
+        self.clean = stage_function(self.source)()
+        self.next(self.join_sources)
+
+    @step
+    def join_sources(self, inputs):
+        """Joins the clean sources and splits the EPC file into shards."""
+        from la_funding_analysis.getters.local_authority_data import (
+            epc_shard_offsets,
+        )
+        from la_funding_analysis.pipeline.joining import (
+            add_grants_data,
+            custom_merge,
+        )
+
+        clean = {input.source: input.clean for input in inputs}
+        fp_parties = clean["fuel_poverty"]
+        for source in ["parties_models", "old_parties", "imd"]:
+            fp_parties = custom_merge(
+                fp_parties, clean[source], on="clean_name", name=source
+            )
+        self.fp_parties_imd_grants = add_grants_data(fp_parties, clean["grants"])
+        self.epc_shards = epc_shard_offsets(self.shards)
+        self.next(self.clean_epc_shard, foreach="epc_shards")
+
+    @step
+    def clean_epc_shard(self):
+        """Counts energy efficiency scores and improvable social housing
+        in each LA in a shard of the EPC file.
+        """
+        from la_funding_analysis.getters.local_authority_data import get_epc_shard
+        from la_funding_analysis.pipeline.cleaning import (
+            EPC_CLEANING_COLUMNS,
+            epc_aggregates,
+        )
+
+        start, end = self.input
+        self.aggregates = epc_aggregates(
+            get_epc_shard(start, end, usecols=EPC_CLEANING_COLUMNS)
+        )
+        self.next(self.join_epc_shards)
+
+    @step
+    def join_epc_shards(self, inputs):
+        """Forms the tidy dataset from the EPC counts of every shard and
+        the joined sources, and plans the charts to render.
+        """
+        from la_funding_analysis.analysis.generate_plots import select_chart_jobs
+        from la_funding_analysis.pipeline.cleaning import clean_epc_from_aggregates
+        from la_funding_analysis.pipeline.joining import add_epc_data, tidy_la_data
+        from la_funding_analysis.pipeline.manifest import stale_charts
+        from la_funding_analysis.pipeline.plotters import FIGURES_DIR
+        from la_funding_analysis.pipeline.stages import CACHE_DIR, cache_path
+
+        self.clean_epc = clean_epc_from_aggregates(
+            [input.aggregates for input in inputs]
+        )
+        self.tidy_data = tidy_la_data(
+            add_epc_data(inputs[0].fp_parties_imd_grants, self.clean_epc)
+        )
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.tidy_data.to_pickle(cache_path("tidy_data"))
+        #
+        stale = stale_charts(
+            self.tidy_data, select_chart_jobs(), FIGURES_DIR, force=self.force
+        )
+        # A foreach needs at least one branch, so there is always a batch,
+        # which is empty if every chart is up to date
+        n_batches = max(1, min(self.chart_batches, len(stale)))
+        self.chart_batches_to_render = [
+            [(job, new_hash) for job, new_hash, _ in stale[i::n_batches]]
+            for i in range(n_batches)
+        ]
+        self.next(self.render_chart_batch, foreach="chart_batches_to_render")
+
+    @step
+    def render_chart_batch(self):
+        """Renders one batch of the stale charts."""
+        from la_funding_analysis.pipeline.chart_registry import chart_tables
+        from la_funding_analysis.pipeline.plotters import FIGURES_DIR
+        from la_funding_analysis.pipeline.rendering import render_charts
+
+        self.rendered = self.input
+        jobs = [job for job, _ in self.rendered]
+        self.timings = render_charts(
+            self.tidy_data,
+            jobs,
+            processes=1,
+            directory=FIGURES_DIR,
+            tables=chart_tables(jobs),
+        )
+        self.next(self.join_charts)
+
+    @step
+    def join_charts(self, inputs):
+        """Records the rendered charts in the figure manifest."""
+        import pandas as pd
+
+        from la_funding_analysis.pipeline.manifest import record_charts
+        from la_funding_analysis.pipeline.plotters import FIGURES_DIR
+
+        rendered = [chart for input in inputs for chart in input.rendered]
+        record_charts(FIGURES_DIR, rendered)
+        self.timings = pd.concat([input.timings for input in inputs]).sort_values(
+            "seconds", ascending=False, ignore_index=True
+        )
+        self.tidy_data = inputs[0].tidy_data
+        self.next(self.end)
+
+    @step
+    def end(self):
+        """Reports the size of the tidy dataset and the charts rendered."""
+        print(f"Tidy dataset: {len(self.tidy_data)} rows")
+        print(f"Rendered {len(self.timings)} charts")
+
+
+if __name__ == "__main__":
+    LAFundingFlow()
@@ -0,0 +1,131 @@
+# File: pipeline/manifest.py
+"""A manifest of the rendered figures, so that charts are only re-rendered
+when something they depend on has changed.
+Each output file is recorded in manifest.json (in its directory) with a
+hash of the chart's input table, its arguments and the version of the
+plotting code. A chart is stale if any of its files is missing or was
+rendered with a different hash.
+"""
+
+import hashlib
+import json
+
+import matplotlib
+
+from la_funding_analysis import PROJECT_DIR
+from la_funding_analysis.pipeline import chart_data
+from la_funding_analysis.pipeline.boundaries import BOUNDARIES_CACHE
+from la_funding_analysis.pipeline.chart_registry import PLOT_TYPES
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Source files whose contents determine how charts are drawn
+CODE_FILES = [
+    PROJECT_DIR / "la_funding_analysis" / path
+    for path in [
+        "pipeline/plotters.py",
+        "pipeline/chart_data.py",
+        "pipeline/boundaries.py",
+        "utils/jitter_functions.py",
+        "utils/geometry.py",
+    ]
+]
+
+# Columns of the tidy dataset read by the plotting functions that don't use
+# a chart table. Entries naming an argument (e.g. "factor") stand for the
+# column passed as that argument.
+PLOT_COLUMNS = {
+    "imd_strip_plot": ["total_grants", "imd_concentration"],
+    "fp_clusters_strip_plot": ["total_grants", "fp_proportion"],
+    "westmids_london_fp_strip_plot": ["total_grants", "fp_proportion", "region_1"],
+    "improvable_strip_plot": [
+        "SHDDF",
+        "factor",
+        "high_improvable_no_SHDDF",
+        "region_3",
+    ],
+    "choropleth": ["code", "column"],
+}
+
+
+def code_version():
+    """Hash of the plotting code and the matplotlib version."""
+    digest = hashlib.sha1(matplotlib.__version__.encode())
+    for path in CODE_FILES:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def chart_input(data, plot, kwargs):
+    """The table a chart is drawn from: its chart_data table if it has one,
+    otherwise the columns of data it reads.
+    """
+    table = PLOT_TYPES[plot].table
+    if table:
+        if "factors" in kwargs:
+            return getattr(chart_data, table)(data, factors=tuple(kwargs["factors"]))
+        return getattr(chart_data, table)(data, factor=kwargs["factor"])
+    columns = [kwargs.get(column, column) for column in PLOT_COLUMNS[plot]]
+    return data[columns]
+
+
+def chart_hash(data, plot, kwargs, code=None):
+    """Hash of a chart's input table, plotting function, arguments
+    and (by default the current) plotting code version.
+    Maps also depend on the cached boundaries.
+    """
+    digest = hashlib.sha1((code or code_version()).encode())
+    digest.update(json.dumps([plot, kwargs], sort_keys=True).encode())
+    digest.update(chart_data.dataset_hash(chart_input(data, plot, kwargs)).encode())
+    if plot == "choropleth" and BOUNDARIES_CACHE.exists():
+        stat = BOUNDARIES_CACHE.stat()
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    """Dict of output filename: hash from the manifest in directory."""
+    path = directory / MANIFEST_FILENAME
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    """Writes manifest, a dict of output filename: hash, to directory."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / MANIFEST_FILENAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def stale_charts(data, jobs, directory, force=False):
+    """The jobs (as in generate_plots) whose output files in directory
+    are missing or out of date (or all jobs, if force is True), each with
+    its new hash and the reason it is stale.
+    Returns a list of (job, hash, reason) tuples.
+    """
+    manifest = read_manifest(directory)
+    code = code_version()
+    stale = []
+    for job in jobs:
+        plot, kwargs, filename, formats = job
+        new_hash = chart_hash(data, plot, kwargs, code)
+        files = [filename + suffix for suffix in formats]
+        if not all((directory / file).exists() for file in files):
+            stale.append((job, new_hash, "missing"))
+        elif any(manifest.get(file) != new_hash for file in files):
+            stale.append((job, new_hash, "changed"))
+        elif force:
+            stale.append((job, new_hash, "forced"))
+    return stale
+
+
+def record_charts(directory, rendered):
+    """Records the hashes of rendered charts, a list of (job, hash),
+    in the manifest in directory.
+    """
+    manifest = read_manifest(directory)
+    for (_, _, filename, formats), new_hash in rendered:
+        manifest.update({filename + suffix: new_hash for suffix in formats})
+    write_manifest(directory, manifest)
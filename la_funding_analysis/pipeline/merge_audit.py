@@ -0,0 +1,176 @@
+# File: pipeline/merge_audit.py
+"""Audit of the merges in pipeline/joining.py. Every merge is checked
+for keys on either side that found no match, duplicate keys, the rows
+added by one-to-many matches and the share of missing values in each
+column of the result.
+Keys are compared as 64-bit hashes in hash tables, so an audit costs
+about as much as the merge itself, even for large tables.
+A merge fails the build if too few rows of the table being added find a
+match (min_coverage in config/base.yaml, which can be set per merge).
+Inside a merge_audit_report, audits are also written to a JSON report.
+"""
+
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from la_funding_analysis import PROJECT_DIR
+
+REPORTS_DIR = PROJECT_DIR / "outputs/reports"
+
+# Number of unmatched or duplicate keys listed in each audit
+MAX_KEYS_LISTED = 20
+
+# The current audit report, if any: its audits and coverage threshold
+_report = None
+
+
+def key_hashes(data, on):
+    """64-bit hash of each row's merge key (one or more columns)."""
+    columns = [on] if isinstance(on, str) else list(on)
+    return pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+
+
+def _listed_keys(data, on, rows, max_keys=MAX_KEYS_LISTED):
+    """Count of distinct keys in the given rows of data, and the first
+    max_keys of them (all of them if max_keys is None).
+    """
+    keys = data.loc[rows, on].drop_duplicates()
+    # Missing keys are listed as None, so that reports are valid JSON
+    keys = keys.astype(object).where(keys.notna(), None)
+    if max_keys is not None:
+        keys = keys.head(max_keys)
+    if isinstance(on, str):
+        listed = keys.tolist()
+    else:
+        listed = keys.values.tolist()
+    return {"count": len(keys), "keys": listed}
+
+
+def audit_merge(left, right, on, merged=None, name=None, max_keys=MAX_KEYS_LISTED):
+    """Audits a left merge of right onto left on the key column(s) on,
+    returning a dict of:
+    - left_rows, right_rows and merged_rows: merged_rows is worked out
+      from the keys, so merged (the result of the merge) is optional
+    - row_inflation: rows added to left by keys that match several rows
+    - left_coverage and right_coverage: the share of rows on each side
+      whose key is matched on the other
+    - unmatched_left, unmatched_right, duplicate_left, duplicate_right:
+      the number of such distinct keys, and the first max_keys of them
+      (all of them if max_keys is None)
+    - null_rates: share of missing values in each column of merged
+    """
+    left_hashes = pd.Series(key_hashes(left, on))
+    right_hashes = pd.Series(key_hashes(right, on))
+    left_matched = left_hashes.isin(right_hashes).to_numpy()
+    right_matched = right_hashes.isin(left_hashes).to_numpy()
+    # Each left row appears once per matching right row, or once if none
+    matches = left_hashes.map(right_hashes.value_counts()).fillna(1)
+    merged_rows = int(matches.sum())
+    #
+    audit = {
+        "name": name,
+        "on": on,
+        "left_rows": len(left),
+        "right_rows": len(right),
+        "merged_rows": merged_rows,
+        "row_inflation": merged_rows - len(left),
+        "left_coverage": float(left_matched.mean()) if len(left) else 1.0,
+        "right_coverage": float(right_matched.mean()) if len(right) else 1.0,
+        "unmatched_left": _listed_keys(left, on, ~left_matched, max_keys),
+        "unmatched_right": _listed_keys(right, on, ~right_matched, max_keys),
+        "duplicate_left": _listed_keys(
+            left, on, left_hashes.duplicated(keep=False).to_numpy(), max_keys
+        ),
+        "duplicate_right": _listed_keys(
+            right, on, right_hashes.duplicated(keep=False).to_numpy(), max_keys
+        ),
+    }
+    if merged is not None:
+        audit["null_rates"] = {
+            column: float(rate) for column, rate in merged.isna().mean().items()
+        }
+    return audit
+
+
+def min_coverage(name=None):
+    """Coverage threshold for a merge: that of the current report if it
+    sets one, otherwise that in config/base.yaml for the merge's name,
+    or else the default there.
+    """
+    if _report and _report["min_coverage"] is not None:
+        return _report["min_coverage"]
+    from la_funding_analysis import config
+
+    thresholds = config["merge_audit"]
+    return thresholds.get("merges", {}).get(name, thresholds["min_coverage"])
+
+
+def check_merge(audit):
+    """Logs a merge audit and adds it to the current report, if any.
+    Raises a ValueError if the share of the right table's rows that were
+    matched is below the merge's coverage threshold.
+    """
+    from la_funding_analysis import logger
+
+    name = audit["name"] or audit["on"]
+    threshold = min_coverage(audit["name"])
+    audit["min_coverage"] = threshold
+    if _report:
+        _report["audits"].append(audit)
+    logger.info(
+        f"Merge audit {name}: {audit['left_rows']} + {audit['right_rows']} -> "
+        f"{audit['merged_rows']} rows, {audit['left_coverage']:.1%} of left and "
+        f"{audit['right_coverage']:.1%} of right matched, "
+        f"{audit['duplicate_left']['count']} duplicate left keys, "
+        f"{audit['duplicate_right']['count']} duplicate right keys"
+    )
+    if audit["row_inflation"]:
+        logger.warning(
+            f"Merge audit {name}: {audit['row_inflation']} rows added by keys "
+            f"matching several rows: {audit['duplicate_right']['keys']}"
+        )
+    if audit["right_coverage"] < threshold:
+        raise ValueError(
+            f"Only {audit['right_coverage']:.1%} of rows matched in merge {name} "
+            f"(minimum {threshold:.1%}). Unmatched keys: "
+            f"{audit['unmatched_right']['keys']}"
+        )
+
+
+@contextmanager
+def merge_audit_report(path=None, min_coverage=None):
+    """Records the audit of every merge made inside the with block and
+    writes them as a JSON report to path (by default a timestamped file
+    in outputs/reports). min_coverage optionally overrides the coverage
+    threshold of every merge.
+    Yields the list of audits, which is filled in as merges are made.
+    """
+    global _report
+    if _report is not None:
+        raise RuntimeError("A merge audit report is already being made")
+    started = datetime.now()
+    _report = {"audits": [], "min_coverage": min_coverage}
+    try:
+        yield _report["audits"]
+    finally:
+        audits, _report = _report["audits"], None
+        report = {
+            "started": started.isoformat(timespec="seconds"),
+            "merges": audits,
+        }
+        path = Path(path or REPORTS_DIR / f"merges_{started:%Y%m%d_%H%M%S}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=_json_default)
+
+
+def _json_default(value):
+    # Keys may be numpy scalars, e.g. from integer code columns
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
@@ -0,0 +1,187 @@
+# File: pipeline/need_scoring.py
+"""Scores LAs by need for decarbonisation funding and compares the
+rankings with the grants they actually received.
+The need indicators (fuel poverty, IMD local concentration, median EPC
+energy efficiency and improvable social housing) are standardised into
+one matrix, oriented so that higher always means more need, and a need
+score is the matrix product of that matrix with a vector of weights.
+To show how far the conclusions depend on the choice of weights, many
+weight vectors (drawn uniformly from the simplex) are scored together as
+one matrix product, and their rankings compared with grant receipt all
+at once.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+# Need indicator: +1 if higher values mean more need, -1 if lower do.
+# The IMD local concentration is an average rank, which is lower in more
+# deprived LAs.
+NEED_INDICATORS = {
+    "fp_proportion": 1,
+    "imd_concentration": -1,
+    "median_energy_efficiency": -1,
+    "total_improvable": 1,
+}
+# Number of the neediest LAs whose grant receipt is compared
+TOP_K = 50
+
+NeedMatrix = namedtuple("NeedMatrix", ["codes", "indicators", "values"])
+NeedMatrix.__doc__ = """Standardised need indicators of each LA.
+values has one row per LA (with the LA code in codes) and one column per
+indicator; higher values mean more need."""
+
+
+def need_matrix(data, indicators=NEED_INDICATORS):
+    """Builds a NeedMatrix from the tidy dataset: each indicator column is
+    converted to z-scores and multiplied by its direction in indicators.
+    Missing values are set to 0 (the mean), so that LAs missing one
+    indicator are scored on the others.
+    """
+    values = data[list(indicators)].to_numpy(dtype=float, na_value=np.nan)
+    means = np.nanmean(values, axis=0)
+    deviations = np.nanstd(values, axis=0)
+    scores = (values - means) / np.where(deviations > 0, deviations, 1)
+    scores = np.nan_to_num(scores, nan=0.0) * np.array(list(indicators.values()))
+    return NeedMatrix(
+        codes=pd.Index(data["code"], name="code"),
+        indicators=list(indicators),
+        values=scores,
+    )
+
+
+def normalise_weights(weights, indicators):
+    """Weights as an array summing to 1 along the last axis. weights is a
+    dict of indicator: weight (missing indicators get 0), or an array with
+    one weight per indicator (or one row of them per weight vector).
+    """
+    if isinstance(weights, dict):
+        unknown = set(weights) - set(indicators)
+        if unknown:
+            raise ValueError(f"Unknown need indicators: {', '.join(sorted(unknown))}")
+        weights = [weights.get(indicator, 0) for indicator in indicators]
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape[-1] != len(indicators) or (weights < 0).any():
+        raise ValueError(
+            f"Expected non-negative weights for each of {', '.join(indicators)}"
+        )
+    totals = weights.sum(axis=-1, keepdims=True)
+    if (totals == 0).any():
+        raise ValueError("Weights must not all be 0")
+    return weights / totals
+
+
+def need_scores(matrix, weights=None):
+    """Need score of each LA for one weight vector (default: equal
+    weights), or a matrix of scores with one column per row of weights.
+    """
+    if weights is None:
+        weights = np.ones(len(matrix.indicators))
+    weights = normalise_weights(weights, matrix.indicators)
+    return matrix.values @ weights.T
+
+
+def rank_correlation(scores, grants):
+    """Spearman rank correlation between grants and each column of scores
+    (or scores, if it is one-dimensional), with tied values given their
+    average rank.
+    """
+    scores = np.asarray(scores, dtype=float)
+    one_dimensional = scores.ndim == 1
+    score_ranks = rankdata(scores.reshape(len(scores), -1), axis=0)
+    grant_ranks = rankdata(grants)
+    score_ranks -= score_ranks.mean(axis=0)
+    grant_ranks -= grant_ranks.mean()
+    correlations = (grant_ranks @ score_ranks) / (
+        np.linalg.norm(grant_ranks) * np.linalg.norm(score_ranks, axis=0)
+    )
+    return correlations[0] if one_dimensional else correlations
+
+
+def top_k_funded(scores, received, k=TOP_K):
+    """Share of the k LAs with the highest need score that received a
+    grant, for each column of scores (or scores, if it is one-dimensional).
+    """
+    scores = np.asarray(scores, dtype=float)
+    one_dimensional = scores.ndim == 1
+    scores = scores.reshape(len(scores), -1)
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+    shares = np.asarray(received, dtype=float)[top].mean(axis=0)
+    return shares[0] if one_dimensional else shares
+
+
+def need_ranking(data, weights=None, grants="total_grants"):
+    """The tidy dataset's LAs ranked by need score (for weights, default
+    equal weights), with their standardised indicators and the number of
+    grants they received.
+    """
+    matrix = need_matrix(data)
+    scores = need_scores(matrix, weights)
+    ranking = pd.DataFrame(matrix.values, columns=matrix.indicators)
+    ranking.insert(0, "code", matrix.codes)
+    ranking.insert(1, "clean_name", data["clean_name"].to_numpy())
+    ranking["need_score"] = scores
+    ranking["need_rank"] = rankdata(-scores, method="min").astype(int)
+    ranking[grants] = data[grants].to_numpy()
+    return ranking.sort_values("need_rank").reset_index(drop=True)
+
+
+def need_agreement(data, weights=None, grants="total_grants", k=TOP_K):
+    """How closely grant receipt follows need scores (for weights, default
+    equal weights). Returns a Series of the rank correlation between need
+    score and grants, the share of the k neediest LAs that received a
+    grant and the share of all LAs that did.
+    """
+    matrix = need_matrix(data)
+    scores = need_scores(matrix, weights)
+    grant_counts = data[grants].to_numpy(dtype=float, na_value=0)
+    return pd.Series(
+        {
+            "rank_correlation": rank_correlation(scores, grant_counts),
+            f"top_{k}_funded": top_k_funded(scores, grant_counts > 0, k),
+            "all_funded": (grant_counts > 0).mean(),
+        }
+    )
+
+
+def weight_sweep(data, n_weights=10_000, grants="total_grants", k=TOP_K, seed=None):
+    """Scores the tidy dataset's LAs with n_weights random weight vectors,
+    drawn uniformly from the simplex, as one matrix product.
+    Returns a DataFrame with each weight vector, the rank correlation
+    between its scores and grants and its top-k lift: the share of the k
+    neediest LAs that received a grant, minus the share of all LAs that did.
+    """
+    matrix = need_matrix(data)
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.ones(len(matrix.indicators)), n_weights)
+    scores = need_scores(matrix, weights)
+    grant_counts = data[grants].to_numpy(dtype=float, na_value=0)
+    received = grant_counts > 0
+    sweep = pd.DataFrame(weights, columns=matrix.indicators)
+    sweep["rank_correlation"] = rank_correlation(scores, grant_counts)
+    sweep[f"top_{k}_lift"] = top_k_funded(scores, received, k) - received.mean()
+    return sweep
+
+
+def sweep_summary(sweep, indicators=NEED_INDICATORS):
+    """Summarises a weight_sweep: the distribution of each agreement
+    measure over the weight vectors, the share of them for which it is
+    positive (grants going more to LAs in more need), and its correlation
+    with the weight given to each indicator (which indicators the
+    conclusions are most sensitive to).
+    """
+    measures = [column for column in sweep.columns if column not in indicators]
+    summary = sweep[measures].describe(percentiles=[0.05, 0.5, 0.95]).T
+    summary["share_positive"] = (sweep[measures] > 0).mean()
+    sensitivity = pd.DataFrame(
+        {
+            f"corr_{indicator}": sweep[measures].corrwith(sweep[indicator])
+            for indicator in indicators
+            if indicator in sweep
+        }
+    )
+    return summary.drop(columns="count").join(sensitivity)
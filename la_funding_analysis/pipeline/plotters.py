@@ -2,132 +2,132 @@
 """Functions to assist with plotting.
 """
 from la_funding_analysis import PROJECT_DIR
-from la_funding_analysis.utils.jitter_functions import jitter
+from la_funding_analysis.utils.instrumentation import instrumented
+from la_funding_analysis.utils.jitter_functions import (
+    jitter,
+    jitter_groups,
+    group_legend_handles,
+)
+from la_funding_analysis.pipeline.chart_data import (
+    grant_type_subtotals,
+    grant_count_proportions,
+    applicant_type_rates,
+    values_by_receipt_status,
+    faceted_grant_type_subtotals,
+    faceted_grant_count_proportions,
+)
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
+from matplotlib.collections import PathCollection
+
+FIGURES_DIR = PROJECT_DIR / "outputs/figures"
+
+
+# FIGURE LIFECYCLE
+
+
+def export_figure(plotter, filename, formats, directory=FIGURES_DIR, **kwargs):
+    """Renders a chart once by calling plotter(**kwargs), which returns
+    a figure, and saves it as filename with each of the given suffixes
+    (e.g. [".png", ".svg"]) in directory.
+    Every figure opened during the render is closed afterwards,
+    even if plotting or saving fails.
+    Returns the paths of the saved files.
+    """
+    open_before = set(plt.get_fignums())
+    try:
+        fig = plotter(**kwargs)
+        paths = [directory / (filename + suffix) for suffix in formats]
+        for path in paths:
+            fig.savefig(path)
+        return paths
+    finally:
+        for number in set(plt.get_fignums()) - open_before:
+            plt.close(number)
 
 
 # STACKED HORIZONTAL BAR PLOTS
 
 
-def stacked_no_members_by_grant_type(data, factor, graph_ylabel, graph_title, filename):
+@instrumented
+def stacked_no_members_by_grant_type(data, factor, graph_ylabel, graph_title):
     """Function to make a stacked bar chart of grants awarded to
     individual LAs and consortium leads (no members) split by factor
     in which sections are coloured according to the number of
     grants of each type.
     """
-    subtotals = (
-        data[["1a_no_members", "1b_no_members", "SHDDF", factor, "all_no_members"]]
-        .groupby(factor)
-        .sum()
-        .sort_values("all_no_members")
-        .drop(columns="all_no_members")
-        .rename(
-            columns={
-                "1a_no_members": "GHG LAD 1a",
-                "1b_no_members": "GHG LAD 1b",
-                "SHDF": "SHDDF",
-            }
-        )
-    )
+    subtotals = grant_type_subtotals(data, factor)
     fig, ax = plt.subplots()
     my_cmap = plt.get_cmap("tab10")
-    subtotals.plot.barh(stacked=True, color=my_cmap([1, 2, 3]), zorder=2)
-    plt.ylabel(graph_ylabel)
-    plt.xlabel("Number of grants")
-    plt.grid(axis="x", zorder=0)
-    plt.title(graph_title)
-    plt.tight_layout()
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    subtotals.plot.barh(stacked=True, color=my_cmap([1, 2, 3]), zorder=2, ax=ax)
+    ax.set_ylabel(graph_ylabel)
+    ax.set_xlabel("Number of grants")
+    ax.grid(axis="x", zorder=0)
+    ax.set_title(graph_title)
+    fig.tight_layout()
+    return fig
 
 
 # PROPORTION HORIZONTAL BAR PLOTS
 
 
-def proportion_by_number_of_grants(data, factor, graph_ylabel, graph_title, filename):
+@instrumented
+def proportion_by_number_of_grants(data, factor, graph_ylabel, graph_title):
     """Function to plot a bar graph in which bars are
     scaled to the number of LAs in the chosen factor.
     Bars are coloured according to the number of LAs
     receiving each number of grants.
     """
-    data = data[~data[factor].isna()]
-    # Count codes to ensure non-LAs are excluded
-    la_counts = data.groupby(factor).count()["code"]
-    num_factors = len(set(data[factor]))
-    #
-    new_index = [
-        (la_counts.index[i] + " (" + str(la_counts.values[i]) + ")")
-        for i in range(0, num_factors)
-    ]
-    num_grants = (
-        data.groupby([factor, "total_grants"])
-        .size()
-        .reset_index(name="counts")
-        .pivot(index=factor, columns="total_grants", values="counts")
-        .fillna(0)
-    )
-    num_grants["total"] = num_grants.sum(axis=1)
-    prop_grants = pd.DataFrame()
-    for i in [4, 3, 2, 1, 0]:
-        prop_grants[i] = num_grants[i] / num_grants["total"]
-    prop_grants["new_index"] = new_index
-    prop_grants = prop_grants.set_index("new_index")
-    prop_grants = prop_grants.reset_index().sort_values(0, ascending=False)
+    prop_grants = grant_count_proportions(data, factor).reset_index()
     #
     fig, ax = plt.subplots()
     my_cmap = plt.get_cmap("viridis")
-    ax = prop_grants.plot(
+    prop_grants.plot(
         x="new_index",
         kind="barh",
         stacked=True,
         color=my_cmap([0, 0.25, 0.5, 0.75, 1]),
         title=graph_title,
         zorder=2,
+        ax=ax,
     )
-    plt.xlim([0, 1])
+    ax.set_xlim([0, 1])
     ax.xaxis.set_major_formatter(
         mtick.PercentFormatter(xmax=1, decimals=None, symbol="%", is_latex=False)
     )
-    plt.xlabel("Percentage of local authorities")
-    plt.ylabel(graph_ylabel)
-    plt.legend(title="Number of grants", loc="center left", bbox_to_anchor=(1, 0.5))
-    plt.grid(axis="x", zorder=0)
-    plt.tight_layout()
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    ax.set_xlabel("Percentage of local authorities")
+    ax.set_ylabel(graph_ylabel)
+    ax.legend(title="Number of grants", loc="center left", bbox_to_anchor=(1, 0.5))
+    ax.grid(axis="x", zorder=0)
+    fig.tight_layout()
+    return fig
 
 
 # DUAL BAR CHART
 
 
-def dual_bar_by_applicant_type(data, factor, graph_ylabel, graph_title, filename):
+@instrumented
+def dual_bar_by_applicant_type(data, factor, graph_ylabel, graph_title):
     """Classifies LAs in each factor by whether or not they received a grant
     and whether or not they were an individual / consortium lead,
     then plots the frequency in each factor.
     """
-    data["grant"] = data["total_grants"] >= 1
-    data["ind_lead"] = data["all_no_members"] >= 1
-    types = data[[factor, "grant", "ind_lead"]].groupby("model").agg(["sum", "count"])
-    types["Individual or consortium lead only"] = (
-        types["ind_lead"]["sum"] / types["grant"]["count"]
-    )
-    types["Individual/lead/consortium member"] = (
-        types["grant"]["sum"] / types["grant"]["count"]
-    )
-    types.columns = types.columns.droplevel(1)
-    types = types.drop(columns=["grant", "ind_lead"])
+    types = applicant_type_rates(data, factor)
     #
-    ax = types.plot(kind="barh", zorder=2)
+    fig, ax = plt.subplots()
+    types.plot(kind="barh", zorder=2, ax=ax)
     ax.xaxis.set_major_formatter(
         mtick.PercentFormatter(xmax=1, decimals=None, symbol="%", is_latex=False)
     )
-    plt.title(graph_title)
-    plt.xlim([0, 1])
+    ax.set_title(graph_title)
+    ax.set_xlim([0, 1])
     ax.set_xticks(np.linspace(0, 1, 11))
-    plt.legend(
-        reversed(plt.legend().legendHandles),
+    handles, _ = ax.get_legend_handles_labels()
+    ax.legend(
+        reversed(handles),
         [
             "Individuals, leads and consortium members",
             "Individuals and consortium leads only",
@@ -135,31 +135,110 @@ def dual_bar_by_applicant_type(data, factor, graph_ylabel, graph_title, filename
         bbox_to_anchor=(0.5, -0.4),
         loc="lower center",
     )
-    plt.grid(axis="x", zorder=0)
-    plt.ylabel(graph_ylabel)
-    plt.xlabel("Percentage of local authorities")
-    plt.tight_layout()
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
-    plt.close()
+    ax.grid(axis="x", zorder=0)
+    ax.set_ylabel(graph_ylabel)
+    ax.set_xlabel("Percentage of local authorities")
+    fig.tight_layout()
+    return fig
+
+
+# FACETED PLOTS (small multiples of the charts above, one panel per
+# factor, sharing an x axis, colours and a legend)
+
+
+def facet_axes(table, graph_title):
+    """Creates a figure with one horizontal bar panel per facet of table
+    (indexed by facet, level), stacked vertically with a shared x axis and
+    heights proportional to each facet's number of levels.
+    Returns the figure and a dict of facet: axes.
+    """
+    facets = list(table.index.get_level_values(0).unique())
+    levels = [len(table.loc[facet]) for facet in facets]
+    fig, axes = plt.subplots(
+        len(facets),
+        1,
+        sharex=True,
+        squeeze=False,
+        figsize=(8, 1.5 + 0.3 * sum(levels)),
+        gridspec_kw={"height_ratios": levels},
+    )
+    fig.suptitle(graph_title)
+    return fig, dict(zip(facets, axes[:, 0]))
+
+
+@instrumented
+def faceted_stacked_no_members_by_grant_type(data, factors, graph_ylabels, graph_title):
+    """stacked_no_members_by_grant_type for each of factors as panels of
+    one figure, with graph_ylabels labelling the panels.
+    """
+    subtotals = faceted_grant_type_subtotals(data, tuple(factors))
+    fig, axes = facet_axes(subtotals, graph_title)
+    my_cmap = plt.get_cmap("tab10")
+    for (facet, ax), graph_ylabel in zip(axes.items(), graph_ylabels):
+        subtotals.loc[facet].plot.barh(
+            stacked=True, color=my_cmap([1, 2, 3]), zorder=2, legend=False, ax=ax
+        )
+        ax.set_ylabel(graph_ylabel)
+        ax.grid(axis="x", zorder=0)
+    ax.set_xlabel("Number of grants")
+    handles, labels = ax.get_legend_handles_labels()
+    fig.legend(handles, labels, loc="center right")
+    # Leave room on the right for the shared legend
+    fig.tight_layout(rect=(0, 0, 0.82, 1))
+    return fig
+
+
+@instrumented
+def faceted_proportion_by_number_of_grants(data, factors, graph_ylabels, graph_title):
+    """proportion_by_number_of_grants for each of factors as panels of
+    one figure, with graph_ylabels labelling the panels.
+    """
+    prop_grants = faceted_grant_count_proportions(data, tuple(factors))
+    fig, axes = facet_axes(prop_grants, graph_title)
+    my_cmap = plt.get_cmap("viridis")
+    for (facet, ax), graph_ylabel in zip(axes.items(), graph_ylabels):
+        prop_grants.loc[facet].plot.barh(
+            stacked=True,
+            color=my_cmap([0, 0.25, 0.5, 0.75, 1]),
+            zorder=2,
+            legend=False,
+            ax=ax,
+        )
+        ax.set_ylabel(graph_ylabel)
+        ax.grid(axis="x", zorder=0)
+    ax.set_xlim([0, 1])
+    ax.xaxis.set_major_formatter(
+        mtick.PercentFormatter(xmax=1, decimals=None, symbol="%", is_latex=False)
+    )
+    ax.set_xlabel("Percentage of local authorities")
+    handles, labels = ax.get_legend_handles_labels()
+    fig.legend(
+        handles,
+        labels,
+        title="Number of grants",
+        loc="center right",
+    )
+    # Leave room on the right for the shared legend
+    fig.tight_layout(rect=(0, 0, 0.85, 1))
+    return fig
 
 
 # BOXPLOT
 
 
-def boxplot_by_receipt_status(data, factor, graph_ylabel, graph_title, filename):
+@instrumented
+def boxplot_by_receipt_status(data, factor, graph_ylabel, graph_title):
     """Plots a boxplot of LA factor according to whether or not they
     received at least one grant of any type.
     """
-    data["received_grant"] = data["total_grants"] >= 1
-    data["Received at least one grant"] = "No"
-    data["Received at least one grant"][data["received_grant"]] = "Yes"
+    values = values_by_receipt_status(data, factor)
     fig, ax = plt.subplots()
-    data.boxplot(factor, by="Received at least one grant")
-    plt.suptitle("")
-    plt.title(graph_title)
-    plt.ylabel(graph_ylabel)
-    plt.grid(False)
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    values.boxplot(factor, by="Received at least one grant", ax=ax)
+    fig.suptitle("")
+    ax.set_title(graph_title)
+    ax.set_ylabel(graph_ylabel)
+    ax.grid(False)
+    return fig
 
 
 # STRIP PLOTS (scatter plots with a discrete x axis and
@@ -197,7 +276,8 @@ def set_up_strip_plot_axes(axes, ymin, ymax, graph_ylabel, graph_title, type="ng
     return axes
 
 
-def imd_strip_plot(data, filename):
+@instrumented
+def imd_strip_plot(data, rng=None):
     """Strip plot of number of grants received by a LA
     against the number of grants it received.
     """
@@ -217,11 +297,20 @@ def imd_strip_plot(data, filename):
         y=data_notna["imd_concentration"],
         alpha=0.25,
         zorder=5,
+        rng=rng,
     )
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    return fig
 
 
-def fp_clusters_strip_plot(data, filename):
+@instrumented
+def fp_clusters_strip_plot(
+    data,
+    top_left_grants=0,
+    top_left_min_fp=20,
+    middle_right_grants=3,
+    middle_right_max_fp=15,
+    rng=None,
+):
     """Strip plot of LA fuel poverty against the
     number of grants it received.
     Certain clusters of points are coloured differently
@@ -230,26 +319,30 @@ def fp_clusters_strip_plot(data, filename):
     have high fuel poverty, and the middle right cluster
     consists of LAs which received 3 grants but have
     relatively low fuel poverty.
+    The cut-offs defining the clusters can be changed
+    in the chart registry.
     """
     data_notna = data[~data["fp_proportion"].isna()]
     #
     # Define conditions for the 'top left' and 'middle right' clusters
-    # then separate these out so they can be plotted in different colours
-    # Numbers used in conditions were determined by inspection of the plot
-    #
-    tl_cond1 = data_notna["total_grants"] == 0
-    tl_cond2 = data_notna["fp_proportion"] > 20
-    tl_conds = [a and b for a, b in zip(tl_cond1, tl_cond2)]
-    top_left = data_notna[tl_conds]
+    # so they can be plotted in different colours
+    # Default cut-offs were determined by inspection of the plot
     #
-    mr_cond1 = data_notna["total_grants"] == 3
-    mr_cond2 = data_notna["fp_proportion"] < 15
-    mr_conds = [a and b for a, b in zip(mr_cond1, mr_cond2)]
-    middle_right = data_notna[mr_conds]
-    #
-    tl_index = top_left.index
-    mr_index = middle_right.index
-    rest = data_notna.drop(tl_index).drop(mr_index)
+    # Conditions are converted to numpy as the tidy data has nullable dtypes
+    cluster = np.select(
+        [
+            (
+                (data_notna["total_grants"] == top_left_grants)
+                & (data_notna["fp_proportion"] > top_left_min_fp)
+            ).to_numpy(dtype=bool),
+            (
+                (data_notna["total_grants"] == middle_right_grants)
+                & (data_notna["fp_proportion"] < middle_right_max_fp)
+            ).to_numpy(dtype=bool),
+        ],
+        ["top_left", "middle_right"],
+        default="rest",
+    )
     #
     fig, ax = plt.subplots()
     #
@@ -261,26 +354,35 @@ def fp_clusters_strip_plot(data, filename):
         graph_title="Fuel poverty rate of local authorities\nvs number of grants obtained",
         type="ngrants",
     )
-    plot_list = [
-        (top_left, {"c": "red", "alpha": 0.4, "zorder": 6}),
-        (middle_right, {"c": "green", "alpha": 0.4, "zorder": 5}),
-        (rest, {"c": "blue", "alpha": 0.25, "zorder": 2}),
-    ]
-    for df, plot_args in plot_list:
-        jitter(axes=ax, x=df["total_grants"], y=df["fp_proportion"], **plot_args)
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    styles = {
+        "top_left": {"c": "red", "alpha": 0.4, "zorder": 6},
+        "middle_right": {"c": "green", "alpha": 0.4, "zorder": 5},
+        "rest": {"c": "blue", "alpha": 0.25, "zorder": 2},
+    }
+    jitter_groups(
+        axes=ax,
+        x=data_notna["total_grants"],
+        y=data_notna["fp_proportion"],
+        groups=cluster,
+        styles=styles,
+        rng=rng,
+    )
+    return fig
 
 
-def westmids_london_fp_strip_plot(data, filename):
+@instrumented
+def westmids_london_fp_strip_plot(data, rng=None):
     """Strip plot of LA fuel poverty against number of grants
     (same as above) but this time points are coloured according
     to their region - West Midlands, London or other.
     """
     data_notna = data[~data["fp_proportion"].isna()]
     #
-    wm_data = data_notna[data_notna["region_1"] == "West Midlands"]
-    london_data = data_notna[data_notna["region_1"] == "London"]
-    neither_data = data_notna.drop(wm_data.index).drop(london_data.index)
+    region = (
+        data_notna["region_1"]
+        .astype(object)
+        .where(data_notna["region_1"].isin(["West Midlands", "London"]), "Other")
+    )
     fig, ax = plt.subplots()
     set_up_strip_plot_axes(
         axes=ax,
@@ -290,21 +392,28 @@ def westmids_london_fp_strip_plot(data, filename):
         graph_title="Fuel poverty rate of local authorities\nvs number of grants obtained",
         type="ngrants",
     )
-    plot_list = [
-        (wm_data, {"c": "red", "alpha": 0.35, "zorder": 6}),
-        (london_data, {"c": "blue", "alpha": 0.35, "zorder": 5}),
-        (neither_data, {"c": "grey", "alpha": 0.25, "zorder": 2}),
-    ]
-    for df, plot_args in plot_list:
-        jitter(axes=ax, x=df["total_grants"], y=df["fp_proportion"], **plot_args)
-    ax.legend(["West Midlands", "London", "Other"], title="Region", loc="lower right")
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    styles = {
+        "West Midlands": {"c": "red", "alpha": 0.35, "zorder": 6},
+        "London": {"c": "blue", "alpha": 0.35, "zorder": 5},
+        "Other": {"c": "grey", "alpha": 0.25, "zorder": 2},
+    }
+    jitter_groups(
+        axes=ax,
+        x=data_notna["total_grants"],
+        y=data_notna["fp_proportion"],
+        groups=region,
+        styles=styles,
+        rng=rng,
+    )
+    ax.legend(handles=group_legend_handles(styles), title="Region", loc="lower right")
+    return fig
 
 
 # Improvable social housing plots
 
 
-def improvable_strip_plot(data, factor, filename):
+@instrumented
+def improvable_strip_plot(data, factor, rng=None):
     """Plots counts/proportions of 'improvable' EPCs against whether
     or not the LA received SHDDF.
     An 'improvable' socially rented dwelling is one that is currently
@@ -342,28 +451,72 @@ def improvable_strip_plot(data, factor, filename):
     standout_points = data_notna[data_notna["high_improvable_no_SHDDF"]].reset_index(
         drop=True
     )
-    other_points = data_notna[~data_notna["high_improvable_no_SHDDF"]]
-    plot_list = [
-        (standout_points, {"c": "red", "alpha": 0.5, "deviation": 0, "zorder": 6}),
-        (other_points, {"c": "blue", "alpha": 0.1, "deviation": 0.01, "zorder": 1}),
-    ]
-    for df, plot_args in plot_list:
-        jitter(axes=ax, x=df["SHDDF"], y=df[factor], **plot_args)
+    styles = {
+        True: {"c": "red", "alpha": 0.5, "deviation": 0, "zorder": 6},
+        False: {"c": "blue", "alpha": 0.1, "deviation": 0.01, "zorder": 1},
+    }
+    jitter_groups(
+        axes=ax,
+        x=data_notna["SHDDF"],
+        y=data_notna[factor],
+        groups=data_notna["high_improvable_no_SHDDF"],
+        styles=styles,
+        rng=rng,
+    )
     #
-    ax.annotate(
-        "County Durham",
-        (0.02, standout_points[factor][0]),
-        fontsize=8,
+    # Label the first three standout LAs (fewer if there aren't three)
+    labels = ["County Durham"] + list(standout_points["region_3"][1:3])
+    for label, value in zip(labels, standout_points[factor]):
+        ax.annotate(label, (0.02, value), fontsize=8)
+    fig.tight_layout()
+    return fig
+
+
+# MAPS
+
+
+@instrumented
+def choropleth(
+    data,
+    column,
+    graph_title=None,
+    legend_label=None,
+    tolerance=500,
+    cmap="viridis",
+    cache_path=None,
+):
+    """Map of LAs coloured by a column of the tidy dataset, joined on code.
+    LAs with no value (or missing from data) are shaded grey.
+    Boundaries are simplified to within tolerance metres (see
+    pipeline/boundaries.py), cached at cache_path (default BOUNDARIES_CACHE).
+    """
+    # Imported here so that importing plotters doesn't load the map code
+    from la_funding_analysis.pipeline.boundaries import (
+        BOUNDARIES_CACHE,
+        boundary_paths,
+        load_boundaries,
     )
-    ax.annotate(
-        standout_points["region_3"][1],
-        (0.02, standout_points[factor][1]),
-        fontsize=8,
+
+    boundaries = load_boundaries(tolerance, cache_path=cache_path or BOUNDARIES_CACHE)
+    paths, polygon_codes = boundary_paths(boundaries)
+    values = (
+        data.drop_duplicates(subset="code")
+        .set_index("code")[column]
+        .reindex(boundaries.codes)
+        .to_numpy(dtype=float, na_value=np.nan)
     )
-    ax.annotate(
-        standout_points["region_3"][2],
-        (0.02, standout_points[factor][2]),
-        fontsize=8,
+    colour_map = plt.get_cmap(cmap).copy()
+    colour_map.set_bad("#d3d3d3")
+    fig, ax = plt.subplots(figsize=(6, 7))
+    collection = PathCollection(
+        paths, cmap=colour_map, edgecolor="white", linewidth=0.1
     )
-    plt.tight_layout()
-    plt.savefig(PROJECT_DIR / "outputs/figures" / filename)
+    collection.set_array(np.ma.masked_invalid(values[polygon_codes]))
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    ax.set_aspect("equal")
+    ax.set_axis_off()
+    fig.colorbar(collection, ax=ax, shrink=0.6, label=legend_label or column)
+    ax.set_title(graph_title or column)
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,369 @@
+# File: pipeline/query_service.py
+"""Local HTTP service answering queries about the tidy LA dataset, so
+that questions like "which LAs got 4 grants" don't need the dataset to
+be rebuilt in a notebook:
+
+    GET /rows?total_grants=4&columns=clean_name,region_1
+    GET /summary?by=region_1&columns=total_grants,fp_proportion&agg=mean
+    GET /tables/grant_count_proportions?factor=majority
+    GET /                                     (columns, rows and tables)
+
+Rows are filtered by column=value (several values separated by commas),
+or column__gt, __gte, __lt, __lte or __ne=value. /summary applies the same
+filters before grouping by the columns in "by". /tables serves the
+aggregate tables behind the charts (see pipeline/chart_data.py), those
+used by the chart registry being computed when the dataset is loaded.
+Responses are JSON records, or an Arrow IPC stream with format=arrow.
+
+The dataset is loaded into memory once, from the stage cache (building
+it first if needed), and reloaded when the cached file changes.
+Each response's ETag is the dataset's hash, so clients can revalidate
+with If-None-Match, and recent responses are kept in an LRU cache.
+Served with asyncio streams from the standard library, one request per
+connection; loading the dataset and answering queries run in worker
+threads, one at a time, so that the event loop keeps accepting requests.
+"""
+
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+
+from la_funding_analysis import logger
+from la_funding_analysis.pipeline import chart_data
+from la_funding_analysis.pipeline.stages import cache_path, load_stage
+
+# Number of responses kept in the LRU cache
+QUERY_CACHE_SIZE = 256
+# Seconds between checks of the stage cache for a new dataset
+RELOAD_INTERVAL = 2.0
+
+FILTER_OPERATORS = {
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "ne": lambda column, value: column != value,
+}
+AGGREGATIONS = ["count", "sum", "mean", "median", "min", "max"]
+# Query parameters that aren't filters
+OPTIONS = ["columns", "by", "agg", "format", "limit", "factor", "factors"]
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+
+# Aggregate tables that can be served, by chart_data function name
+TABLES = [
+    name
+    for name, function in vars(chart_data).items()
+    if hasattr(function, "cache_key")
+]
+
+
+def parse_value(column, value):
+    """Converts a query string value to the type of a column."""
+    if pd.api.types.is_bool_dtype(column):
+        if value.lower() not in ["true", "false"]:
+            raise ValueError(f"Expected true or false for {column.name}: {value}")
+        return value.lower() == "true"
+    if pd.api.types.is_numeric_dtype(column):
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Expected a number for {column.name}: {value}")
+    return value
+
+
+def filter_rows(data, filters):
+    """Rows of data matching every filter, a dict of parameter: [values]
+    from the query string (see the module docstring).
+    """
+    mask = pd.Series(True, index=data.index)
+    for parameter, values in filters.items():
+        name, _, operator = parameter.partition("__")
+        if name not in data.columns:
+            raise ValueError(f"Unknown column: {name}")
+        column = data[name]
+        if operator:
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unknown filter: {parameter}")
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                # Categoricals can't be compared by order, so are compared
+                # as their values
+                column = column.astype(column.cat.categories.dtype)
+            for value in values:
+                matches = FILTER_OPERATORS[operator](column, parse_value(column, value))
+                mask &= matches.fillna(False).astype(bool)
+        else:
+            options = [
+                parse_value(column, option)
+                for value in values
+                for option in value.split(",")
+            ]
+            mask &= column.isin(options).fillna(False).astype(bool)
+    return data.loc[mask]
+
+
+def _columns(data, parameter):
+    """The columns named in a comma-separated query parameter."""
+    columns = [column for column in parameter.split(",") if column]
+    unknown = set(columns) - set(data.columns)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    return columns
+
+
+def query_rows(data, options, filters):
+    """Filtered rows, optionally with only some columns and rows."""
+    rows = filter_rows(data, filters)
+    if "columns" in options:
+        rows = rows[_columns(data, options["columns"])]
+    if "limit" in options:
+        rows = rows.head(int(options["limit"]))
+    return rows.reset_index(drop=True)
+
+
+def query_summary(data, options, filters):
+    """Filtered rows grouped by the columns in options["by"], with the
+    aggregation in options["agg"] (default count) of options["columns"]
+    (default all numeric columns).
+    """
+    if "by" not in options:
+        raise ValueError("A summary needs columns to group by")
+    by = _columns(data, options["by"])
+    agg = options.get("agg", "count")
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {agg}")
+    rows = filter_rows(data, filters)
+    if "columns" in options:
+        columns = _columns(data, options["columns"])
+    else:
+        columns = [
+            column
+            for column in rows.select_dtypes("number").columns
+            if column not in by
+        ]
+    summary = rows.groupby(by, dropna=False)[columns].agg(agg)
+    summary.insert(0, "n_las", rows.groupby(by, dropna=False).size())
+    return summary.reset_index()
+
+
+def query_table(data, name, options):
+    """An aggregate table from chart_data, with its index as columns."""
+    if name not in TABLES:
+        raise ValueError(f"Unknown table: {name}")
+    kwargs = {}
+    if "factor" in options:
+        kwargs["factor"] = options["factor"]
+    if "factors" in options:
+        kwargs["factors"] = tuple(options["factors"].split(","))
+    for factor in [kwargs.get("factor"), *kwargs.get("factors", ())]:
+        if factor is not None and factor not in data.columns:
+            raise ValueError(f"Unknown column: {factor}")
+    try:
+        table = getattr(chart_data, name)(data, **kwargs)
+    except TypeError as error:
+        raise ValueError(f"Bad arguments for {name}: {error}")
+    table.columns = [str(column) for column in table.columns]
+    return table.reset_index()
+
+
+def encode(table, format):
+    """A table as JSON records or an Arrow IPC stream, with its content type."""
+    if format == "arrow":
+        import pyarrow as pa
+
+        arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        return sink.getvalue().to_pybytes(), ARROW_TYPE
+    if format not in [None, "json"]:
+        raise ValueError(f"Unknown format: {format}")
+    return table.to_json(orient="records").encode(), "application/json"
+
+
+class QueryService:
+    """The tidy dataset held in memory, with its hash (the ETag of every
+    response) and an LRU cache of responses. lock is held while the
+    dataset is loaded or queried.
+    """
+
+    def __init__(self, cache_size=QUERY_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.responses = OrderedDict()
+        self.data = None
+        self.etag = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Loads the tidy dataset (building it if it isn't cached) and
+        computes the tables used by the chart registry.
+        """
+        from la_funding_analysis.analysis.generate_plots import chart_jobs
+        from la_funding_analysis.pipeline.chart_registry import chart_tables
+
+        with self.lock:
+            data = load_stage("tidy_data")
+            self.mtime = cache_path("tidy_data").stat().st_mtime
+            chart_data.clear_chart_data_cache()
+            chart_data.compute_tables(data, chart_tables(chart_jobs()))
+            self.data = data
+            self.etag = f'"{chart_data.dataset_hash(data)}"'
+            self.responses.clear()
+        logger.info(f"Query service loaded {len(data)} rows ({self.etag})")
+
+    def reload_if_changed(self):
+        """Reloads the dataset if the stage cache has changed since it
+        was loaded. Returns whether it was reloaded.
+        """
+        path = cache_path("tidy_data")
+        if path.exists() and path.stat().st_mtime != self.mtime:
+            self.load()
+            return True
+        return False
+
+    def respond(self, target):
+        """Status, content type and body of the response to a request
+        target (path and query string), from the cache if possible.
+        """
+        with self.lock:
+            return self._respond(target)
+
+    def _respond(self, target):
+        if target in self.responses:
+            self.responses.move_to_end(target)
+            return self.responses[target]
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        options = {name: query.pop(name)[-1] for name in OPTIONS if name in query}
+        path = unquote(url.path).rstrip("/")
+        try:
+            if path == "":
+                body = json.dumps(
+                    {
+                        "rows": len(self.data),
+                        "columns": {
+                            column: str(dtype)
+                            for column, dtype in self.data.dtypes.items()
+                        },
+                        "tables": TABLES,
+                        "etag": self.etag,
+                    }
+                ).encode()
+                response = (200, "application/json", body)
+            elif path in ["/rows", "/summary"] or path.startswith("/tables/"):
+                if path == "/rows":
+                    table = query_rows(self.data, options, query)
+                elif path == "/summary":
+                    table = query_summary(self.data, options, query)
+                else:
+                    table = query_table(self.data, path[len("/tables/") :], options)
+                body, content_type = encode(table, options.get("format"))
+                response = (200, content_type, body)
+            else:
+                return 404, "application/json", _error(f"Not found: {path}")
+        except ValueError as error:
+            # Errors aren't cached, as they are cheap to answer
+            return 400, "application/json", _error(str(error))
+        self.responses[target] = response
+        if len(self.responses) > self.cache_size:
+            self.responses.popitem(last=False)
+        return response
+
+    async def handle(self, reader, writer):
+        """Answers one HTTP request on a connection, then closes it."""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ["\r\n", "\n", ""]:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) != 3:
+                return
+            method, target, _ = request_line
+            if method not in ["GET", "HEAD"]:
+                status, content_type, body = (
+                    405,
+                    "application/json",
+                    _error("Only GET requests are supported"),
+                )
+            elif headers.get("if-none-match") == self.etag:
+                status, content_type, body = 304, None, b""
+            else:
+                try:
+                    status, content_type, body = await asyncio.to_thread(
+                        self.respond, target
+                    )
+                except Exception:
+                    logger.exception(f"Query service failed to answer {target}")
+                    status, content_type, body = (
+                        500,
+                        "application/json",
+                        _error("Internal server error"),
+                    )
+            logger.info(f"{method} {target} {status}")
+            _write_response(
+                writer, status, content_type, body, self.etag, method == "HEAD"
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self, interval=RELOAD_INTERVAL):
+        """Reloads the dataset whenever the stage cache changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception as error:
+                # Keep serving the loaded dataset, e.g. if the cache
+                # is being rewritten
+                logger.warning(f"Query service failed to reload: {error}")
+
+
+REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+def _error(message):
+    return json.dumps({"error": message}).encode()
+
+
+def _write_response(writer, status, content_type, body, etag, head=False):
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"ETag: {etag}"]
+    if content_type:
+        lines.append(f"Content-Type: {content_type}")
+    lines += [f"Content-Length: {len(body)}", "Connection: close", "", ""]
+    writer.write("\r\n".join(lines).encode("latin-1"))
+    if not head:
+        writer.write(body)
+
+
+async def _serve(service, host, port, interval):
+    server = await asyncio.start_server(service.handle, host, port)
+    logger.info(f"Query service listening on http://{host}:{port}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), service.watch(interval))
+
+
+def serve(host="127.0.0.1", port=8050, interval=RELOAD_INTERVAL):
+    """Loads the tidy dataset and serves queries about it until stopped."""
+    service = QueryService()
+    service.load()
+    asyncio.run(_serve(service, host, port, interval))
@@ -0,0 +1,108 @@
+# File: pipeline/rendering.py
+"""Functions to render many charts in parallel.
+Each chart is a job (a plotting function and its arguments) that is run
+in a pool of worker processes using the non-interactive Agg backend.
+The dataset, and any chart tables shared between jobs, are sent to each
+worker once when the pool starts, rather than being pickled with every job.
+"""
+
+import time
+from concurrent.futures import as_completed, ProcessPoolExecutor
+
+import pandas as pd
+
+from la_funding_analysis import logger
+from la_funding_analysis.pipeline import chart_data, plotters
+from la_funding_analysis.pipeline.plotters import export_figure, FIGURES_DIR
+
+# Dataset shared by all jobs run in a worker process
+_worker_data = None
+
+
+def _init_worker(data, tables=None):
+    """Sets up a worker process with the Agg backend, the shared dataset
+    and any precomputed chart tables.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    global _worker_data
+    _worker_data = data
+    chart_data.load_tables(tables or {})
+
+
+def _render_job(plotter, kwargs, filename, formats, directory):
+    """Renders one chart with the worker's dataset, saves it in each format
+    and returns the time taken in seconds.
+    plotter is the name of a function in pipeline/plotters.py.
+    """
+    start = time.perf_counter()
+    export_figure(
+        getattr(plotters, plotter),
+        filename,
+        formats,
+        directory=directory,
+        data=_worker_data,
+        **kwargs,
+    )
+    return time.perf_counter() - start
+
+
+def render_charts(
+    data, jobs, formats=None, processes=None, directory=None, tables=None
+):
+    """Renders every chart job once and saves it in each of its formats
+    (e.g. [".png", ".svg"]) in directory (defaults to outputs/figures).
+    jobs is a list of (plotting function name, keyword arguments, filename
+    without suffix, formats) tuples; formats, if given, overrides the
+    formats of every job. Charts are rendered in parallel across
+    processes workers (defaults to the number of CPUs); processes=1
+    renders them one at a time in the current process.
+    tables optionally lists chart tables (chart_data function name,
+    keyword arguments) used by several jobs, which are computed once
+    up front and shared with every worker.
+    Returns a DataFrame of render times per chart, which are also logged.
+    """
+    directory = directory or FIGURES_DIR
+    start = time.perf_counter()
+    jobs = [
+        (plotter, kwargs, filename, formats or job_formats)
+        for plotter, kwargs, filename, job_formats in jobs
+    ]
+    shared_tables = chart_data.compute_tables(data, tables or [])
+    timings = {}
+    if processes == 1:
+        _init_worker(data)
+        for plotter, kwargs, filename, formats in jobs:
+            timings[filename] = _render_job(
+                plotter, kwargs, filename, formats, directory
+            )
+            logger.info(f"Rendered {filename} in {timings[filename]:.2f}s")
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(data, shared_tables),
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _render_job, plotter, kwargs, filename, formats, directory
+                ): filename
+                for plotter, kwargs, filename, formats in jobs
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                timings[filename] = future.result()
+                logger.info(f"Rendered {filename} in {timings[filename]:.2f}s")
+    #
+    total = time.perf_counter() - start
+    logger.info(
+        f"Rendered {len(jobs)} charts in {total:.2f}s "
+        f"(slowest chart {max(timings.values(), default=0):.2f}s)"
+    )
+    return (
+        pd.Series(timings, name="seconds", dtype=float)
+        .rename_axis("chart")
+        .sort_values(ascending=False)
+        .reset_index()
+    )
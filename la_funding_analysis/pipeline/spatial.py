@@ -0,0 +1,251 @@
+# File: pipeline/spatial.py
+"""Functions for analysing the spatial structure of the LA data.
+LA centroids are indexed in a KD-tree, from which neighbour weights matrices
+are built for all LAs at once. These give spatially lagged variables
+(e.g. the share of an LA's neighbours that received SHDDF) and
+Moran's I statistics with permutation inference.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from la_funding_analysis.pipeline.cleaning import get_clean_la_centroids
+from la_funding_analysis.pipeline.joining import form_all_tidy_data
+
+SpatialIndex = namedtuple("SpatialIndex", ["codes", "tree"])
+SpatialIndex.__doc__ = """KD-tree over LA centroids.
+codes holds the LA code of each point in the tree, in tree order."""
+
+
+def build_centroid_tree(centroids):
+    """Builds a SpatialIndex from a DataFrame of LA centroids
+    with code, easting and northing columns.
+    """
+    centroids = centroids.dropna(subset=["code", "easting", "northing"])
+    return SpatialIndex(
+        codes=pd.Index(centroids["code"], name="code"),
+        tree=cKDTree(centroids[["easting", "northing"]].to_numpy(dtype=float)),
+    )
+
+
+def align_to_index(spatial_index, data, column):
+    """Returns the values of data[column] in the order of the spatial index,
+    with NaN for LAs that are missing from data or whose value is missing
+    (including <NA> in nullable integer columns).
+    """
+    values = data.drop_duplicates(subset="code").set_index("code")[column]
+    return values.reindex(spatial_index.codes).to_numpy(dtype=float, na_value=np.nan)
+
+
+def _check_k(spatial_index, k):
+    """Raises a ValueError unless each LA has k other LAs to be neighbours."""
+    n = len(spatial_index.codes)
+    if not 1 <= k < n:
+        raise ValueError(f"k must be between 1 and {n - 1} (one less than the LAs)")
+
+
+def k_nearest_neighbours(spatial_index, k):
+    """Finds the k nearest neighbours of every LA (excluding itself).
+    Returns a long DataFrame with code, neighbour_code, rank and distance (m).
+    """
+    _check_k(spatial_index, k)
+    # The closest point to each centroid is the centroid itself
+    distances, positions = spatial_index.tree.query(spatial_index.tree.data, k=k + 1)
+    codes = spatial_index.codes.to_numpy()
+    return pd.DataFrame(
+        {
+            "code": np.repeat(codes, k),
+            "neighbour_code": codes[positions[:, 1:]].ravel(),
+            "rank": np.tile(np.arange(1, k + 1), len(codes)),
+            "distance": distances[:, 1:].ravel(),
+        }
+    )
+
+
+def radius_neighbours(spatial_index, radius):
+    """Finds all pairs of LAs whose centroids are within radius metres
+    of each other (excluding self-pairs).
+    Returns a long DataFrame with code, neighbour_code and distance (m).
+    """
+    pairs = spatial_index.tree.sparse_distance_matrix(
+        spatial_index.tree, radius, output_type="coo_matrix"
+    )
+    not_self = pairs.row != pairs.col
+    codes = spatial_index.codes.to_numpy()
+    return (
+        pd.DataFrame(
+            {
+                "code": codes[pairs.row[not_self]],
+                "neighbour_code": codes[pairs.col[not_self]],
+                "distance": pairs.data[not_self],
+            }
+        )
+        .sort_values(["code", "distance"])
+        .reset_index(drop=True)
+    )
+
+
+def knn_weights(spatial_index, k):
+    """Row-standardised sparse weights matrix in which each LA's
+    k nearest neighbours get weight 1 / k.
+    """
+    _check_k(spatial_index, k)
+    n = len(spatial_index.codes)
+    _, positions = spatial_index.tree.query(spatial_index.tree.data, k=k + 1)
+    return sparse.csr_matrix(
+        (np.full(n * k, 1 / k), (np.repeat(np.arange(n), k), positions[:, 1:].ravel())),
+        shape=(n, n),
+    )
+
+
+def radius_weights(spatial_index, radius):
+    """Row-standardised sparse weights matrix in which all LAs within
+    radius metres of an LA share its weight equally.
+    LAs with no neighbours in range get a row of zeros.
+    """
+    pairs = spatial_index.tree.sparse_distance_matrix(
+        spatial_index.tree, radius, output_type="coo_matrix"
+    )
+    not_self = pairs.row != pairs.col
+    adjacency = sparse.csr_matrix(
+        (np.ones(not_self.sum()), (pairs.row[not_self], pairs.col[not_self])),
+        shape=pairs.shape,
+    )
+    n_neighbours = np.asarray(adjacency.sum(axis=1)).ravel()
+    scale = np.divide(
+        1, n_neighbours, out=np.zeros_like(n_neighbours), where=n_neighbours > 0
+    )
+    return sparse.diags(scale) @ adjacency
+
+
+def spatial_lag(weights, values):
+    """Weighted average of each LA's neighbours' values.
+    Neighbours with missing values are left out and the remaining
+    weights rescaled; LAs with no non-missing neighbours get NaN.
+    """
+    present = ~np.isnan(values)
+    weighted_sum = weights @ np.where(present, values, 0)
+    weight_total = weights @ present.astype(float)
+    return np.divide(
+        weighted_sum,
+        weight_total,
+        out=np.full(len(values), np.nan),
+        where=weight_total > 0,
+    )
+
+
+def _morans_statistic(weights, deviations):
+    """Moran's I for each column of deviations (values minus their mean)."""
+    lagged = weights @ deviations
+    return (
+        len(deviations)
+        / weights.sum()
+        * (deviations * lagged).sum(axis=0)
+        / (deviations**2).sum(axis=0)
+    )
+
+
+def morans_i(weights, values, permutations=999, seed=None):
+    """Moran's I for values under the given weights matrix, with a pseudo
+    p-value from random permutations of the values across LAs.
+    All permutations are evaluated together as one sparse matrix product.
+    LAs with missing values (NaN) are dropped, and a ValueError is raised
+    if fewer than two LAs have values.
+    Returns a Series with I, expected_I, p_value and z_score (relative to
+    the permutation distribution).
+    """
+    present = ~np.isnan(values)
+    if present.sum() < 2:
+        raise ValueError("Moran's I needs values for at least two LAs")
+    weights = weights[present][:, present]
+    z = values[present] - values[present].mean()
+    n = len(z)
+
+    observed = _morans_statistic(weights, z[:, None])[0]
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.tile(z[:, None], (1, permutations)), axis=0)
+    simulated = _morans_statistic(weights, permuted)
+    # Two-sided pseudo p-value, counting the observed value as one permutation
+    extreme = np.abs(simulated - simulated.mean()) >= np.abs(
+        observed - simulated.mean()
+    )
+    return pd.Series(
+        {
+            "I": observed,
+            "expected_I": -1 / (n - 1),
+            "p_value": (extreme.sum() + 1) / (permutations + 1),
+            "z_score": (observed - simulated.mean()) / simulated.std(),
+        }
+    )
+
+
+def add_spatial_lags(data, spatial_index, weights, columns):
+    """Adds a "<column>_neighbour_lag" column to data for each given column,
+    holding the weighted average of that column over each LA's neighbours.
+    Returns a new DataFrame; LAs without a centroid get NaN.
+    """
+    lags = pd.DataFrame(
+        {
+            f"{column}_neighbour_lag": spatial_lag(
+                weights, align_to_index(spatial_index, data, column)
+            )
+            for column in columns
+        },
+        index=spatial_index.codes,
+    )
+    return data.merge(lags, how="left", left_on="code", right_index=True)
+
+
+def _add_grant_indicators(la_data):
+    """Adds 0/1 columns for whether each LA received SHDDF / any grant,
+    so that their spatial lags are shares of neighbours.
+    """
+    return la_data.assign(
+        SHDDF_received=(la_data["SHDDF"] > 0).astype(float),
+        received_grant=(la_data["total_grants"] > 0).astype(float),
+    )
+
+
+def get_la_spatial_data(k=8):
+    """Forms the tidy LA dataset with spatially lagged versions of the
+    grant, fuel poverty and IMD columns, using each LA's k nearest neighbours.
+    For example, SHDDF_received_neighbour_lag is the share of an LA's
+    neighbours that received SHDDF.
+    """
+    la_data = _add_grant_indicators(form_all_tidy_data())
+    spatial_index = build_centroid_tree(get_clean_la_centroids())
+    return add_spatial_lags(
+        la_data,
+        spatial_index,
+        knn_weights(spatial_index, k),
+        ["SHDDF_received", "received_grant", "fp_proportion", "imd_concentration"],
+    )
+
+
+def get_morans_i_table(
+    columns=("SHDDF_received", "received_grant", "fp_proportion"),
+    k=8,
+    permutations=999,
+    seed=None,
+):
+    """Computes Moran's I with permutation inference for each given column
+    of the tidy LA dataset, using k-nearest-neighbour weights.
+    """
+    la_data = _add_grant_indicators(form_all_tidy_data())
+    spatial_index = build_centroid_tree(get_clean_la_centroids())
+    weights = knn_weights(spatial_index, k)
+    return pd.DataFrame(
+        {
+            column: morans_i(
+                weights,
+                align_to_index(spatial_index, la_data, column),
+                permutations=permutations,
+                seed=seed,
+            )
+            for column in columns
+        }
+    ).T.rename_axis("variable")
@@ -0,0 +1,92 @@
+# File: pipeline/stages.py
+"""Registry of the pipeline's data stages and a cache of their outputs.
+Stages are referred to by module and function name, so that they can be
+listed without importing pandas or any of the pipeline code.
+Stage outputs are cached in outputs/cache so that later commands
+(e.g. rendering charts) don't have to rebuild the data.
+"""
+
+from importlib import import_module
+
+from la_funding_analysis import PROJECT_DIR
+
+CACHE_DIR = PROJECT_DIR / "outputs/cache"
+
+# Stage name: (module, function, description)
+STAGES = {
+    "fuel_poverty": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_fuel_poverty",
+        "Clean fuel poverty data, including LA regional structure",
+    ),
+    "parties_models": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_parties_models",
+        "Clean LA majority parties (August 2021) and models",
+    ),
+    "old_parties": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_old_parties",
+        "Clean LA majority parties (August 2020)",
+    ),
+    "imd": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_imd",
+        "Clean IMD local concentration data",
+    ),
+    "grants": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_grants",
+        "Grants per LA, scheme, round and role, in long form",
+    ),
+    "epc": (
+        "la_funding_analysis.pipeline.cleaning",
+        "get_clean_epc",
+        "Median EPC and improvable social housing counts per LA",
+    ),
+    "tidy_data": (
+        "la_funding_analysis.pipeline.joining",
+        "form_all_tidy_data",
+        "All datasets joined into one tidy row per LA",
+    ),
+    "epc_monthly": (
+        "la_funding_analysis.pipeline.time_series",
+        "get_epc_monthly_summary",
+        "Monthly and 12-month rolling EPC summaries per LA",
+    ),
+    "pre_post_grant": (
+        "la_funding_analysis.pipeline.time_series",
+        "get_pre_post_grant_comparison",
+        "EPCs per LA in the 12 months before and after its first grant",
+    ),
+}
+
+
+def stage_function(name):
+    """Imports and returns the function that computes a stage."""
+    module, function, _ = STAGES[name]
+    return getattr(import_module(module), function)
+
+
+def cache_path(name):
+    """Path of the cached output of a stage."""
+    return CACHE_DIR / f"{name}.pkl"
+
+
+def run_stage(name):
+    """Computes a stage, caches its output and returns it."""
+    output = stage_function(name)()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    output.to_pickle(cache_path(name))
+    return output
+
+
+def load_stage(name, rebuild=False):
+    """Returns the cached output of a stage, computing it first
+    if it has not been cached yet or rebuild is True.
+    """
+    import pandas as pd
+
+    if rebuild or not cache_path(name).exists():
+        return run_stage(name)
+    return pd.read_pickle(cache_path(name))
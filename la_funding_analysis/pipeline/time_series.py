@@ -0,0 +1,273 @@
+# File: pipeline/time_series.py
+"""Functions for analysing EPCs over time by lodgement date.
+Certificates are indexed once by LA and lodgement date; windows
+(calendar months, or periods before/after a grant was awarded) are then
+located with binary search on the sorted index rather than by filtering
+the EPC data once per window.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from la_funding_analysis import config
+from la_funding_analysis.getters.local_authority_data import get_epc
+from la_funding_analysis.pipeline.cleaning import (
+    SOCIAL_TENURES,
+    grant_schemes,
+    is_improvable,
+)
+from la_funding_analysis.pipeline.joining import form_all_tidy_data
+
+# Each row of the index is keyed by LA position * _KEY_SPAN + days since 1970,
+# so sorting by key sorts by LA and then by lodgement date
+_KEY_SPAN = 2**32
+
+LodgementIndex = namedtuple(
+    "LodgementIndex", ["codes", "keys", "days", "efficiency", "improvable"]
+)
+LodgementIndex.__doc__ = """EPC certificates sorted by LA and lodgement date.
+codes holds the LA codes; the other fields are aligned arrays with one
+entry per certificate."""
+
+
+def index_epc_by_lodgement(epc):
+    """Sorts certificates by LA and lodgement date and returns a LodgementIndex.
+    Certificates without a lodgement date are dropped.
+    """
+    epc = epc[~epc["LODGEMENT_DATE"].isna()]
+    la_codes = pd.Categorical(epc["LOCAL_AUTHORITY"])
+    days = (
+        pd.to_datetime(epc["LODGEMENT_DATE"]).to_numpy().astype("datetime64[D]")
+    ).astype(np.int64)
+    keys = la_codes.codes.astype(np.int64) * _KEY_SPAN + days
+    order = np.argsort(keys, kind="stable")
+
+    improvable = epc["TENURE"].isin(SOCIAL_TENURES) & is_improvable(epc)
+    return LodgementIndex(
+        codes=pd.Index(la_codes.categories, name="code"),
+        keys=keys[order],
+        days=days[order],
+        efficiency=epc["CURRENT_ENERGY_EFFICIENCY"].to_numpy(dtype=float)[order],
+        improvable=improvable.to_numpy()[order],
+    )
+
+
+def _window_bounds(index, la_positions, days):
+    """Row positions at which each (LA, day) boundary falls in the index."""
+    return np.searchsorted(index.keys, la_positions * _KEY_SPAN + days, side="left")
+
+
+def _prefix_sum(values):
+    """Cumulative sum with a leading zero, so that the total over rows
+    [a, b) is prefix[b] - prefix[a].
+    """
+    return np.concatenate([[0], np.cumsum(values)])
+
+
+def monthly_rolling_summary(index, window=12, start=None, end=None):
+    """Computes, for each LA and calendar month, the number of certificates
+    and improvable social housing certificates lodged in that month,
+    and the same counts plus the median energy efficiency over
+    the rolling window of the last `window` months.
+    Months run from start to end (defaults: first and last lodgement dates).
+    Medians are exact - efficiency scores are integers so they are read off
+    per-month histograms that are summed over each rolling window.
+    """
+    start = pd.Timestamp(start or pd.Timestamp(index.days.min(), unit="D"))
+    end = pd.Timestamp(end or pd.Timestamp(index.days.max(), unit="D"))
+    months = pd.date_range(start.to_period("M").start_time, end, freq="MS")
+    edges = (
+        months.append(pd.DatetimeIndex([months[-1] + pd.offsets.MonthBegin()]))
+        .to_numpy()
+        .astype("datetime64[D]")
+        .astype(np.int64)
+    )
+    n_las, n_months = len(index.codes), len(months)
+
+    # Row boundaries of every (LA, month) bin, shape (n_las, n_months + 1)
+    la_positions = np.arange(n_las)[:, None]
+    bounds = _window_bounds(index, la_positions, edges[None, :])
+    improvable_prefix = _prefix_sum(index.improvable)
+    certificates = np.diff(bounds, axis=1)
+    improvable = np.diff(improvable_prefix[bounds], axis=1)
+
+    # Rolling windows cover bins [t - window + 1, t], so their row boundaries
+    # are the month boundaries shifted back by window - 1 months
+    window_starts = bounds[:, np.maximum(np.arange(n_months) - window + 1, 0)]
+    window_ends = bounds[:, 1:]
+    rolling_certificates = window_ends - window_starts
+    rolling_improvable = (
+        improvable_prefix[window_ends] - improvable_prefix[window_starts]
+    )
+
+    # Histogram of efficiency scores per (LA, month), summed over rolling windows
+    in_range = (index.days >= edges[0]) & (index.days < edges[-1])
+    in_range &= ~np.isnan(index.efficiency)
+    scores = np.clip(index.efficiency[in_range], 0, None).astype(np.int64)
+    n_scores = scores.max() + 1 if len(scores) else 1
+    la_of_row = index.keys[in_range] // _KEY_SPAN
+    month_of_row = np.searchsorted(edges, index.days[in_range], side="right") - 1
+    histograms = np.bincount(
+        (la_of_row * n_months + month_of_row) * n_scores + scores,
+        minlength=n_las * n_months * n_scores,
+    ).reshape(n_las, n_months, n_scores)
+    cumulative = np.concatenate(
+        [np.zeros((n_las, 1, n_scores), dtype=np.int64), histograms.cumsum(axis=1)],
+        axis=1,
+    )
+    window_index = np.maximum(np.arange(n_months) - window + 1, 0)
+    rolling_histograms = cumulative[:, 1:] - cumulative[:, window_index]
+    rolling_medians = _histogram_medians(rolling_histograms)
+
+    return pd.DataFrame(
+        {
+            "code": np.repeat(index.codes.to_numpy(), n_months),
+            "month": np.tile(months.to_numpy(), n_las),
+            "certificates": certificates.ravel(),
+            "improvable": improvable.ravel(),
+            "rolling_certificates": rolling_certificates.ravel(),
+            "rolling_improvable": rolling_improvable.ravel(),
+            "rolling_median_energy_efficiency": rolling_medians.ravel(),
+        }
+    )
+
+
+def _histogram_medians(histograms):
+    """Medians of integer values given as histograms along the last axis.
+    Empty histograms give NaN.
+    """
+    cumulative = histograms.cumsum(axis=-1)
+    totals = cumulative[..., -1]
+    # Value at (0-based) rank r is the first bin whose cumulative count exceeds r
+    lower = np.argmax(cumulative > ((totals - 1) // 2)[..., None], axis=-1)
+    upper = np.argmax(cumulative > (totals // 2)[..., None], axis=-1)
+    return np.where(totals > 0, (lower + upper) / 2, np.nan)
+
+
+def _segment_medians(values, starts, stops):
+    """Medians of values[starts[i]:stops[i]] for every segment i at once.
+    Empty segments give NaN. NaN values are ignored.
+    """
+    lengths = stops - starts
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    gathered = values[starts[segment] + offsets]
+    keep = ~np.isnan(gathered)
+    segment, gathered = segment[keep], gathered[keep]
+    # Sort values within each segment, then pick the middle one(s)
+    if len(gathered) == 0:
+        return np.full(len(starts), np.nan)
+    gathered = gathered[np.lexsort((gathered, segment))]
+    counts = np.bincount(segment, minlength=len(starts))
+    first = np.cumsum(counts) - counts
+    lower = np.minimum(first + (counts - 1) // 2, len(gathered) - 1)
+    upper = np.minimum(first + counts // 2, len(gathered) - 1)
+    return np.where(counts > 0, (gathered[lower] + gathered[upper]) / 2, np.nan)
+
+
+def grant_scheme_columns():
+    """Grant columns in the tidy data making up each scheme, or each round
+    of schemes with rounds (e.g. GHG_1a), named as in grant_award_dates.
+    """
+    schemes = grant_schemes()
+    names = schemes["scheme"] + ("_" + schemes["round"]).fillna("")
+    return {
+        name: list(columns)
+        for name, columns in schemes.groupby(names, sort=False)["column"]
+    }
+
+
+def la_grant_award_dates(tidy_data, award_dates=None):
+    """Finds the date each LA was first awarded a grant, given the announcement
+    date of each scheme (defaults to grant_award_dates in config/base.yaml).
+    LAs that received no grant get the earliest announcement date,
+    so that they can serve as a comparison group. Schemes without an
+    announcement date are left out.
+    Returns a DataFrame with code, award_date and received_grant columns.
+    """
+    award_dates = pd.Series(award_dates or config["grant_award_dates"])
+    scheme_columns = {
+        scheme: columns
+        for scheme, columns in grant_scheme_columns().items()
+        if scheme in award_dates
+    }
+    scheme_dates = pd.to_datetime(award_dates[list(scheme_columns)]).to_numpy()
+    received = np.column_stack(
+        [
+            tidy_data[columns].to_numpy(dtype=float).sum(axis=1) > 0
+            for columns in scheme_columns.values()
+        ]
+    )
+    # Schemes not received are pushed to the latest possible date,
+    # since NaT would propagate through the minimum
+    first_award = np.where(received, scheme_dates, np.datetime64("2262-01-01")).min(
+        axis=1
+    )
+    received_grant = received.any(axis=1)
+    return pd.DataFrame(
+        {
+            "code": tidy_data["code"].to_numpy(),
+            "award_date": np.where(received_grant, first_award, scheme_dates.min()),
+            "received_grant": received_grant,
+        }
+    ).dropna(subset=["code"])
+
+
+def pre_post_grant_comparison(index, award_dates, window_months=12):
+    """Compares certificates lodged in the window_months before and after
+    each LA's award date, for all LAs in one pass over the index.
+    award_dates is a DataFrame with code and award_date columns,
+    as returned by la_grant_award_dates; any other columns are kept.
+    """
+    la_positions = index.codes.get_indexer(award_dates["code"])
+    comparison = award_dates[la_positions >= 0].reset_index(drop=True)
+    la_positions = la_positions[la_positions >= 0].astype(np.int64)
+
+    award = pd.to_datetime(comparison["award_date"])
+    window = pd.DateOffset(months=window_months)
+    boundaries = np.column_stack(
+        [
+            (dates.to_numpy().astype("datetime64[D]")).astype(np.int64)
+            for dates in [award - window, award, award + window]
+        ]
+    )
+    bounds = _window_bounds(index, la_positions[:, None], boundaries)
+    before, after = (bounds[:, 0], bounds[:, 1]), (bounds[:, 1], bounds[:, 2])
+
+    improvable_prefix = _prefix_sum(index.improvable)
+    for period, (starts, stops) in {"before": before, "after": after}.items():
+        comparison[f"certificates_{period}"] = stops - starts
+        comparison[f"improvable_{period}"] = (
+            improvable_prefix[stops] - improvable_prefix[starts]
+        )
+        comparison[f"median_energy_efficiency_{period}"] = _segment_medians(
+            index.efficiency, starts, stops
+        )
+
+    comparison["improvable_change"] = (
+        comparison["improvable_after"] - comparison["improvable_before"]
+    )
+    comparison["median_energy_efficiency_change"] = (
+        comparison["median_energy_efficiency_after"]
+        - comparison["median_energy_efficiency_before"]
+    )
+    return comparison
+
+
+def get_epc_monthly_summary(window=12):
+    """Gets EPC data and computes monthly and rolling summaries for each LA."""
+    return monthly_rolling_summary(index_epc_by_lodgement(get_epc()), window=window)
+
+
+def get_pre_post_grant_comparison(window_months=12):
+    """Gets EPC data and the tidy LA dataset and compares each LA's
+    certificates before and after it was awarded a grant.
+    """
+    award_dates = la_grant_award_dates(form_all_tidy_data())
+    return pre_post_grant_comparison(
+        index_epc_by_lodgement(get_epc()), award_dates, window_months=window_months
+    )
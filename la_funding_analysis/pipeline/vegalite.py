@@ -0,0 +1,470 @@
+# File: pipeline/vegalite.py
+"""Functions to produce Vega-Lite versions of the charts with Altair.
+Each function mirrors a plotting function in pipeline/plotters.py (with the
+same name plus "_spec") but returns an Altair chart that reads the LA data
+from a URL instead of embedding it. The data is written once to a compact
+shared JSON file that every spec references, and the aggregation
+(subtotals, proportions etc.) is done by Vega-Lite transforms in the client.
+"""
+
+import json
+
+import altair as alt
+
+from la_funding_analysis import logger, PROJECT_DIR
+
+VEGALITE_DIR = PROJECT_DIR / "outputs/figures/vegalite"
+DATA_FILENAME = "la_data.json"
+
+# Columns of the tidy dataset that the specs use
+SPEC_COLUMNS = [
+    "code",
+    "region_1",
+    "region_3",
+    "model",
+    "majority",
+    "old_majority",
+    "fp_proportion",
+    "imd_concentration",
+    "median_energy_efficiency",
+    "total_improvable",
+    "prop_improvable",
+    "high_improvable_no_SHDDF",
+    "SHDDF",
+    "total_grants",
+    "1a_no_members",
+    "1b_no_members",
+    "all_no_members",
+]
+
+# Vega expression for the x-axis jitter in the strip plots - normally
+# distributed as in utils/jitter_functions.py (Box-Muller transform)
+_JITTER = "sqrt(-2 * log(random())) * cos(2 * PI * random()) * {deviation}"
+
+
+def write_shared_data(la_data, directory=VEGALITE_DIR, decimals=4):
+    """Writes the columns of the tidy dataset used by the specs to a compact
+    JSON file in directory, and returns its path.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / DATA_FILENAME
+    la_data[SPEC_COLUMNS].to_json(path, orient="records", double_precision=decimals)
+    return path
+
+
+def _title(graph_title):
+    """Vega-Lite titles take a list of lines rather than newlines."""
+    return alt.TitleParams(graph_title.split("\n"))
+
+
+def _data():
+    return alt.UrlData(url=DATA_FILENAME)
+
+
+# STACKED HORIZONTAL BAR PLOTS
+
+
+def stacked_no_members_by_grant_type_spec(factor, graph_ylabel, graph_title):
+    """Stacked bar chart of grants awarded to individual LAs and
+    consortium leads (no members) split by factor.
+    """
+    return (
+        alt.Chart(_data(), title=_title(graph_title))
+        .transform_fold(
+            ["1a_no_members", "1b_no_members", "SHDDF"], as_=["scheme", "grants"]
+        )
+        .transform_calculate(
+            scheme="{'1a_no_members': 'GHG LAD 1a', "
+            "'1b_no_members': 'GHG LAD 1b', 'SHDDF': 'SHDDF'}[datum.scheme]"
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X("sum(grants):Q", title="Number of grants"),
+            y=alt.Y(
+                f"{factor}:N",
+                title=graph_ylabel,
+                sort=alt.EncodingSortField("grants", op="sum", order="descending"),
+            ),
+            color=alt.Color("scheme:N", title=None),
+        )
+    )
+
+
+# PROPORTION HORIZONTAL BAR PLOTS
+
+
+def proportion_by_number_of_grants_spec(factor, graph_ylabel, graph_title):
+    """Bar chart in which bars are scaled to the number of LAs in the chosen
+    factor, coloured according to the number of LAs receiving each number
+    of grants.
+    """
+    return (
+        alt.Chart(_data(), title=_title(graph_title))
+        .transform_filter(f"isValid(datum['{factor}'])")
+        # As in grant_count_proportions, only rows with an LA code are
+        # counted in the labels
+        .transform_calculate(
+            no_grant="datum.total_grants == 0 ? 1 : 0",
+            is_la="isValid(datum.code) ? 1 : 0",
+        )
+        .transform_joinaggregate(
+            rows="count()",
+            la_count="sum(is_la)",
+            no_grants="sum(no_grant)",
+            groupby=[factor],
+        )
+        .transform_calculate(
+            label=f"datum['{factor}'] + ' (' + datum.la_count + ')'",
+            no_grant_share="datum.no_grants / datum.rows",
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X(
+                "count():Q",
+                stack="normalize",
+                title="Percentage of local authorities",
+                axis=alt.Axis(format="%"),
+            ),
+            y=alt.Y(
+                "label:N",
+                title=graph_ylabel,
+                sort=alt.EncodingSortField(
+                    "no_grant_share", op="max", order="ascending"
+                ),
+            ),
+            color=alt.Color(
+                "total_grants:O",
+                title="Number of grants",
+                scale=alt.Scale(scheme="viridis", reverse=True),
+            ),
+            order=alt.Order("total_grants:O", sort="descending"),
+        )
+    )
+
+
+# DUAL BAR CHART
+
+
+def dual_bar_by_applicant_type_spec(factor, graph_ylabel, graph_title):
+    """Percentages of LAs in each factor that received a grant, and that
+    were an individual / consortium lead.
+    """
+    return (
+        alt.Chart(_data(), title=_title(graph_title))
+        .transform_calculate(
+            grant="datum.total_grants >= 1 ? 1 : 0",
+            ind_lead="datum.all_no_members >= 1 ? 1 : 0",
+        )
+        .transform_aggregate(
+            grant="mean(grant)", ind_lead="mean(ind_lead)", groupby=[factor]
+        )
+        .transform_fold(["grant", "ind_lead"], as_=["type", "share"])
+        .transform_calculate(
+            type="datum.type == 'grant' ? "
+            "'Individuals, leads and consortium members' : "
+            "'Individuals and consortium leads only'"
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X(
+                "share:Q",
+                title="Percentage of local authorities",
+                scale=alt.Scale(domain=[0, 1]),
+                axis=alt.Axis(format="%"),
+            ),
+            y=alt.Y(f"{factor}:N", title=graph_ylabel),
+            yOffset="type:N",
+            color=alt.Color("type:N", title=None, legend=alt.Legend(orient="bottom")),
+        )
+    )
+
+
+# FACETED PLOTS
+
+
+def _panel_label(graph_ylabel):
+    return " ".join(graph_ylabel.split("\n"))
+
+
+def _faceted_data(factors, graph_ylabels):
+    """Chart of the data with the factor columns folded into (facet, level)
+    rows, each labelled with its facet's y-axis label ("panel").
+    """
+    labels = json.dumps(
+        {factor: _panel_label(label) for factor, label in zip(factors, graph_ylabels)}
+    )
+    return (
+        alt.Chart(_data())
+        .transform_fold(list(factors), as_=["facet", "level"])
+        .transform_filter("isValid(datum.level)")
+        .transform_calculate(panel=f"{labels}[datum.facet]")
+    )
+
+
+def _facet_rows(chart, graph_ylabels, graph_title):
+    """Lays out a chart of _faceted_data as one row per facet,
+    each with its own y axis.
+    """
+    return chart.facet(
+        row=alt.Row(
+            "panel:N",
+            title=None,
+            sort=[_panel_label(label) for label in graph_ylabels],
+        ),
+        title=_title(graph_title),
+    ).resolve_scale(y="independent")
+
+
+def faceted_stacked_no_members_by_grant_type_spec(factors, graph_ylabels, graph_title):
+    """stacked_no_members_by_grant_type_spec for each of factors as rows
+    of one chart.
+    """
+    chart = (
+        _faceted_data(factors, graph_ylabels)
+        .transform_fold(
+            ["1a_no_members", "1b_no_members", "SHDDF"], as_=["scheme", "grants"]
+        )
+        .transform_calculate(
+            scheme="{'1a_no_members': 'GHG LAD 1a', "
+            "'1b_no_members': 'GHG LAD 1b', 'SHDDF': 'SHDDF'}[datum.scheme]"
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X("sum(grants):Q", title="Number of grants"),
+            y=alt.Y(
+                "level:N",
+                title=None,
+                sort=alt.EncodingSortField("grants", op="sum", order="descending"),
+            ),
+            color=alt.Color("scheme:N", title=None),
+        )
+    )
+    return _facet_rows(chart, graph_ylabels, graph_title)
+
+
+def faceted_proportion_by_number_of_grants_spec(factors, graph_ylabels, graph_title):
+    """proportion_by_number_of_grants_spec for each of factors as rows
+    of one chart.
+    """
+    chart = (
+        _faceted_data(factors, graph_ylabels)
+        .transform_calculate(no_grant="datum.total_grants == 0 ? 1 : 0")
+        .transform_joinaggregate(la_count="count()", groupby=["facet", "level"])
+        .transform_joinaggregate(no_grants="sum(no_grant)", groupby=["facet", "level"])
+        .transform_calculate(
+            label="datum.level + ' (' + datum.la_count + ')'",
+            no_grant_share="datum.no_grants / datum.la_count",
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X(
+                "count():Q",
+                stack="normalize",
+                title="Percentage of local authorities",
+                axis=alt.Axis(format="%"),
+            ),
+            y=alt.Y(
+                "label:N",
+                title=None,
+                sort=alt.EncodingSortField(
+                    "no_grant_share", op="max", order="ascending"
+                ),
+            ),
+            color=alt.Color(
+                "total_grants:O",
+                title="Number of grants",
+                scale=alt.Scale(scheme="viridis", reverse=True),
+            ),
+            order=alt.Order("total_grants:O", sort="descending"),
+        )
+    )
+    return _facet_rows(chart, graph_ylabels, graph_title)
+
+
+# BOXPLOT
+
+
+def boxplot_by_receipt_status_spec(factor, graph_ylabel, graph_title):
+    """Boxplot of LA factor according to whether or not they
+    received at least one grant of any type.
+    """
+    return (
+        alt.Chart(_data(), title=_title(graph_title))
+        .transform_calculate(received="datum.total_grants >= 1 ? 'Yes' : 'No'")
+        .mark_boxplot()
+        .encode(
+            x=alt.X("received:N", title="Received at least one grant"),
+            y=alt.Y(f"{factor}:Q", title=graph_ylabel, scale=alt.Scale(zero=False)),
+        )
+    )
+
+
+# STRIP PLOTS
+
+
+def _strip_plot(graph_title, x, y, ymin, ymax, graph_ylabel, colour, deviation=0.05):
+    """Scatter plot with a discrete x axis and normal jitter along it.
+    colour is an Altair colour encoding (or value).
+    """
+    return (
+        alt.Chart(_data(), title=_title(graph_title))
+        .transform_filter(f"isValid(datum['{y}'])")
+        .transform_calculate(
+            jittered=f"datum['{x}'] + " + _JITTER.format(deviation=deviation)
+        )
+        .mark_circle(size=20)
+        .encode(
+            x=alt.X(
+                "jittered:Q",
+                title="Number of grants",
+                scale=alt.Scale(domain=[-0.5, 4.5]),
+            ),
+            y=alt.Y(f"{y}:Q", title=graph_ylabel, scale=alt.Scale(domain=[ymin, ymax])),
+            color=colour,
+            tooltip=["region_3:N", f"{x}:Q", f"{y}:Q"],
+        )
+    )
+
+
+def imd_strip_plot_spec():
+    """Strip plot of LA IMD local concentration against number of grants."""
+    return _strip_plot(
+        "IMD local concentration of local authorities\nvs number of grants obtained",
+        x="total_grants",
+        y="imd_concentration",
+        ymin=10000,
+        ymax=35000,
+        graph_ylabel="IMD local concentration",
+        colour=alt.value("blue"),
+    ).mark_circle(size=20, opacity=0.25)
+
+
+def fp_clusters_strip_plot_spec(
+    top_left_grants=0, top_left_min_fp=20, middle_right_grants=3, middle_right_max_fp=15
+):
+    """Strip plot of LA fuel poverty against number of grants, with the
+    'top left' and 'middle right' clusters highlighted.
+    """
+    return (
+        _strip_plot(
+            "Fuel poverty rate of local authorities\nvs number of grants obtained",
+            x="total_grants",
+            y="fp_proportion",
+            ymin=0,
+            ymax=25,
+            graph_ylabel="Fuel poor households (%)",
+            colour=alt.Color(
+                "cluster:N",
+                scale=alt.Scale(
+                    domain=["Top left", "Middle right", "Other"],
+                    range=["red", "green", "blue"],
+                ),
+                title=None,
+            ),
+        )
+        .transform_calculate(
+            cluster=f"datum.total_grants == {top_left_grants} "
+            f"&& datum.fp_proportion > {top_left_min_fp} ? 'Top left' "
+            f": datum.total_grants == {middle_right_grants} "
+            f"&& datum.fp_proportion < {middle_right_max_fp} ? 'Middle right' "
+            ": 'Other'"
+        )
+        .mark_circle(size=20, opacity=0.4)
+    )
+
+
+def westmids_london_fp_strip_plot_spec():
+    """Strip plot of LA fuel poverty against number of grants, coloured
+    by region - West Midlands, London or other.
+    """
+    return (
+        _strip_plot(
+            "Fuel poverty rate of local authorities\nvs number of grants obtained",
+            x="total_grants",
+            y="fp_proportion",
+            ymin=0,
+            ymax=25,
+            graph_ylabel="Fuel poor households (%)",
+            colour=alt.Color(
+                "region:N",
+                scale=alt.Scale(
+                    domain=["West Midlands", "London", "Other"],
+                    range=["red", "blue", "grey"],
+                ),
+                title="Region",
+            ),
+        )
+        .transform_calculate(
+            region="indexof(['West Midlands', 'London'], datum.region_1) >= 0 "
+            "? datum.region_1 : 'Other'"
+        )
+        .mark_circle(size=20, opacity=0.35)
+    )
+
+
+def improvable_strip_plot_spec(factor):
+    """Strip plot of counts/proportions of 'improvable' EPCs against whether
+    or not the LA received SHDDF, highlighting LAs with many improvable
+    homes but no SHDDF.
+    """
+    if factor == "total_improvable":
+        ymin, ymax = 0, 40000
+        graph_ylabel = "Number of EPCs for improvable socially rented dwellings"
+        graph_title = "Number of EPCs for improvable socially rented dwellings\nvs whether or not the local authority received a SHDDF grant"
+    if factor == "prop_improvable":
+        ymin, ymax = 0, 0.7
+        graph_ylabel = "Percentage of registered EPCs for\nsocially rented dwellings that are improvable"
+        graph_title = "Percentage of registered EPCs for socially rented dwellings\nthat are improvable vs whether or not\nthe local authority received a SHDDF grant"
+    chart = _strip_plot(
+        graph_title,
+        x="SHDDF",
+        y=factor,
+        ymin=ymin,
+        ymax=ymax,
+        graph_ylabel=graph_ylabel.split("\n"),
+        colour=alt.condition(
+            "datum.high_improvable_no_SHDDF", alt.value("red"), alt.value("blue")
+        ),
+        deviation=0.01,
+    )
+    # Styled as in improvable_strip_plot: highlighted LAs are drawn on top,
+    # more opaque and without jitter
+    return (
+        chart.transform_calculate(
+            highlighted="datum.high_improvable_no_SHDDF ? 1 : 0",
+            x_position="datum.high_improvable_no_SHDDF ? datum.SHDDF : datum.jittered",
+        )
+        .mark_circle(size=20)
+        .encode(
+            x=alt.X(
+                "x_position:Q",
+                title="Received SHDDF",
+                scale=alt.Scale(domain=[-0.4, 1.4]),
+                axis=alt.Axis(values=[0, 1], labelExpr="datum.value ? 'Yes' : 'No'"),
+            ),
+            opacity=alt.condition(
+                "datum.high_improvable_no_SHDDF", alt.value(0.5), alt.value(0.1)
+            ),
+            order=alt.Order("highlighted:Q"),
+        )
+    )
+
+
+def produce_vegalite_specs(la_data, chart_jobs, directory=VEGALITE_DIR):
+    """Writes the shared data file and one Vega-Lite spec (<filename>.vl.json)
+    per chart job to directory. chart_jobs is a list of (plotting function
+    name, keyword arguments, filename, formats) tuples, as in generate_plots.
+    Charts with no Vega-Lite version (e.g. maps) are skipped.
+    Returns the paths of the files written.
+    """
+    paths = [write_shared_data(la_data, directory)]
+    for plotter, kwargs, filename, _ in chart_jobs:
+        if plotter + "_spec" not in globals():
+            logger.warning(f"No Vega-Lite version of {filename} ({plotter})")
+            continue
+        chart = globals()[plotter + "_spec"](**kwargs)
+        path = directory / f"{filename}.vl.json"
+        with open(path, "w") as f:
+            f.write(chart.to_json(indent=None))
+        paths.append(path)
+    return paths
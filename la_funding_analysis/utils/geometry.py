@@ -0,0 +1,88 @@
+# File: utils/geometry.py
+"""Functions for simplifying polygon boundaries with numpy, so that maps
+can be drawn without a GIS library.
+Coordinates are expected to be projected (e.g. British National Grid,
+in metres), so that tolerances are distances.
+"""
+
+import numpy as np
+
+
+def simplify_line(points, tolerance):
+    """Simplifies a line (an (n, 2) array) with the Douglas-Peucker
+    algorithm, keeping the endpoints and every point further than
+    tolerance from the simplified line. Returns the kept points.
+    For a closed ring (first point equal to the last), the ring is split
+    at the point furthest from the start so that it can't collapse.
+    Every segment still being split is processed at once in each round,
+    so the number of rounds grows with the depth of the splitting rather
+    than the number of points kept.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    if np.array_equal(points[0], points[-1]):
+        furthest = np.argmax(((points - points[0]) ** 2).sum(axis=1))
+        keep[furthest] = True
+        starts, ends = np.array([0, furthest]), np.array([furthest, len(points) - 1])
+    else:
+        starts, ends = np.array([0]), np.array([len(points) - 1])
+    while True:
+        interior = ends - starts - 1
+        starts, ends, interior = (
+            starts[interior > 0],
+            ends[interior > 0],
+            interior[interior > 0],
+        )
+        if not len(starts):
+            return points[keep]
+        # Index of every interior point, and of its segment
+        segment = np.repeat(np.arange(len(starts)), interior)
+        offsets = np.arange(len(segment)) - np.repeat(
+            np.cumsum(interior) - interior, interior
+        )
+        indices = starts[segment] + 1 + offsets
+        distances = _segment_distances(
+            points[indices], points[starts[segment]], points[ends[segment]]
+        )
+        # Furthest point of each segment
+        order = np.lexsort((-distances, segment))
+        firsts = order[np.cumsum(interior) - interior]
+        split = distances[firsts] > tolerance
+        furthest = indices[firsts[split]]
+        keep[furthest] = True
+        starts, ends = (
+            np.concatenate([starts[split], furthest]),
+            np.concatenate([furthest, ends[split]]),
+        )
+
+
+def _segment_distances(points, starts, ends):
+    """Distances from each of points to the line segment between the
+    corresponding start and end points.
+    """
+    segments = ends - starts
+    length_sq = (segments**2).sum(axis=1)
+    t = (((points - starts) * segments).sum(axis=1)) / np.where(length_sq, length_sq, 1)
+    projections = starts + np.clip(t, 0, 1)[:, None] * segments
+    return np.sqrt(((points - projections) ** 2).sum(axis=1))
+
+
+def signed_ring_area(ring):
+    """Area of a closed ring (shoelace formula), positive if the ring
+    runs anticlockwise and negative if clockwise.
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    return (np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+
+def orient_ring(ring, anticlockwise=True):
+    """The ring, reversed if needed so that it runs in the given direction.
+    Exterior rings should run anticlockwise and holes clockwise for them
+    to be filled correctly with the nonzero winding rule.
+    """
+    if (signed_ring_area(ring) > 0) != anticlockwise:
+        return ring[::-1]
+    return ring
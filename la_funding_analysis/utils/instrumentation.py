@@ -0,0 +1,219 @@
+# File: utils/instrumentation.py
+"""Instrumentation of the pipeline's stages (getters, cleaning, joining and
+plotting functions). Each instrumented call is logged with its wall time,
+CPU time and the number of rows going in and out.
+Inside a run_report, calls are also recorded with their peak memory
+(traced with tracemalloc) and written to a JSON run report, and a single
+stage can be profiled with cProfile.
+Records are only kept for calls in the process that started the report,
+so charts rendered in worker processes are left out (render with one
+process to include them).
+"""
+
+import cProfile
+import functools
+import inspect
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from la_funding_analysis import PROJECT_DIR
+
+REPORTS_DIR = PROJECT_DIR / "outputs/reports"
+
+# The current run report, if any: its records, the stage to profile,
+# and the stack of instrumented calls in progress
+_run = None
+
+
+def stage_name(function):
+    """Name of an instrumented function, e.g. "cleaning.get_clean_epc"."""
+    return f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+
+def _rows(value):
+    """Number of rows in a DataFrame, Series or array, otherwise None."""
+    shape = getattr(value, "shape", None)
+    return shape[0] if shape else None
+
+
+def _input_rows(args, kwargs):
+    """Total rows in the tabular arguments of a call, or None if it has none."""
+    rows = [_rows(value) for value in list(args) + list(kwargs.values())]
+    rows = [n for n in rows if n is not None]
+    return sum(rows) if rows else None
+
+
+class _Call:
+    """Measurements of an instrumented call in progress."""
+
+    def __init__(self, name, rows_in):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.profiler = None
+        self.depth = len(_run["stack"]) if _run else 0
+        self.parent = _run["stack"][-1].name if _run and _run["stack"] else None
+        self.started = datetime.now().isoformat(timespec="milliseconds")
+        if _run and _run["trace_memory"]:
+            # The peak is reset for each call, so the peak reached by the
+            # calling stage so far is kept to restore its own peak later
+            self.memory_start, peak = tracemalloc.get_traced_memory()
+            if _run["stack"]:
+                caller = _run["stack"][-1]
+                caller.peak = max(caller.peak, peak)
+            self.peak = self.memory_start
+            tracemalloc.reset_peak()
+        if _run and _run["profile"] == name:
+            self.profiler = cProfile.Profile()
+            # Only the first call is profiled
+            _run["profile"] = None
+        if _run:
+            _run["stack"].append(self)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        if self.profiler:
+            self.profiler.enable()
+
+    def finish(self):
+        """Logs the call and adds its record to the run report, if any."""
+        if self.profiler:
+            self.profiler.disable()
+        wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = time.process_time() - self.cpu_start
+        record = {
+            "stage": self.name,
+            "parent": self.parent,
+            "depth": self.depth,
+            "started": self.started,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+        }
+        if _run:
+            _run["stack"].pop()
+            if _run["trace_memory"]:
+                peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+                record["peak_mb"] = (peak - self.memory_start) / 1e6
+                if _run["stack"]:
+                    caller = _run["stack"][-1]
+                    caller.peak = max(caller.peak, peak)
+            if self.profiler:
+                REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+                path = REPORTS_DIR / f"{self.name}.prof"
+                self.profiler.dump_stats(path)
+                record["profile"] = str(path)
+            _run["records"].append(record)
+        _log(record)
+
+
+def _log(record):
+    from la_funding_analysis import logger
+
+    memory = f", {record['peak_mb']:.1f} MB peak" if "peak_mb" in record else ""
+    rows = f"{record['rows_in'] if record['rows_in'] is not None else '-'} -> "
+    rows += f"{record['rows_out'] if record['rows_out'] is not None else '-'} rows"
+    logger.info(
+        f"{record['stage']}: {record['wall_seconds']:.2f}s wall, "
+        f"{record['cpu_seconds']:.2f}s CPU{memory}, {rows}"
+    )
+
+
+def instrumented(function):
+    """Decorator instrumenting a pipeline stage: each call is logged
+    (and recorded in the run report, if one is being made) with its
+    wall and CPU time and rows in and out.
+    For generator functions (e.g. get_epc_chunks), the whole iteration
+    is measured and the rows out are summed over the items.
+    """
+    name = stage_name(function)
+
+    if inspect.isgeneratorfunction(function):
+
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            call = _Call(name, _input_rows(args, kwargs))
+            try:
+                for item in function(*args, **kwargs):
+                    call.rows_out = (call.rows_out or 0) + (_rows(item) or 0)
+                    yield item
+            finally:
+                call.finish()
+
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        call = _Call(name, _input_rows(args, kwargs))
+        try:
+            result = function(*args, **kwargs)
+            call.rows_out = _rows(result)
+            return result
+        finally:
+            call.finish()
+
+    return wrapper
+
+
+@contextmanager
+def run_report(path=None, trace_memory=True, profile=None):
+    """Records every instrumented call made inside the with block and
+    writes them as a JSON run report to path (by default a timestamped
+    file in outputs/reports). If trace_memory is True, each call's peak
+    memory is traced with tracemalloc, which slows the stages down.
+    profile optionally names a stage (e.g. "cleaning.get_clean_epc" or
+    just "get_clean_epc") whose first call is profiled with cProfile,
+    with the stats dumped to outputs/reports/<stage>.prof.
+    Yields the list of records, which is filled in as stages run.
+    """
+    global _run
+    if _run is not None:
+        raise RuntimeError("A run report is already being made")
+    started = datetime.now()
+    if profile:
+        profile = find_stage(profile)
+    _run = {
+        "records": [],
+        "stack": [],
+        "trace_memory": trace_memory,
+        "profile": profile,
+    }
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield _run["records"]
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        records, _run = _run["records"], None
+        report = {
+            "started": started.isoformat(timespec="seconds"),
+            "wall_seconds": (datetime.now() - started).total_seconds(),
+            "trace_memory": trace_memory,
+            "stages": records,
+        }
+        path = Path(path or REPORTS_DIR / f"run_{started:%Y%m%d_%H%M%S}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def find_stage(name):
+    """Full name of an instrumented stage given its function name alone
+    (or its full name).
+    """
+    if "." in name:
+        return name
+    from la_funding_analysis.pipeline import cleaning, joining, plotters
+    from la_funding_analysis.getters import local_authority_data
+
+    for module in [local_authority_data, cleaning, joining, plotters]:
+        function = getattr(module, name, None)
+        if function is not None and hasattr(function, "__wrapped__"):
+            return stage_name(function)
+    raise ValueError(f"No instrumented stage called {name}")
@@ -1,17 +1,85 @@
 # File: utils/jitter_functions.py
 """Functions to enable the creation of jitter plots with the jitter in a single direction.
+Jitter is drawn from a numpy random Generator, seeded with JITTER_SEED
+unless one is passed in, so that figures are reproducible.
 """
 
 import numpy as np
+import pandas as pd
+from matplotlib.colors import to_rgba_array
+from matplotlib.lines import Line2D
 
+JITTER_SEED = 0
 
-def rand_jitter(list, deviation):
-    """Function to add small variation to values in a list."""
-    return list + np.random.randn(len(list)) * deviation
 
+def rand_jitter(values, deviation, rng=None):
+    """Function to add small variation to values in an array.
+    deviation can be a single number or one per value.
+    """
+    if rng is None:
+        rng = np.random.default_rng(JITTER_SEED)
+    values = np.asarray(values, dtype=float)
+    return values + rng.standard_normal(len(values)) * deviation
 
-def jitter(axes, x, y, s=20, c="b", alpha=None, zorder=5, deviation=0.05, **kwargs):
+
+def jitter(
+    axes, x, y, s=20, c="b", alpha=None, zorder=5, deviation=0.05, rng=None, **kwargs
+):
     """Function to make a jitter plot, with jitter only in the x direction."""
     return axes.scatter(
-        rand_jitter(x, deviation), y, s=s, c=c, alpha=alpha, zorder=zorder, **kwargs
+        rand_jitter(x, deviation, rng),
+        y,
+        s=s,
+        c=c,
+        alpha=alpha,
+        zorder=zorder,
+        **kwargs,
     )
+
+
+def jitter_groups(axes, x, y, groups, styles, s=20, rng=None, **kwargs):
+    """Function to make a jitter plot of points in several groups, each with
+    its own style, as a single scatter collection.
+    groups gives each point's group and styles maps every group to a dict
+    with "c" (colour), "alpha", "zorder" and optionally "deviation"
+    (default 0.05). Colours and alphas are set per point, and points are
+    drawn in order of their group's zorder so that higher groups are on top.
+    """
+    codes = pd.Categorical(groups, categories=list(styles)).codes
+    if (codes == -1).any():
+        raise ValueError("Every group must have a style")
+    style_list = list(styles.values())
+    colours = to_rgba_array([style["c"] for style in style_list])
+    colours[:, 3] = [style.get("alpha", 1) for style in style_list]
+    zorders = np.array([style.get("zorder", 5) for style in style_list])
+    deviations = np.array([style.get("deviation", 0.05) for style in style_list])
+    #
+    order = np.argsort(zorders[codes], kind="stable")
+    codes = codes[order]
+    x_jittered = rand_jitter(np.asarray(x)[order], deviations[codes], rng)
+    return axes.scatter(
+        x_jittered,
+        np.asarray(y)[order],
+        s=s,
+        c=colours[codes],
+        zorder=zorders.max(),
+        **kwargs,
+    )
+
+
+def group_legend_handles(styles, s=20):
+    """Legend handles matching the groups of a jitter_groups plot."""
+    return [
+        Line2D(
+            [],
+            [],
+            linestyle="",
+            marker="o",
+            markersize=np.sqrt(s),
+            markerfacecolor=style["c"],
+            markeredgecolor=style["c"],
+            alpha=style.get("alpha"),
+            label=group,
+        )
+        for group, style in styles.items()
+    ]
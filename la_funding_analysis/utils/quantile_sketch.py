@@ -0,0 +1,108 @@
+"""Mergeable quantile sketches for summarising continuous EPC fields
+in bounded memory.
+
+The sketch follows the KLL construction: values are held in a stack of
+"compactor" levels, where an item in level h stands for 2**h original values.
+When a level grows past its capacity it is sorted and every other item
+(starting from a random offset) is promoted to the level above.
+Capacities shrink geometrically towards the bottom of the stack,
+so memory stays close to k items no matter how many values are added.
+Sketches built on different chunks or shards can be merged and queried
+for any quantile afterwards.
+"""
+
+import numpy as np
+
+
+class KLLSketch:
+    """Quantile sketch with mergeable state and bounded memory.
+    Larger k gives more accurate quantiles (rank error roughly 1.7 / k)
+    at the cost of storing more items.
+    """
+
+    # Ratio between the capacities of consecutive levels
+    _capacity_ratio = 2 / 3
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        """Number of items a level can hold before it is compacted."""
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * self._capacity_ratio**depth)))
+
+    def _compress(self):
+        """Compacts levels until the sketch fits within its capacity."""
+        while sum(len(items) for items in self.levels) > sum(
+            self._capacity(level) for level in range(len(self.levels))
+        ):
+            for level, items in enumerate(self.levels):
+                if len(items) >= self._capacity(level):
+                    break
+            items = np.sort(items)
+            # With an odd number of items the largest stays at this level
+            leftover = items[len(items) - len(items) % 2 :]
+            promoted = items[self._rng.integers(2) : len(items) - len(leftover) : 2]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = leftover
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def update(self, values):
+        """Adds an array of values to the sketch. Non-finite values are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Merges another sketch into this one, e.g. a sketch built on
+        a different chunk or shard of the same data.
+        """
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Estimates the value at quantile q (a float or array of floats in [0, 1]).
+        Returns NaN for an empty sketch.
+        """
+        q = np.asarray(q, dtype=float)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)[()]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(items, kind="stable")
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+        # Index of the first item whose cumulative weight reaches q
+        positions = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        estimates = items[np.clip(positions, 0, len(items) - 1)]
+        # The extremes are tracked exactly
+        estimates = np.where(q <= 0, self.min, estimates)
+        estimates = np.where(q >= 1, self.max, estimates)
+        return estimates[()]
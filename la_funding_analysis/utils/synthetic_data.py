@@ -0,0 +1,134 @@
+# File: utils/synthetic_data.py
+"""Functions to generate synthetic versions of the project's datasets,
+so that the pipeline and plotting code can be exercised and benchmarked
+without access to the real inputs.
+Values are random but have the same columns, types and rough ranges
+as the real data.
+"""
+
+import numpy as np
+import pandas as pd
+
+REGIONS = [
+    "North East",
+    "North West",
+    "Yorkshire and the Humber",
+    "East Midlands",
+    "West Midlands",
+    "East",
+    "London",
+    "South East",
+    "South West",
+]
+MODELS = ["Unitary", "County", "District", "Metropolitan borough", "London borough"]
+PARTIES = ["CON", "LAB", "LD", "NOC", "GRN", "IND"]
+# Most grants received by any synthetic LA, as in the grant count charts
+MAX_GRANTS = 4
+
+
+def make_tidy_data(n_las=339, seed=0, dtypes=True):
+    """Makes a synthetic version of the tidy LA dataset
+    returned by form_all_tidy_data, with n_las rows.
+    If dtypes is False, columns keep the dtypes NumPy gives them rather
+    than those of the tidy dataset.
+    """
+    from la_funding_analysis.pipeline.cleaning import grant_schemes
+    from la_funding_analysis.pipeline.joining import grant_totals
+
+    rng = np.random.default_rng(seed)
+    la_names = [f"Authority {i}" for i in range(n_las)]
+    # The improvable strip plot labels the first three LAs with many improvable
+    # homes but no SHDDF, the first of which is County Durham
+    la_names[0] = "County Durham"
+    data = pd.DataFrame(
+        {
+            "code": [f"E{i:08d}" for i in range(n_las)],
+            "region_1": rng.choice(REGIONS, n_las),
+            "region_2": la_names,
+            "region_3": la_names,
+            "total_households": rng.integers(20_000, 250_000, n_las).astype(float),
+            "fp_proportion": rng.uniform(5, 24, n_las),
+            "clean_name": la_names,
+            "model": rng.choice(MODELS, n_las),
+            "majority": rng.choice(PARTIES, n_las),
+            "old_majority": rng.choice(PARTIES, n_las),
+            "imd_concentration": rng.uniform(10_000, 35_000, n_las),
+        }
+    )
+    data["fp_households"] = (
+        data["total_households"] * data["fp_proportion"] / 100
+    ).round()
+    # One grant in each grants column (see grant_schemes) with probability
+    # 0.12, keeping only the first MAX_GRANTS of each LA, totalled as in
+    # the tidy dataset
+    schemes = grant_schemes()
+    received = rng.random((len(schemes), n_las)).T < 0.12
+    received &= received.cumsum(axis=1) <= MAX_GRANTS
+    received[:3, (schemes["column"] == "SHDDF").to_numpy()] = False
+    las, columns = np.nonzero(received)
+    grants = schemes.iloc[columns][["scheme", "round", "role"]].assign(
+        clean_name=np.array(la_names)[las], amount=1
+    )
+    totals = grant_totals(grants)
+    data = data.merge(totals, on="clean_name", how="left")
+    data[totals.columns[1:]] = data[totals.columns[1:]].fillna(0).astype(int)
+    data["median_energy_efficiency"] = rng.integers(55, 72, n_las).astype(float)
+    data["total_improvable"] = rng.integers(0, 20_000, n_las).astype(float)
+    data["prop_improvable"] = rng.uniform(0, 0.7, n_las)
+    data.loc[:2, "total_improvable"] = [35_000, 30_000, 25_000]
+    data["high_improvable_no_SHDDF"] = (data["SHDDF"] == 0) & (
+        data["total_improvable"] > 20_000
+    )
+    if dtypes:
+        from la_funding_analysis.pipeline.joining import apply_tidy_dtypes
+
+        data = apply_tidy_dtypes(data)
+    return data
+
+
+def make_la_boundaries(codes, seed=0, points_per_side=250, cell_size=20_000):
+    """Makes synthetic LA boundaries as a GeoJSON feature collection in
+    the format returned by get_la_boundaries: one jagged square per code,
+    laid out on a grid in British National Grid-like coordinates.
+    Every tenth LA also has a small island just north of it, and every seventh
+    has a hole in it.
+    """
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(len(codes))))
+    # Unit square traced anticlockwise with points_per_side points per side
+    steps = np.linspace(0, 1, points_per_side, endpoint=False)
+    square = np.concatenate(
+        [
+            np.column_stack([steps, np.zeros_like(steps)]),
+            np.column_stack([np.ones_like(steps), steps]),
+            np.column_stack([1 - steps, np.ones_like(steps)]),
+            np.column_stack([np.zeros_like(steps), 1 - steps]),
+        ]
+    )
+    features = []
+    for i, code in enumerate(codes):
+        ring = (square + rng.normal(0, 0.01, square.shape)) * cell_size
+        # Cells are spaced out so that the islands fit between them
+        ring += np.array([100_000, 50_000]) + 1.2 * cell_size * np.array(
+            [i % columns, i // columns]
+        )
+        polygons = [[_closed(ring)]]
+        if i % 7 == 0:
+            hole = ring.mean(axis=0) + (square[::-1] - 0.5) * cell_size * 0.2
+            polygons[0].append(_closed(hole))
+        if i % 10 == 0:
+            island = ring.mean(axis=0) + (square - 0.5) * cell_size * 0.05
+            polygons.append([_closed(island + [0, cell_size * 0.55])])
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"LAD21CD": code},
+                "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _closed(ring):
+    """A ring as a list of coordinates, with the first point repeated last."""
+    return np.vstack([ring, ring[:1]]).round(1).tolist()
@@ -0,0 +1,648 @@
+# File: utils/synthetic_inputs.py
+"""Functions to write synthetic versions of every input file read by
+getters/local_authority_data.py, in the same formats and layouts as the
+real files (sheet names, title and footer rows, column positions and
+header spellings), so that the whole pipeline can be run and benchmarked
+without the real inputs.
+Set the LA_FUNDING_INPUT_DIR environment variable to the directory the
+files were written to for the getters to read them.
+LA names are spelled differently in each file, in the ways clean_names
+has to handle (e.g. "Babergh DC", "Kings Lynn & West Norfolk").
+The size of the EPC file is set by a scale factor, and the file is written
+in chunks, so that tens of millions of rows can be written without holding
+them all in memory.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from la_funding_analysis.utils.synthetic_data import PARTIES, make_la_boundaries
+
+# The LA structure of each region: the number of unitary authorities,
+# the number of districts in each county, and the number of boroughs in
+# each metropolitan county (or Inner/Outer London).
+# This gives 339 LAs, as in the real fuel poverty data.
+REGION_LAYOUTS = {
+    "North East": (7, {}, {"Tyne and Wear (Met County)": 5}),
+    "North West": (
+        6,
+        {"Cumbria": 6, "Lancashire": 12},
+        {"Greater Manchester (Met County)": 10, "Merseyside (Met County)": 5},
+    ),
+    "Yorkshire and the Humber": (
+        5,
+        {"North Yorkshire": 7},
+        {"South Yorkshire (Met County)": 4, "West Yorkshire (Met County)": 5},
+    ),
+    "East Midlands": (
+        4,
+        {
+            "Derbyshire": 8,
+            "Leicestershire": 7,
+            "Lincolnshire": 7,
+            "Northamptonshire": 7,
+            "Nottinghamshire": 7,
+        },
+        {},
+    ),
+    "West Midlands": (
+        4,
+        {"Staffordshire": 8, "Warwickshire": 5, "Worcestershire": 6},
+        {"West Midlands (Met County)": 7},
+    ),
+    "East": (
+        6,
+        {
+            "Cambridgeshire": 5,
+            "Essex": 12,
+            "Hertfordshire": 10,
+            "Norfolk": 7,
+            "Suffolk": 5,
+        },
+        {},
+    ),
+    "London": (0, {}, {"Inner London": 14, "Outer London": 19}),
+    "South East": (
+        12,
+        {
+            "East Sussex": 5,
+            "Hampshire": 11,
+            "Kent": 12,
+            "Oxfordshire": 5,
+            "Surrey": 11,
+            "West Sussex": 7,
+        },
+        {},
+    ),
+    "South West": (
+        12,
+        {"Devon": 8, "Gloucestershire": 6, "Somerset": 5},
+        {},
+    ),
+}
+
+# LAs given their real names (as spelled in the fuel poverty data) because
+# the cleaning and plotting code treats them specially, or because their
+# names are spelled differently in different sources.
+# Other LAs get made-up place names.
+NAMED_LAS = {
+    "North East": ["County Durham"],
+    "Tyne and Wear (Met County)": ["Newcastle upon Tyne"],
+    "North West": ["Blackburn with Darwen"],
+    "Merseyside (Met County)": ["St. Helens"],
+    "Yorkshire and the Humber": ["Kingston upon Hull, City of"],
+    "West Midlands": ["Herefordshire, County of"],
+    "Staffordshire": ["Newcastle-under-Lyme"],
+    "Norfolk": ["King's Lynn and West Norfolk"],
+    "Suffolk": ["Babergh", "Mid Suffolk"],
+    "Inner London": ["Greenwich", "Lewisham", "Kensington and Chelsea"],
+    "Outer London": ["Redbridge", "Richmond upon Thames"],
+    "South East": ["Buckinghamshire"],
+    "Hampshire": ["Basingstoke and Deane"],
+    "Oxfordshire": ["Vale of White Horse"],
+    "South West": ["Bristol, City of"],
+}
+
+# Pieces of the made-up place names. None of the names they make
+# contain the names in NAMED_LAS.
+NAME_STEMS = [
+    "Ash",
+    "Brad",
+    "Carl",
+    "Dun",
+    "Elm",
+    "Fair",
+    "Glen",
+    "Hart",
+    "Ire",
+    "Lang",
+    "Mar",
+    "North",
+    "Oak",
+    "Pen",
+    "Rush",
+    "Sand",
+    "Thorn",
+    "Wal",
+    "West",
+    "Wood",
+    "Bel",
+    "Crow",
+    "Fen",
+    "Hol",
+    "Stan",
+    "Whit",
+]
+NAME_ENDINGS = [
+    "bury",
+    "by",
+    "dale",
+    "field",
+    "ford",
+    "ham",
+    "ley",
+    "mouth",
+    "stead",
+    "ton",
+    "wick",
+    "worth",
+    "combe",
+    "minster",
+]
+
+# Tiers of the LAs that are lower tier (district-level) authorities,
+# which have EPCs, centroids and boundaries
+LOWER_TIERS = ["unitary", "district", "met_borough", "london_borough"]
+
+# Other spellings of parts of LA names, each used for about half of the
+# names containing the part in the files other than the fuel poverty data
+NAME_VARIANTS = {
+    " and ": [" & "],
+    "Mid ": ["Mid-"],
+    " upon ": [" Upon "],
+    " with ": [" With "],
+    "-under-": ["-Under-"],
+    "King's Lynn": ["Kings Lynn", "King’s Lynn"],
+    "St. Helens": ["St Helens"],
+    "Vale of White Horse": ["Vale of Whitehorse"],
+    "Basingstoke and Deane": ["Basingstoke and Dean"],
+}
+
+# Ways of writing the names of councils of each tier
+COUNCIL_NAMES = {
+    "unitary": ["{} Council", "{} City Council", "{} Borough Council", "{}"],
+    "county": ["{} County Council", "{} CC", "{}"],
+    "district": [
+        "{} District Council",
+        "{} Borough Council",
+        "{} City Council",
+        "{} DC",
+        "{}",
+    ],
+    "met_borough": [
+        "{} Metropolitan Borough Council",
+        "{} Metropolitan District Council",
+        "{} Council",
+        "{}",
+    ],
+    "london_borough": [
+        "London Borough of {}",
+        "Royal Borough of {}",
+        "{} Council",
+        "{}",
+    ],
+}
+
+# Number of EPC rows per unit of scale factor
+EPC_ROWS_PER_SCALE = 100_000
+
+# Model codes in the opencouncildata file, by tier
+TIER_MODELS = {
+    "unitary": "U1",
+    "county": "C1",
+    "district": "D3",
+    "met_borough": "M3",
+    "london_borough": "L1",
+}
+
+GRANT_HEADERS = [
+    "Local authority",
+    "GHG LADS 1a",
+    "1a Consortium Leads",
+    "1a Consortium bodies",
+    "GHG LADS 1b",
+    "1b Consortium leads",
+    "1b Consortium bodies",
+    "Social Housing Decarbonisation Fund - Demonstrator ",
+    "Total",
+]
+
+# LAs that appear twice in the grants data, under two spellings
+DUPLICATE_GRANT_NAMES = {
+    "Greenwich": "Royal Borough of Greenwich",
+    "Lewisham": "London Borough of Lewisham",
+    "Redbridge": "London Borough of Redbridge",
+}
+
+TENURES = [
+    "owner-occupied",
+    "Owner-occupied",
+    "rental (private)",
+    "Rented (private)",
+    "rental (social)",
+    "Rented (social)",
+    "NO DATA!",
+]
+TENURE_WEIGHTS = [0.35, 0.25, 0.1, 0.08, 0.08, 0.08, 0.06]
+
+# Lower bounds of the energy efficiency scores for each EPC rating
+RATING_BOUNDS = [(92, "A"), (81, "B"), (69, "C"), (55, "D"), (39, "E"), (21, "F")]
+
+# Date range of the EPC lodgement dates
+FIRST_LODGEMENT = np.datetime64("2008-10-01")
+LAST_LODGEMENT = np.datetime64("2021-12-31")
+
+
+def place_names(n):
+    """The first n made-up place names, in a fixed order."""
+    names = [stem + ending for ending in NAME_ENDINGS for stem in NAME_STEMS]
+    if n > len(names):
+        raise ValueError(f"Can only make {len(names)} place names")
+    return names[:n]
+
+
+def synthetic_las(seed=0):
+    """Makes the areas of the synthetic fuel poverty table (England, the
+    regions, and the LAs in each region) in the order they appear in it.
+    Returns a DataFrame with code, name, tier, region, parent (the county,
+    metropolitan county or Inner/Outer London containing an LA, if any),
+    total_households and fp_households. Households are summed over each
+    region, county and metropolitan county.
+    """
+    areas = [["E92000001", "England", "england", None, None]]
+    counters = {}
+    made_up_names = iter(place_names(len(NAME_STEMS) * len(NAME_ENDINGS)))
+
+    def add(prefix, name, tier, region, parent):
+        counters[prefix] = counters.get(prefix, 0) + 1
+        areas.append([f"{prefix}{counters[prefix]:06d}", name, tier, region, parent])
+
+    def names(group, n):
+        named = NAMED_LAS.get(group, [])
+        return named + [next(made_up_names) for _ in range(n - len(named))]
+
+    for region, (unitaries, counties, met_counties) in REGION_LAYOUTS.items():
+        add("E12", region, "region", region, None)
+        for name in names(region, unitaries):
+            add("E06", name, "unitary", region, None)
+        for county, districts in counties.items():
+            add("E10", county, "county", region, None)
+            for name in names(county, districts):
+                add("E07", name, "district", region, county)
+        for met_county, boroughs in met_counties.items():
+            if region == "London":
+                add("E13", met_county, "inner_outer_london", region, None)
+                tier, prefix = "london_borough", "E09"
+            else:
+                add("E11", met_county, "met_county", region, None)
+                tier, prefix = "met_borough", "E08"
+            for name in names(met_county, boroughs):
+                add(prefix, name, tier, region, met_county)
+    las = pd.DataFrame(areas, columns=["code", "name", "tier", "region", "parent"])
+    #
+    rng = np.random.default_rng(seed)
+    lower = las["tier"].isin(LOWER_TIERS)
+    households = rng.integers(20_000, 250_000, lower.sum())
+    las.loc[lower, "total_households"] = households
+    las.loc[lower, "fp_households"] = np.round(
+        households * rng.uniform(0.05, 0.24, lower.sum())
+    )
+    # Totals for the areas containing LAs
+    for column in ["total_households", "fp_households"]:
+        lower_las = las.loc[lower]
+        totals = pd.concat(
+            [
+                lower_las.groupby("region")[column].sum(),
+                lower_las.groupby("parent")[column].sum(),
+            ]
+        )
+        grouped = las["tier"].isin(
+            ["region", "county", "met_county", "inner_outer_london"]
+        )
+        las.loc[grouped, column] = las.loc[grouped, "name"].map(totals)
+        las.loc[las["tier"] == "england", column] = lower_las[column].sum()
+    return las
+
+
+def spell_name(name, rng, tier=None):
+    """Another spelling of an LA name that clean_names cleans to the same
+    name, with parts of it spelled as in NAME_VARIANTS. If the LA's tier
+    is given, the name is written as a council name, e.g. "Adur District
+    Council", "Bristol City Council" or "London Borough of Lewisham".
+    """
+    for part, variants in NAME_VARIANTS.items():
+        if part in name and rng.random() < 0.5:
+            name = name.replace(part, rng.choice(variants))
+    if tier is not None:
+        # e.g. "Bristol, City of" is Bristol City Council
+        name, _, city_or_county = name.partition(", ")
+        if city_or_county == "City of":
+            return f"{name} City Council"
+        return rng.choice(COUNCIL_NAMES[tier]).format(name)
+    return name
+
+
+def write_synthetic_inputs(directory, scale=1, seed=0, chunksize=500_000):
+    """Writes synthetic versions of all the input files to directory,
+    with scale * EPC_ROWS_PER_SCALE rows in the EPC file, written
+    chunksize rows at a time. Returns the DataFrame of areas from
+    synthetic_las.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    las = synthetic_las(seed)
+    rng = np.random.default_rng(seed)
+    write_fuel_poverty(directory, las)
+    write_parties_models(directory, las, rng)
+    write_old_parties(directory, las, rng)
+    write_imd(directory, las, rng)
+    write_grants(directory, las, rng)
+    write_boundaries(directory, las, seed)
+    write_epc(directory, las, round(scale * EPC_ROWS_PER_SCALE), rng, chunksize)
+    return las
+
+
+def _write_workbook(path, sheets):
+    """Writes an xlsx file with a sheet of rows for each name in sheets."""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+
+
+def write_fuel_poverty(directory, las):
+    """Writes the sub-regional fuel poverty tables. Table 2 has two title
+    rows and seven rows of notes at the bottom. Region names are in the
+    second column, unitaries, counties and metropolitan counties in the
+    third, and the LAs in a county or metropolitan county in the fourth.
+    """
+    name_columns = {
+        "england": 1,
+        "region": 1,
+        "unitary": 2,
+        "county": 2,
+        "met_county": 2,
+        "inner_outer_london": 2,
+        "district": 3,
+        "met_borough": 3,
+        "london_borough": 3,
+    }
+    rows = [
+        ["Table 2: Proportion of households in fuel poverty, 2019"],
+        ["Local Authority"],
+        [
+            "Area Codes",
+            "Area name",
+            None,
+            None,
+            "Number of households1",
+            "Number of households in fuel poverty1",
+            "Proportion of households fuel poor (%)",
+        ],
+    ]
+    for area in las.itertuples():
+        row = [area.code, None, None, None]
+        # Region names are upper case with trailing spaces in the real data
+        row[name_columns[area.tier]] = (
+            area.name.upper() + " " if area.tier == "region" else area.name
+        )
+        rows.append(
+            row
+            + [
+                int(area.total_households),
+                int(area.fp_households),
+                round(100 * area.fp_households / area.total_households, 1),
+            ]
+        )
+    rows += [
+        [],
+        ["Source: Sub-regional fuel poverty statistics, synthetic version"],
+        ["Notes:"],
+        ["1. Number of households and fuel poor households are rounded."],
+        ["2. Areas are local authorities as at April 2019."],
+        ["3. Totals may not sum because of rounding."],
+        ["4. This table is synthetic and is for testing only."],
+    ]
+    _write_workbook(
+        directory / "2021-sub-regional-fuel-poverty-tables.xlsx",
+        {
+            "Contents": [["Sub-regional fuel poverty tables"]],
+            "Table 1": [["Table 1: see Table 2"]],
+            "Table 2": rows,
+        },
+    )
+
+
+def _council_las(las):
+    """The LAs that are councils (lower tier LAs and counties)."""
+    return las.loc[las["tier"].isin(LOWER_TIERS + ["county"])]
+
+
+def write_parties_models(directory, las, rng):
+    """Writes the opencouncildata list of councils, with each council's
+    model in the third column and majority party in the sixth.
+    Buckinghamshire is in the third row and is labelled as a county,
+    as in the real data.
+    """
+    councils = _council_las(las).sort_values("name")
+    buckinghamshire = councils["name"] == "Buckinghamshire"
+    councils = pd.concat(
+        [councils[~buckinghamshire][:2], councils[buckinghamshire]]
+        + [councils[~buckinghamshire][2:]]
+    )
+    models = councils["tier"].map(TIER_MODELS).where(~buckinghamshire, "C1")
+    pd.DataFrame(
+        {
+            "id": np.arange(1, len(councils) + 1),
+            "name": [
+                spell_name(name, rng, tier)
+                for name, tier in zip(councils["name"], councils["tier"])
+            ],
+            "model (C=county, D=district, 1=all-up, 3=thirds, etc.)": models,
+            "seats": rng.integers(30, 90, len(councils)),
+            "region": councils["region"],
+            "majority": rng.choice(PARTIES, len(councils)),
+        }
+    ).to_csv(directory / "opencouncildata_councils.csv", index=False)
+
+
+def write_old_parties(directory, las, rng):
+    """Writes the opencouncildata history of council control, with one row
+    per council and year from 2015 to 2019 and the controlling party
+    in lower case in the eleventh column.
+    """
+    councils = _council_las(las)
+    years = np.arange(2015, 2020)
+    names = [spell_name(name, rng) for name in councils["name"]]
+    n = len(councils) * len(years)
+    seats = rng.integers(5, 30, (n, 5))
+    pd.DataFrame(
+        {
+            "Authority": np.tile(names, len(years)),
+            "Type": np.tile(councils["tier"], len(years)),
+            "Region": np.tile(councils["region"], len(years)),
+            "Year": np.repeat(years, len(councils)),
+            "Total": seats.sum(axis=1),
+            "Con": seats[:, 0],
+            "Lab": seats[:, 1],
+            "LD": seats[:, 2],
+            "Green": seats[:, 3],
+            "Other": seats[:, 4],
+            "Control": [party.lower() for party in rng.choice(PARTIES, n)],
+        }
+    ).to_csv(directory / "history1973-2019.csv", index=False)
+
+
+def write_imd(directory, las, rng):
+    """Writes the IMD summary for each lower tier LA, after seven rows of
+    preamble, with the local concentration in the third column.
+    """
+    lower_las = las.loc[las["tier"].isin(LOWER_TIERS)]
+    with open(directory / "societal-wellbeing_imd2019_indicesbyla.csv", "w") as f:
+        f.write("English Indices of Deprivation 2019\n")
+        f.write("Local authority district summaries (synthetic)\n")
+        f.write("\n" * 4)
+        f.write("Lower ranks are more deprived\n")
+        pd.DataFrame(
+            {
+                "Reference area code": lower_las["code"],
+                "Reference area": [spell_name(name, rng) for name in lower_las["name"]],
+                " Local concentration": rng.uniform(10_000, 35_000, len(lower_las)),
+                " Extent": rng.uniform(0, 0.6, len(lower_las)),
+                " Average score": rng.uniform(5, 45, len(lower_las)),
+            }
+        ).to_csv(f, index=False)
+
+
+def write_grants(directory, las, rng):
+    """Writes the list of LAs receiving decarbonisation grants, with a row
+    of sub-headers under the column names and a notes column after the
+    totals. Greenwich, Lewisham and Redbridge each appear twice, and
+    Babergh and Mid Suffolk share one row, as in the real data.
+    """
+    lower_las = las.loc[las["tier"].isin(LOWER_TIERS)]
+    lower_las = lower_las[
+        ~lower_las["name"].isin(
+            ["Babergh", "Mid Suffolk"] + list(DUPLICATE_GRANT_NAMES)
+        )
+    ]
+    recipients = [
+        spell_name(la.name, rng, la.tier)
+        for la in lower_las[rng.random(len(lower_las)) < 0.4].itertuples()
+    ]
+    # Some names have a non-breaking space in them
+    recipients = [
+        name.replace(" ", "\xa0", 1) if rng.random() < 0.05 else name
+        for name in recipients
+    ]
+    recipients += list(DUPLICATE_GRANT_NAMES) + list(DUPLICATE_GRANT_NAMES.values())
+    recipients += [
+        "Babergh and Mid Suffolk",
+        "Greater London Authority",
+        "Greater Manchester Combined Authority",
+    ]
+    rows = [
+        GRANT_HEADERS + ["Notes"],
+        [None, "Individual", "Lead", "Member", "Individual", "Lead", "Member"],
+    ]
+    for name in sorted(recipients):
+        grants = (rng.random(7) < 0.2).astype(int)
+        # Every LA in the list received at least one grant
+        if not grants.any():
+            grants[rng.integers(7)] = 1
+        # Blank cells stand for no grant
+        row = [name] + [int(grant) or None for grant in grants] + [int(grants.sum())]
+        if name in DUPLICATE_GRANT_NAMES.values():
+            row.append("Second bid")
+        rows.append(row)
+    _write_workbook(
+        directory / "Local_authorities_and_decarbonisation_schemes.xlsx",
+        {"Sheet1": rows},
+    )
+
+
+def write_boundaries(directory, las, seed):
+    """Writes the boundaries (as GeoJSON) and centroids of each
+    lower tier LA.
+    """
+    codes = list(las.loc[las["tier"].isin(LOWER_TIERS), "code"])
+    boundaries = make_la_boundaries(codes, seed=seed)
+    with open(directory / "la_boundaries.geojson", "w") as f:
+        json.dump(boundaries, f)
+    # Centroids are the centres of the LAs' outer rings
+    centres = np.array(
+        [
+            np.mean(feature["geometry"]["coordinates"][0][0][:-1], axis=0)
+            for feature in boundaries["features"]
+        ]
+    )
+    names = las.set_index("code").loc[codes, "name"]
+    pd.DataFrame(
+        {
+            "FID": np.arange(1, len(codes) + 1),
+            "LAD21CD": codes,
+            "LAD21NM": names.to_numpy(),
+            "BNG_E": centres[:, 0].round(),
+            "BNG_N": centres[:, 1].round(),
+        }
+    ).to_csv(directory / "la_centroids.csv", index=False)
+
+
+def epc_chunk(codes, weights, mean_efficiencies, n_rows, rng):
+    """Makes n_rows synthetic EPCs for the LAs with the given codes,
+    which are picked with probabilities proportional to weights.
+    Each LA's energy efficiency scores are centred on its mean efficiency,
+    and ratings are consistent with the scores.
+    """
+    la_positions = rng.choice(len(codes), n_rows, p=weights / weights.sum())
+    efficiency = np.clip(
+        rng.normal(mean_efficiencies[la_positions], 12), 1, 100
+    ).astype(int)
+    potential = np.clip(efficiency + rng.exponential(12, n_rows), 1, 100).astype(int)
+    days = rng.integers(0, (LAST_LODGEMENT - FIRST_LODGEMENT).astype(int), n_rows)
+    lodgement_dates = (FIRST_LODGEMENT + days).astype(str).astype(object)
+    # A few certificates have no lodgement date
+    lodgement_dates[rng.random(n_rows) < 0.001] = None
+    floor_area = rng.lognormal(4.4, 0.4, n_rows).round(1)
+    energy_consumption = np.clip(rng.normal(330 - 2.5 * efficiency, 40), 5, None)
+    return pd.DataFrame(
+        {
+            "LOCAL_AUTHORITY": codes[la_positions],
+            "CURRENT_ENERGY_RATING": _ratings(efficiency),
+            "POTENTIAL_ENERGY_RATING": _ratings(potential),
+            "CURRENT_ENERGY_EFFICIENCY": efficiency,
+            "POTENTIAL_ENERGY_EFFICIENCY": potential,
+            "TENURE": rng.choice(TENURES, n_rows, p=TENURE_WEIGHTS),
+            "LODGEMENT_DATE": lodgement_dates,
+            "CO2_EMISS_CURR_PER_FLOOR_AREA": (energy_consumption * 0.18).round(),
+            "ENERGY_CONSUMPTION_CURRENT": energy_consumption.round(),
+            "TOTAL_FLOOR_AREA": floor_area,
+        }
+    )
+
+
+def _ratings(efficiency):
+    """EPC ratings (A-G) for an array of energy efficiency scores."""
+    ratings = np.full(len(efficiency), "G", dtype=object)
+    for bound, rating in RATING_BOUNDS[::-1]:
+        ratings[efficiency >= bound] = rating
+    return ratings
+
+
+def write_epc(directory, las, n_rows, rng, chunksize=500_000):
+    """Writes n_rows synthetic EPCs for the lower tier LAs, in chunks of
+    chunksize rows, with the row number in an unnamed first column.
+    LAs have EPCs in proportion to their number of households.
+    """
+    lower_las = las.loc[las["tier"].isin(LOWER_TIERS)]
+    codes = lower_las["code"].to_numpy()
+    weights = lower_las["total_households"].to_numpy(dtype=float)
+    mean_efficiencies = rng.uniform(55, 72, len(codes))
+    path = directory / "epc.csv"
+    for start in range(0, max(n_rows, 1), chunksize):
+        chunk = epc_chunk(
+            codes, weights, mean_efficiencies, min(chunksize, n_rows - start), rng
+        )
+        chunk.index = np.arange(start, start + len(chunk))
+        chunk.to_csv(
+            path,
+            mode="w" if start == 0 else "a",
+            header=start == 0,
+        )
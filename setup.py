@@ -19,6 +19,7 @@ setup(
     install_requires=read_lines(BASE_DIR / "requirements.txt"),
     extras_require={"dev": read_lines(BASE_DIR / "requirements_dev.txt")},
     packages=find_packages(exclude=["docs"]),
+    entry_points={"console_scripts": ["la-funding=la_funding_analysis.cli:app"]},
     version="0.1.0",
     description="An analysis of local authorities receiving environmental housing grants.",
     author="Chris Williamson",
@@ -0,0 +1,24 @@
+"""Tests that CLI commands which don't need the data start quickly, without
+importing pandas, matplotlib or numpy (see benchmarks/cli_startup.py).
+"""
+
+import pytest
+
+from la_funding_analysis.benchmarks.cli_startup import (
+    FAST_COMMANDS,
+    MAX_SECONDS,
+    heavy_imports,
+    time_command,
+)
+
+
+@pytest.mark.parametrize("args", FAST_COMMANDS, ids=" ".join)
+def test_fast_command_has_no_heavy_imports(args):
+    """Running the command imports none of the heavy modules."""
+    assert heavy_imports(args) == ""
+
+
+@pytest.mark.parametrize("args", FAST_COMMANDS, ids=" ".join)
+def test_fast_command_starts_quickly(args):
+    """The command's median start-up time is under MAX_SECONDS."""
+    assert time_command(args, repeats=3) < MAX_SECONDS